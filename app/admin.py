@@ -1,7 +1,23 @@
-from django.contrib import admin
+import io
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.utils.html import format_html
 
+from .exports import CONTENT_TYPES, FORMATS, export_filename, export_stream, order_queryset
+from .importer import detect_format, import_products, iter_rows
 from .models import Category, Product, Order, OrderItem, Review
+from .ratings import recompute_product_rating
+from .recommendations import apply_order as apply_copurchases
+from .stock import restock
+from .rollups import apply_order
 
 
 @admin.register(Category)
@@ -10,34 +26,143 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ("name",)
 
 
+class RestockForm(forms.Form):
+    quantity = forms.IntegerField(label="Добавить штук", min_value=1)
+
+
+class ProductImportForm(forms.Form):
+    file = forms.FileField(label="Файл CSV или JSONL")
+    format = forms.ChoiceField(
+        label="Формат",
+        choices=(("", "По расширению"), ("csv", "CSV"), ("jsonl", "JSONL")),
+        required=False,
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        upload = cleaned.get("file")
+        if upload and not cleaned.get("format"):
+            try:
+                cleaned["format"] = detect_format(upload.name)
+            except ValueError as exc:
+                raise forms.ValidationError(str(exc))
+        return cleaned
+
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "category", "price", "preview")
+    list_display = ("id", "name", "category", "price", "stock", "rating_avg", "rating_count", "preview")
     list_filter = ("category",)
-    search_fields = ("name", "category__name")
+    search_fields = ("name", "external_id", "category__name")
+    change_list_template = "admin/app/product/change_list.html"
+    actions = ("restock_action",)
 
     fieldsets = (
         ("Основная информация", {
-            "fields": ("name", "category", "description"),
+            "fields": ("name", "category", "description", "external_id"),
         }),
-        ("Цена", {
-            "fields": ("price",),
+        ("Цена и остаток", {
+            "fields": ("price", "stock"),
         }),
         ("Изображение", {
             "fields": ("photo",),
         }),
     )
 
+    def get_readonly_fields(self, request, obj=None):
+        # Начальный остаток задаётся при создании, дальше — только
+        # действием «Пополнить остатки» (F-выражение): значение из формы
+        # затёрло бы списания checkout, сделанные пока форма была открыта.
+        if obj is not None:
+            return ("stock",)
+        return ()
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # Только поля формы: stock, рейтинг и очки популярности
+            # меняются своими UPDATE и не перезаписываются старыми значениями.
+            obj.save(update_fields=list(form.fields))
+        else:
+            super().save_model(request, obj, form, change)
+
     def preview(self, obj):
         if obj.photo:
             return format_html(
                 "<img src='{}' style='height:60px;border-radius:10px;object-fit:cover;'>",
-                obj.photo.url,
+                obj.photo_urls["thumb"],
             )
         return "—"
 
     preview.short_description = "Фото"
 
+    @admin.action(description="Пополнить остатки", permissions=["change"])
+    def restock_action(self, request, queryset):
+        form = RestockForm(request.POST if "apply" in request.POST else None)
+        if form.is_valid():
+            count = restock(queryset, form.cleaned_data["quantity"])
+            self.message_user(
+                request,
+                f"Остатки пополнены на {form.cleaned_data['quantity']} шт. у {count} товаров.",
+                messages.SUCCESS,
+            )
+            return None
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "queryset": queryset,
+            "action_checkbox_name": ACTION_CHECKBOX_NAME,
+            "title": "Пополнить остатки",
+        }
+        return TemplateResponse(request, "admin/app/product/restock.html", context)
+
+    def get_urls(self):
+        urls = [
+            path(
+                "import/",
+                self.admin_site.admin_view(self.import_view),
+                name="app_product_import",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def import_view(self, request):
+        """
+        Загрузка файла импорта. Изображения берутся из каталога
+        settings.PRODUCT_IMPORT_IMAGES_DIR, если он задан.
+        """
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            upload = form.cleaned_data["file"]
+            stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+            stats = import_products(
+                iter_rows(stream, form.cleaned_data["format"]),
+                images_dir=getattr(settings, "PRODUCT_IMPORT_IMAGES_DIR", None),
+            )
+            self.message_user(
+                request,
+                f"Импорт за {stats.elapsed:.1f} с: создано {stats.created}, "
+                f"обновлено {stats.updated}, без изменений {stats.unchanged}, "
+                f"пропущено {stats.skipped}.",
+                messages.SUCCESS,
+            )
+            for line, message in stats.errors[:20]:
+                prefix = f"Строка {line}: " if line else ""
+                self.message_user(request, f"{prefix}{message}", messages.WARNING)
+            return redirect("admin:app_product_changelist")
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "title": "Импорт товаров",
+        }
+        return TemplateResponse(request, "admin/app/product/import.html", context)
+
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
@@ -45,11 +170,76 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
 
 
+class OrderExportForm(forms.Form):
+    date_from = forms.DateField(label="С даты", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    date_to = forms.DateField(label="По дату", required=False, widget=forms.DateInput(attrs={"type": "date"}))
+    status = forms.ChoiceField(
+        label="Статус",
+        choices=(("", "Все"),) + Order.STATUS_CHOICES,
+        required=False,
+    )
+    format = forms.ChoiceField(label="Формат", choices=[(f, f.upper()) for f in FORMATS])
+    gzip = forms.BooleanField(label="Сжать gzip", required=False)
+
+    def clean(self):
+        cleaned = super().clean()
+        date_from, date_to = cleaned.get("date_from"), cleaned.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError("Начало периода позже конца.")
+        return cleaned
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "total_price", "status", "created_at")
     list_filter = ("status", "created_at")
+    list_select_related = ("user",)
     inlines = [OrderItemInline]
+    change_list_template = "admin/app/order/change_list.html"
+
+    def get_urls(self):
+        urls = [
+            path(
+                "export/",
+                self.admin_site.admin_view(self.export_view),
+                name="app_order_export",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def export_view(self, request):
+        """
+        Форма выгрузки; с параметрами в GET отдаёт файл потоком.
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        form = OrderExportForm(request.GET or None)
+        if form.is_valid():
+            data = form.cleaned_data
+            qs = order_queryset(data["date_from"], data["date_to"], data["status"])
+            response = StreamingHttpResponse(
+                export_stream(qs, data["format"], gzip=data["gzip"]),
+                content_type="application/gzip" if data["gzip"] else CONTENT_TYPES[data["format"]],
+            )
+            filename = export_filename(data["format"], data["date_from"], data["date_to"], data["gzip"])
+            response["Content-Disposition"] = f'attachment; filename="{filename}"'
+            return response
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "form": form,
+            "title": "Выгрузка заказов",
+        }
+        return TemplateResponse(request, "admin/app/order/export.html", context)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Смену статуса учитывает сигнал, а новый заказ — только когда есть позиции.
+        if not change and form.instance.status == "completed":
+            apply_order(form.instance)
+            apply_copurchases(form.instance)
 
 
 @admin.register(Review)
@@ -57,3 +247,22 @@ class ReviewAdmin(admin.ModelAdmin):
     list_display = ("id", "product", "user", "rating", "created_at")
     list_filter = ("rating", "created_at")
     search_fields = ("product__name", "user__username")
+
+    def save_model(self, request, obj, form, change):
+        old_product_id = None
+        if change and "product" in form.changed_data:
+            old_product_id = form.initial.get("product")
+        super().save_model(request, obj, form, change)
+        recompute_product_rating(obj.product_id)
+        if old_product_id:
+            recompute_product_rating(old_product_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        recompute_product_rating(obj.product_id)
+
+    def delete_queryset(self, request, queryset):
+        product_ids = set(queryset.values_list("product_id", flat=True))
+        super().delete_queryset(request, queryset)
+        for product_id in product_ids:
+            recompute_product_rating(product_id)
@@ -0,0 +1,460 @@
+"""
+Аналитика заказов по колоночному снимку (NumPy).
+
+Снимок — каталог ANALYTICS_SNAPSHOT_DIR с «сырыми» бинарными колонками
+(orders.<колонка>.<поколение>.bin, items...) и meta.json с числом строк.
+Колонки открываются через np.memmap и считаются векторно, без ORM;
+результаты запоминаются до следующего обновления снимка.
+
+Обновление — refresh_snapshot(): дописывает в конец колонок заказы
+с id больше последнего выгруженного (keyset-пачками, как app.exports).
+У .npy форма записана в заголовке, а сырую колонку можно дописывать
+на месте — форму задаёт meta.json. Сначала пишутся данные, затем
+meta.json (атомарной заменой), поэтому читатель никогда не видит
+недописанных строк.
+
+Смену статуса уже выгруженных заказов догоняет refresh_snapshot(full=True):
+он строит новое поколение файлов рядом и переключает meta.json, старые
+файлы удаляются — открытые memmap-ы читателей остаются валидными.
+
+Даты в снимке — номера дня и месяца в TIME_ZONE проекта, деньги —
+в копейках. NumPy — необязательная зависимость: без неё available()
+ложно и API аналитики не подключается.
+"""
+import json
+import os
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .models import Category, Order, OrderItem
+
+
+SNAPSHOT_DIR = getattr(settings, "ANALYTICS_SNAPSHOT_DIR", settings.BASE_DIR / "analytics")
+CHUNK_SIZE = 5000
+FORMAT_VERSION = 1
+
+STATUS_CODES = {"pending": 0, "completed": 1, "cancelled": 2}
+COMPLETED = STATUS_CODES["completed"]
+
+ORDER_COLUMNS = {
+    "id": "<i8",
+    "user_id": "<i8",   # 0 — гость
+    "status": "<i1",
+    "day": "<i4",       # дней от 1970-01-01, локальная дата
+    "month": "<i4",     # год * 12 + месяц - 1, локальный
+    "total": "<i8",     # копейки
+    "units": "<i4",
+    "lines": "<i4",
+}
+ITEM_COLUMNS = {
+    "order_id": "<i8",
+    "product_id": "<i8",
+    "category_id": "<i8",
+    "status": "<i1",    # копия из заказа — фильтр без join
+    "day": "<i4",
+    "quantity": "<i4",
+    "revenue": "<i8",   # копейки
+}
+TABLES = {"orders": ORDER_COLUMNS, "items": ITEM_COLUMNS}
+
+EPOCH = date(1970, 1, 1).toordinal()
+BASKET_BINS = 20
+PERCENTILES = (10, 25, 50, 75, 90, 95, 99)
+
+
+def available():
+    return np is not None
+
+
+def _cents(value):
+    return int(round(value * 100))
+
+
+def _local_day(dt):
+    return timezone.localtime(dt).date().toordinal() - EPOCH
+
+
+def _month_index(dt):
+    local = timezone.localtime(dt)
+    return local.year * 12 + local.month - 1
+
+
+def _month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+# --- снимок на диске ---
+
+def _column_path(directory, table, name, generation):
+    return os.path.join(directory, f"{table}.{name}.{generation}.bin")
+
+
+def _meta_path(directory):
+    return os.path.join(directory, "meta.json")
+
+
+def read_meta(directory=None):
+    directory = directory or SNAPSHOT_DIR
+    try:
+        with open(_meta_path(directory)) as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == FORMAT_VERSION else None
+
+
+def _write_meta(directory, meta):
+    tmp = _meta_path(directory) + ".tmp"
+    with open(tmp, "w") as fh:
+        json.dump(meta, fh)
+    os.replace(tmp, _meta_path(directory))
+
+
+def _truncate(directory, meta):
+    """
+    Обрезает колонки до числа строк из meta: хвост после прерванного
+    обновления не должен попасть в следующую дозапись.
+    """
+    for table, columns in TABLES.items():
+        for name, dtype in columns.items():
+            path = _column_path(directory, table, name, meta["generation"])
+            size = meta[table] * np.dtype(dtype).itemsize
+            with open(path, "ab") as fh:
+                fh.truncate(size)
+
+
+def _iter_chunks(last_id, chunk_size):
+    """
+    Пачки (orders, items) с id > last_id: на пачку — запрос заказов
+    с агрегатами позиций и запрос самих позиций.
+    """
+    orders_qs = (
+        Order.objects.order_by("id")
+        .annotate(units=Sum("items__quantity"), lines=Count("items"))
+        .values_list("id", "user_id", "status", "created_at", "total_price", "units", "lines")
+    )
+    while True:
+        orders = list(orders_qs.filter(id__gt=last_id)[:chunk_size])
+        if not orders:
+            return
+        last_id = orders[-1][0]
+        items = list(
+            OrderItem.objects.filter(order_id__in=[o[0] for o in orders])
+            .order_by("order_id", "id")
+            .values_list("order_id", "product_id", "product__category_id", "quantity", "unit_price")
+        )
+        yield orders, items
+
+
+def _order_columns(orders):
+    return {
+        "id": [o[0] for o in orders],
+        "user_id": [o[1] or 0 for o in orders],
+        "status": [STATUS_CODES.get(o[2], -1) for o in orders],
+        "day": [_local_day(o[3]) for o in orders],
+        "month": [_month_index(o[3]) for o in orders],
+        "total": [_cents(o[4]) for o in orders],
+        "units": [o[5] or 0 for o in orders],
+        "lines": [o[6] for o in orders],
+    }
+
+
+def _item_columns(items, orders):
+    by_order = {o[0]: (STATUS_CODES.get(o[2], -1), _local_day(o[3])) for o in orders}
+    return {
+        "order_id": [i[0] for i in items],
+        "product_id": [i[1] for i in items],
+        "category_id": [i[2] for i in items],
+        "status": [by_order[i[0]][0] for i in items],
+        "day": [by_order[i[0]][1] for i in items],
+        "quantity": [i[3] for i in items],
+        "revenue": [_cents(i[3] * i[4]) for i in items],
+    }
+
+
+def _append(directory, meta, table, values):
+    for name, dtype in TABLES[table].items():
+        with open(_column_path(directory, table, name, meta["generation"]), "ab") as fh:
+            fh.write(np.asarray(values[name], dtype=dtype).tobytes())
+
+
+def _new_generation(directory, previous):
+    generation = previous["generation"] + 1 if previous else 1
+    for table, columns in TABLES.items():
+        for name in columns:
+            open(_column_path(directory, table, name, generation), "wb").close()
+    return {
+        "format": FORMAT_VERSION,
+        "generation": generation,
+        "orders": 0,
+        "items": 0,
+        "last_order_id": 0,
+        "version": previous["version"] + 1 if previous else 1,
+    }
+
+
+def _remove_generation(directory, generation):
+    for table, columns in TABLES.items():
+        for name in columns:
+            try:
+                os.remove(_column_path(directory, table, name, generation))
+            except FileNotFoundError:
+                pass
+
+
+def refresh_snapshot(directory=None, full=False, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Дописывает новые заказы в снимок (full=True или снимка нет — строит
+    новое поколение и переключается на него в конце). Возвращает meta.
+    progress(meta) вызывается после каждой пачки.
+    """
+    if not available():
+        raise RuntimeError("NumPy is required for the analytics snapshot")
+    directory = str(directory or SNAPSHOT_DIR)
+    os.makedirs(directory, exist_ok=True)
+
+    previous = read_meta(directory)
+    rebuild = full or previous is None
+    if rebuild:
+        meta = _new_generation(directory, previous)
+    else:
+        meta = dict(previous)
+        _truncate(directory, meta)
+
+    for orders, items in _iter_chunks(meta["last_order_id"], chunk_size):
+        _append(directory, meta, "orders", _order_columns(orders))
+        _append(directory, meta, "items", _item_columns(items, orders))
+        meta.update(
+            orders=meta["orders"] + len(orders),
+            items=meta["items"] + len(items),
+            last_order_id=orders[-1][0],
+            version=meta["version"] + 1,
+        )
+        meta["built_at"] = timezone.now().isoformat()
+        # Новое поколение показываем читателям только целиком.
+        if not rebuild:
+            _write_meta(directory, meta)
+        if progress:
+            progress(meta)
+
+    if rebuild:
+        meta.setdefault("built_at", timezone.now().isoformat())
+        _write_meta(directory, meta)
+        if previous is not None:
+            _remove_generation(directory, previous["generation"])
+    return meta
+
+
+class Snapshot:
+    """
+    Колонки снимка (memmap, только чтение) и запомненные результаты.
+    """
+
+    def __init__(self, directory, meta):
+        self.meta = meta
+        self.results = {}
+        self.orders = self._open(directory, "orders", meta)
+        self.items = self._open(directory, "items", meta)
+
+    @staticmethod
+    def _open(directory, table, meta):
+        rows = meta[table] if meta else 0
+        columns = {}
+        for name, dtype in TABLES[table].items():
+            if rows:
+                columns[name] = np.memmap(
+                    _column_path(directory, table, name, meta["generation"]),
+                    dtype=dtype, mode="r", shape=(rows,),
+                )
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        return columns
+
+    def memo(self, key, compute):
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+
+_snapshot = None
+
+
+def load_snapshot(directory=None):
+    """
+    Снимок текущей версии. Открывается заново, только когда
+    refresh_snapshot записал новую meta.json.
+    """
+    global _snapshot
+    directory = str(directory or SNAPSHOT_DIR)
+    meta = read_meta(directory)
+    key = (directory, snapshot_version(meta))
+    if _snapshot is None or _snapshot[0] != key:
+        try:
+            snapshot = Snapshot(directory, meta)
+        except FileNotFoundError:
+            # Полный пересчёт только что заменил поколение — берём новое.
+            meta = read_meta(directory)
+            key = (directory, snapshot_version(meta))
+            snapshot = Snapshot(directory, meta)
+        _snapshot = (key, snapshot)
+    return _snapshot[1]
+
+
+def snapshot_version(meta):
+    return (meta["generation"], meta["version"]) if meta else (0, 0)
+
+
+# --- расчёты ---
+
+def _since_day(days):
+    if days is None:
+        return None
+    return _local_day(timezone.now() - timedelta(days=days)) + 1
+
+
+def _completed(table, since_day):
+    mask = table["status"] == COMPLETED
+    if since_day is not None:
+        mask &= table["day"] >= since_day
+    return mask
+
+
+def cohort_retention(snapshot, months=12):
+    """
+    Когорты по месяцу первой покупки (только зарегистрированные):
+    доля покупателей когорты, купивших снова через 0..months-1 месяцев.
+    """
+    def compute():
+        orders = snapshot.orders
+        mask = _completed(orders, None) & (orders["user_id"] > 0)
+        users = np.asarray(orders["user_id"][mask])
+        month = np.asarray(orders["month"][mask])
+        if not users.size:
+            return {"months": months, "cohorts": []}
+
+        # Сортировка по (покупатель, месяц) — один sort упакованного ключа,
+        # он заметно быстрее lexsort по двум колонкам.
+        key = np.sort(users.astype(np.int64) << 32 | month.astype(np.int64))
+        users, month = key >> 32, (key & 0xFFFFFFFF).astype(np.int32)
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+        first = np.repeat(month[starts], np.diff(np.r_[starts, users.size]))
+        offset = month - first
+
+        # Один покупатель считается в ячейке (когорта, смещение) один раз.
+        unique = np.r_[True, (users[1:] != users[:-1]) | (offset[1:] != offset[:-1])]
+        current = _month_index(timezone.now())
+        oldest = current - months + 1
+        keep = unique & (first >= oldest) & (offset < months)
+
+        cohort = first[keep] - oldest
+        matrix = np.bincount(
+            cohort * months + offset[keep], minlength=months * months,
+        ).reshape(months, months)
+
+        cohorts = []
+        for index in range(months):
+            size = int(matrix[index, 0])
+            if not size:
+                continue
+            observed = current - (oldest + index) + 1
+            cohorts.append({
+                "month": _month_label(oldest + index),
+                "size": size,
+                "retention": [round(float(n) / size, 4) for n in matrix[index, :observed]],
+            })
+        return {"months": months, "cohorts": cohorts}
+
+    return snapshot.memo(("cohorts", months, _month_index(timezone.now())), compute)
+
+
+def basket_sizes(snapshot, days=None):
+    """
+    Распределение заказов по числу штук (последний столбец — BASKET_BINS и больше).
+    """
+    def compute():
+        mask = _completed(snapshot.orders, _since_day(days))
+        units = np.asarray(snapshot.orders["units"][mask])
+        lines = np.asarray(snapshot.orders["lines"][mask])
+        counts = np.bincount(np.clip(units, 1, BASKET_BINS), minlength=BASKET_BINS + 1)[1:]
+        labels = [str(n) for n in range(1, BASKET_BINS)] + [f"{BASKET_BINS}+"]
+        return {
+            "labels": labels,
+            "orders": counts.tolist(),
+            "mean_units": round(float(units.mean()), 2) if units.size else 0,
+            "median_units": float(np.median(units)) if units.size else 0,
+            "mean_lines": round(float(lines.mean()), 2) if lines.size else 0,
+        }
+
+    return snapshot.memo(("baskets", _since_day(days)), compute)
+
+
+def revenue_percentiles(snapshot, days=None):
+    """
+    Перцентили суммы заказа (₽), плюс число заказов, выручка и средний чек.
+    """
+    def compute():
+        mask = _completed(snapshot.orders, _since_day(days))
+        totals = np.asarray(snapshot.orders["total"][mask]) / 100
+        if not totals.size:
+            return {"count": 0, "revenue": 0, "mean": 0, "percentiles": {str(p): 0 for p in PERCENTILES}}
+        values = np.percentile(totals, PERCENTILES)
+        return {
+            "count": int(totals.size),
+            "revenue": round(float(totals.sum()), 2),
+            "mean": round(float(totals.mean()), 2),
+            "percentiles": {str(p): round(float(v), 2) for p, v in zip(PERCENTILES, values)},
+        }
+
+    return snapshot.memo(("revenue", _since_day(days)), compute)
+
+
+def category_mix(snapshot, days=None):
+    """
+    Выручка и штуки по категориям с долями, по убыванию выручки.
+    Названия категорий — один запрос.
+    """
+    def compute():
+        mask = _completed(snapshot.items, _since_day(days))
+        categories = np.asarray(snapshot.items["category_id"][mask])
+        if not categories.size:
+            return []
+        # id категорий небольшие и плотные — bincount по самим id без сортировки.
+        revenue = np.bincount(categories, weights=snapshot.items["revenue"][mask]) / 100
+        units = np.bincount(categories, weights=snapshot.items["quantity"][mask])
+        ids = np.flatnonzero(units)
+        return [
+            (int(i), float(revenue[i]), int(units[i]))
+            for i in ids[np.argsort(-revenue[ids], kind="stable")]
+        ]
+
+    rows = snapshot.memo(("categories", _since_day(days)), compute)
+    total = sum(revenue for _, revenue, _ in rows)
+    names = Category.objects.in_bulk([category_id for category_id, _, _ in rows])
+    return [
+        {
+            "category_id": category_id,
+            "name": names[category_id].name if category_id in names else None,
+            "revenue": round(revenue, 2),
+            "units": units,
+            "share": round(revenue / total, 4) if total else 0,
+        }
+        for category_id, revenue, units in rows
+    ]
+
+
+def snapshot_info(snapshot):
+    meta = snapshot.meta or {}
+    return {
+        "orders": meta.get("orders", 0),
+        "items": meta.get("items", 0),
+        "built_at": meta.get("built_at"),
+    }
+
@@ -1,13 +1,62 @@
+from django.conf import settings
 from django.urls import path
-from . import api_views
+from . import analytics, api_views, async_api_views
+
+ASYNC_CART_VIEWS = {
+    "list": async_api_views.cart_list,
+    "add": async_api_views.cart_add,
+    "update": async_api_views.cart_update_qty,
+    "clear": async_api_views.cart_clear,
+    "batch": async_api_views.cart_batch,
+    "order": async_api_views.order_create,
+}
+
+SYNC_CART_VIEWS = {
+    "list": api_views.CartListAPIView.as_view(),
+    "add": api_views.CartAddAPIView.as_view(),
+    "update": api_views.CartUpdateQtyAPIView.as_view(),
+    "clear": api_views.CartClearAPIView.as_view(),
+    "batch": api_views.CartBatchAPIView.as_view(),
+    "order": api_views.OrderCreateAPIView.as_view(),
+}
+
+
+def cart_urlpatterns(views):
+    return [
+        path("cart/", views["list"], name="api-cart-list"),
+        path("cart/add/", views["add"], name="api-cart-add"),
+        path("cart/update_qty/", views["update"], name="api-cart-update"),
+        path("cart/clear/", views["clear"], name="api-cart-clear"),
+        path("cart/batch/", views["batch"], name="api-cart-batch"),
+        path("orders/create/", views["order"], name="api-order-create"),
+    ]
+
+
+cart_views = ASYNC_CART_VIEWS if getattr(settings, "ASYNC_CART_API", False) else SYNC_CART_VIEWS
 
 urlpatterns = [
     path("products/", api_views.ProductListAPIView.as_view(), name="api-products"),
-    path("cart/", api_views.CartListAPIView.as_view(), name="api-cart-list"),
-    path("cart/add/", api_views.CartAddAPIView.as_view(), name="api-cart-add"),
-    path("cart/update_qty/", api_views.CartUpdateQtyAPIView.as_view(), name="api-cart-update"),
-    path("cart/clear/", api_views.CartClearAPIView.as_view(), name="api-cart-clear"),
-    path("orders/create/", api_views.OrderCreateAPIView.as_view(), name="api-order-create"),
+    path("products/facets/", api_views.ProductFacetsAPIView.as_view(), name="api-product-facets"),
+    path(
+        "products/<int:pk>/recommendations/",
+        api_views.ProductRecommendationsAPIView.as_view(),
+        name="api-product-recommendations",
+    ),
+    *cart_urlpatterns(cart_views),
+    path("auth/login/", api_views.LoginAPIView.as_view(), name="api-login"),
     path("stats/sales/", api_views.SalesStatsAPIView.as_view(), name="api-stats-sales"),
     path("stats/categories/", api_views.CategoriesStatsAPIView.as_view(), name="api-stats-categories"),
 ]
+
+# Аналитика по снимку заказов — только если установлен NumPy.
+if analytics.available():
+    urlpatterns += [
+        path("analytics/cohorts/", api_views.AnalyticsCohortsAPIView.as_view(), name="api-analytics-cohorts"),
+        path("analytics/baskets/", api_views.AnalyticsBasketsAPIView.as_view(), name="api-analytics-baskets"),
+        path("analytics/revenue/", api_views.AnalyticsRevenueAPIView.as_view(), name="api-analytics-revenue"),
+        path(
+            "analytics/categories/",
+            api_views.AnalyticsCategoriesAPIView.as_view(),
+            name="api-analytics-categories",
+        ),
+    ]
@@ -1,239 +1,426 @@
 # app/api_views.py
-from datetime import timedelta
-
-from django.db.models import Sum, F
-from django.db.models.functions import TruncDate
-from django.shortcuts import get_object_or_404
-from django.utils import timezone
+from django.contrib.auth import authenticate
+from django.http import Http404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status, permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Product, CartItem, Order, OrderItem
+from .analytics import (
+    basket_sizes,
+    category_mix,
+    cohort_retention,
+    load_snapshot,
+    revenue_percentiles,
+    snapshot_info,
+)
+from .cart import (
+    cart_owner,
+    cart_queryset,
+    get_cart_summary,
+    invalidate_cart_summary,
+    login_with_cart,
+    refresh_cart_summary,
+)
+from .catalog import (
+    InvalidCursor,
+    build_catalog_queryset,
+    keyset_page,
+    ordered_categories,
+    parse_catalog_params,
+    parse_page_size,
+)
+from .cartops import (
+    CART_STEPS,
+    CartOpError,
+    add_line,
+    apply_cart_ops,
+    parse_quantity,
+    step_line,
+)
+from .checkout import EmptyCart, create_order_from_cart
+from .facets import catalog_facets
+from .guests import ensure_guest_token, guest_token
+from .conditional import (
+    analytics_etag,
+    catalog_api_etag,
+    catalog_last_modified,
+    recommendations_etag,
+    stats_etag,
+    stats_last_modified,
+)
+from .models import CartItem, Product
+from .querybudget import query_budget
+from .recommendations import recommended_products
+from .rollups import GRANULARITIES, category_revenue, sales_series
 from .serializers import ProductSerializer, CartItemSerializer
+from .stock import OutOfStock
 
 
-def get_session_key(request):
+@query_budget(max_queries=5)
+class ProductListAPIView(APIView):
     """
-    Гарантированно получаем session_key для гостя.
+    /api/products/ — те же q, min_price, max_price, category и sort, что в каталоге.
+    С ?cursor= или ?page_size= включается keyset-пагинация:
+    {"results": [...], "next": "<url>" | null}.
     """
-    if not request.session.session_key:
-        request.session.create()
-    return request.session.session_key
+    permission_classes = (permissions.AllowAny,)
+
+    @method_decorator(condition(etag_func=catalog_api_etag, last_modified_func=catalog_last_modified))
+    def get(self, request):
+        qs, filters = build_catalog_queryset(request.query_params)
+
+        params = request.query_params
+        if "cursor" not in params and "page_size" not in params:
+            serializer = ProductSerializer(qs, many=True, context={"request": request})
+            return Response(serializer.data)
+
+        try:
+            items, next_cursor = keyset_page(
+                qs,
+                filters["sort"],
+                cursor=params.get("cursor"),
+                page_size=parse_page_size(params.get("page_size")),
+            )
+        except InvalidCursor:
+            return Response(
+                {"error": "invalid cursor"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
+        next_url = None
+        if next_cursor:
+            query = params.copy()
+            query["cursor"] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
 
-class ProductListAPIView(APIView):
+        serializer = ProductSerializer(items, many=True, context={"request": request})
+        return Response({"results": serializer.data, "next": next_url})
+
+
+@query_budget(max_queries=5)
+class ProductFacetsAPIView(APIView):
+    """
+    /api/products/facets/ — счётчики по категориям и ценовым диапазонам
+    для тех же параметров, что у /api/products/:
+    {"total": n, "categories": [...], "price": [...]}.
+    """
     permission_classes = (permissions.AllowAny,)
 
+    @method_decorator(condition(etag_func=catalog_api_etag, last_modified_func=catalog_last_modified))
     def get(self, request):
-        qs = Product.objects.all()
-        serializer = ProductSerializer(qs, many=True, context={"request": request})
+        filters = parse_catalog_params(request.query_params)
+        return Response(catalog_facets(filters, ordered_categories(filters["sort"])))
+
+
+@query_budget(max_queries=4)
+class ProductRecommendationsAPIView(APIView):
+    """
+    /api/products/<pk>/recommendations/ — «часто покупают вместе»:
+    готовый top-K из app.recommendations, без расчёта по заказам.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    @method_decorator(condition(etag_func=recommendations_etag))
+    def get(self, request, pk):
+        products = recommended_products(pk)
+        if not products and not Product.objects.filter(pk=pk).exists():
+            raise Http404
+        serializer = ProductSerializer(products, many=True, context={"request": request})
         return Response(serializer.data)
 
 
+@query_budget(max_queries=5)
 class CartListAPIView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def get(self, request):
-        if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user).select_related("product")
-        else:
-            session_key = get_session_key(request)
-            items = CartItem.objects.filter(
-                session_key=session_key,
-                user__isnull=True,
-            ).select_related("product")
+        # Гостю без токена — пустая корзина, ничего не создаём.
+        items = cart_queryset(*cart_owner(request)).select_related("product")
 
         serializer = CartItemSerializer(items, many=True)
         cart_total = sum([i.total_price for i in items]) if items else 0
         return Response({"items": serializer.data, "cart_total": float(cart_total)})
 
 
+@query_budget(max_queries=8)
 class CartAddAPIView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def post(self, request):
-        product_id = request.data.get("product_id")
-        qty = int(request.data.get("qty", 1))
-        product = get_object_or_404(Product, id=product_id)
+        try:
+            qty = parse_quantity(request.data.get("qty", 1))
+        except CartOpError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
         if request.user.is_authenticated:
-            obj, created = CartItem.objects.get_or_create(
-                user=request.user,
-                product=product,
-                session_key=None,
-                defaults={"quantity": qty},
-            )
+            user_id, session_key = request.user.pk, None
         else:
-            session_key = get_session_key(request)
-            obj, created = CartItem.objects.get_or_create(
-                session_key=session_key,
-                user=None,
-                product=product,
-                defaults={"quantity": qty},
-            )
+            user_id, session_key = None, ensure_guest_token(request)
 
-        if not created:
-            obj.quantity += qty
-            obj.save()
+        line = add_line(user_id, session_key, request.data.get("product_id"), qty)
+        if line is None:
+            raise Http404
 
-        if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user)
-        else:
-            items = CartItem.objects.filter(
-                session_key=get_session_key(request),
-                user__isnull=True,
+        summary = refresh_cart_summary(user_id, session_key)
+        return Response({
+            "success": True,
+            "new_qty": line.quantity,
+            "cart_total": float(summary["total"]),
+        })
+
+
+@query_budget(max_queries=8)
+class CartUpdateQtyAPIView(APIView):
+    """
+    /api/cart/update_qty/ — {"item_id", "action": "increase" | "decrease"}
+    для строки корзины текущего посетителя.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def post(self, request):
+        delta = CART_STEPS.get(request.data.get("action"))
+        if delta is None:
+            return Response(
+                {"error": "action must be increase or decrease"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-        cart_total = sum([i.total_price for i in items])
 
-        return Response({"success": True, "cart_total": float(cart_total)})
+        user_id, session_key = cart_owner(request)
+        line = step_line(user_id, session_key, request.data.get("item_id"), delta)
+        if line is None:
+            raise Http404
 
+        summary = refresh_cart_summary(user_id, session_key)
+        if not line.quantity:
+            return Response({"success": True, "deleted": True, "cart_total": float(summary["total"])})
+        return Response({
+            "success": True,
+            "new_qty": line.quantity,
+            "item_total": float(line.quantity * line.unit_price),
+            "cart_total": float(summary["total"]),
+        })
 
-class CartUpdateQtyAPIView(APIView):
+
+@query_budget(max_queries=9)
+class CartBatchAPIView(APIView):
+    """
+    /api/cart/batch/ — пакет операций {"ops": [...]} (см. app.cartops),
+    применяется атомарно. Ответ: строки с суммами и итог корзины.
+    """
     permission_classes = (permissions.AllowAny,)
 
     def post(self, request):
-        item_id = request.data.get("item_id")
-        action = request.data.get("action")
-        item = get_object_or_404(CartItem, id=item_id)
-
-        if action == "increase":
-            item.quantity += 1
-            item.save()
-        elif action == "decrease":
-            if item.quantity > 1:
-                item.quantity -= 1
-                item.save()
-            else:
-                item.delete()
-                return Response({"success": True, "deleted": True})
-
-        if item.user:
-            items = CartItem.objects.filter(user=item.user)
+        if request.user.is_authenticated:
+            user_id, session_key = request.user.pk, None
         else:
-            items = CartItem.objects.filter(
-                session_key=item.session_key,
-                user__isnull=True,
-            )
+            user_id, session_key = None, ensure_guest_token(request)
+
+        try:
+            items, summary = apply_cart_ops(user_id, session_key, request.data.get("ops"))
+        except CartOpError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
-        cart_total = sum([i.total_price for i in items])
         return Response({
             "success": True,
-            "new_qty": getattr(item, "quantity", 0),
-            "item_total": float(getattr(item, "total_price", 0)),
-            "cart_total": float(cart_total),
+            "items": [
+                {**item, "line_total": float(item["line_total"])}
+                for item in items
+            ],
+            "cart_count": summary["count"],
+            "cart_total": float(summary["total"]),
         })
 
 
+@query_budget(max_queries=5)
 class CartClearAPIView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def post(self, request):
         if request.user.is_authenticated:
             CartItem.objects.filter(user=request.user).delete()
+            invalidate_cart_summary(user_id=request.user.pk)
         else:
-            session_key = get_session_key(request)
-            CartItem.objects.filter(
-                session_key=session_key,
-                user__isnull=True,
-            ).delete()
+            session_key = guest_token(request)
+            if session_key:
+                CartItem.objects.filter(
+                    session_key=session_key,
+                    user__isnull=True,
+                ).delete()
+                invalidate_cart_summary(session_key=session_key)
         return Response({"success": True})
 
 
+@query_budget(max_queries=19)
 class OrderCreateAPIView(APIView):
     permission_classes = (permissions.AllowAny,)
 
     def post(self, request):
         if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user)
             user = request.user
+            session_key = None
         else:
-            session_key = get_session_key(request)
-            items = CartItem.objects.filter(
-                session_key=session_key,
-                user__isnull=True,
-            )
             user = None
+            session_key = guest_token(request)
 
-        if not items.exists():
+        try:
+            order = create_order_from_cart(user=user, session_key=session_key)
+        except EmptyCart:
             return Response(
                 {"success": False, "error": "cart empty"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-
-        order = Order.objects.create(
-            user=user,
-            status="completed",
-            created_at=timezone.now(),
-        )
-
-        total = 0
-        for i in items:
-            OrderItem.objects.create(
-                order=order,
-                product=i.product,
-                quantity=i.quantity,
-                unit_price=i.product.price,
+        except OutOfStock as exc:
+            return Response(
+                {"success": False, "error": "out of stock", "product_ids": exc.product_ids},
+                status=status.HTTP_409_CONFLICT,
             )
-            total += i.total_price
 
-        order.total_price = total
-        order.save()
-        items.delete()
+        invalidate_cart_summary(getattr(user, "pk", None), session_key)
 
         return Response({"success": True, "order_id": order.id})
 
 
+@query_budget(max_queries=15)
+class LoginAPIView(APIView):
+    """
+    /api/auth/login/ — вход по username/password с переносом гостевой корзины.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def post(self, request):
+        user = authenticate(
+            request,
+            username=(request.data.get("username") or "").strip(),
+            password=request.data.get("password") or "",
+        )
+        if user is None:
+            return Response(
+                {"success": False, "error": "invalid credentials"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        login_with_cart(request, user)
+        return Response({
+            "success": True,
+            "cart_count": get_cart_summary(request)["count"],
+        })
+
+
+@query_budget(max_queries=5)
 class SalesStatsAPIView(APIView):
     """
-    /api/stats/sales/?days=30 — для line-графика по дням.
+    /api/stats/sales/?days=30&granularity=day — для line-графика.
+    granularity: hour, day, week, month (по Asia/Tashkent), данные из SalesRollup.
     Теперь доступно всем (и главная, и админка).
     """
     permission_classes = (permissions.AllowAny,)
 
+    @method_decorator(condition(etag_func=stats_etag, last_modified_func=stats_last_modified))
     def get(self, request):
         days = int(request.query_params.get("days", 30))
-        since = timezone.now() - timedelta(days=days)
-
-        qs = (
-            Order.objects.filter(
-                created_at__gte=since,
-                status="completed",
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in GRANULARITIES:
+            return Response(
+                {"error": f"granularity must be one of {', '.join(GRANULARITIES)}"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            .annotate(day=TruncDate("created_at"))
-            .values("day")
-            .annotate(total=Sum("total_price"))
-            .order_by("day")
-        )
-
-        labels = [entry["day"].strftime("%Y-%m-%d") for entry in qs]
-        values = [float(entry["total"] or 0) for entry in qs]
 
+        labels, values = sales_series(days, granularity)
         return Response({"labels": labels, "values": values})
 
 
+@query_budget(max_queries=5)
 class CategoriesStatsAPIView(APIView):
     """
-    /api/stats/categories/?days=30 — для pie-чарта по категориям.
+    /api/stats/categories/?days=30 — для pie-чарта по категориям (CategorySalesRollup).
     Теперь тоже доступно всем.
     """
     permission_classes = (permissions.AllowAny,)
 
+    @method_decorator(condition(etag_func=stats_etag, last_modified_func=stats_last_modified))
     def get(self, request):
         days = int(request.query_params.get("days", 30))
-        since = timezone.now() - timedelta(days=days)
+        labels, values = category_revenue(days)
+        return Response({"labels": labels, "values": values})
+
+
+def _query_int(request, name, default, maximum):
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        return None
+    return max(1, min(value, maximum))
+
+
+class AnalyticsAPIView(APIView):
+    """
+    Общая часть /api/analytics/*: считается по снимку app.analytics
+    (NumPy, memmap), БД не трогает. Только для персонала.
+    """
+    permission_classes = (permissions.IsAdminUser,)
 
-        qs = (
-            OrderItem.objects.filter(
-                order__created_at__gte=since,
-                order__status="completed",
+    param = "days"
+    default = 90
+    maximum = 3650
+
+    def compute(self, snapshot, value):
+        raise NotImplementedError
+
+    @method_decorator(condition(etag_func=analytics_etag))
+    def get(self, request):
+        value = _query_int(request, self.param, self.default, self.maximum)
+        if value is None:
+            return Response(
+                {"error": f"{self.param} must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            .values("product__category__name")
-            .annotate(revenue=Sum(F("quantity") * F("unit_price")))
-            .order_by("-revenue")
-        )
+        snapshot = load_snapshot()
+        return Response({
+            "results": self.compute(snapshot, value),
+            "snapshot": snapshot_info(snapshot),
+        })
 
-        labels = [entry["product__category__name"] for entry in qs]
-        values = [float(entry["revenue"] or 0) for entry in qs]
 
-        return Response({"labels": labels, "values": values})
+@query_budget(max_queries=3)
+class AnalyticsCohortsAPIView(AnalyticsAPIView):
+    """
+    /api/analytics/cohorts/?months=12 — удержание по месяцу первой покупки.
+    """
+    param = "months"
+    default = 12
+    maximum = 36
+
+    def compute(self, snapshot, months):
+        return cohort_retention(snapshot, months)
+
+
+@query_budget(max_queries=3)
+class AnalyticsBasketsAPIView(AnalyticsAPIView):
+    """
+    /api/analytics/baskets/?days=90 — распределение размера корзины (штук в заказе).
+    """
+
+    def compute(self, snapshot, days):
+        return basket_sizes(snapshot, days)
+
+
+@query_budget(max_queries=3)
+class AnalyticsRevenueAPIView(AnalyticsAPIView):
+    """
+    /api/analytics/revenue/?days=90 — перцентили суммы заказа.
+    """
+
+    def compute(self, snapshot, days):
+        return revenue_percentiles(snapshot, days)
+
+
+@query_budget(max_queries=3)
+class AnalyticsCategoriesAPIView(AnalyticsAPIView):
+    """
+    /api/analytics/categories/?days=90 — доли категорий в выручке и штуках.
+    """
+
+    def compute(self, snapshot, days):
+        return category_mix(snapshot, days)
@@ -0,0 +1,209 @@
+"""
+Асинхронные версии API корзины и оформления заказа для ASGI.
+
+Контракт запросов и ответов тот же, что у классов из api_views:
+JSON или form-data на входе, те же поля на выходе, CSRF проверяется
+только для авторизованных (как SessionAuthentication в DRF).
+Включаются настройкой ASYNC_CART_API = True.
+
+Транзакций и сырых курсоров в async ORM нет, поэтому checkout и
+изменения строк корзины (app.cartops) выполняются через sync_to_async —
+остальное работает без потоков.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.encoders import JSONEncoder
+
+from .cart import ainvalidate_cart_summary, arefresh_cart_summary, cart_queryset
+from .cartops import (
+    CART_STEPS,
+    CartOpError,
+    add_line,
+    apply_cart_ops,
+    parse_quantity,
+    step_line,
+)
+from .checkout import EmptyCart, create_order_from_cart
+from .guests import ensure_guest_token, guest_token
+from .querybudget import query_budget
+from .serializers import CartItemSerializer
+from .stock import OutOfStock
+
+
+def _not_found():
+    # Текст DRF в языке запроса, как у Http404 в api_views.
+    return JsonResponse({"detail": str(NotFound.default_detail)}, status=404)
+
+
+def _payload(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return None
+    return request.POST
+
+
+def _csrf_failure(request):
+    check = CsrfViewMiddleware(lambda req: None)
+    check.process_request(request)
+    response = check.process_view(request, None, (), {})
+    if response is None:
+        return None
+    return JsonResponse({"detail": "CSRF Failed"}, status=403)
+
+
+async def _visitor(request, create_token=False):
+    """
+    (user, session_key) + ответ с ошибкой CSRF, если он нужен.
+    session_key гостя — токен из app.guests.
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        return user, None, _csrf_failure(request) if request.method == "POST" else None
+
+    token = ensure_guest_token(request) if create_token else guest_token(request)
+    return None, token, None
+
+
+@query_budget(max_queries=5)
+@require_GET
+async def cart_list(request):
+    user, session_key, _ = await _visitor(request)
+    qs = cart_queryset(user.pk if user else None, session_key)
+    items = [item async for item in qs.select_related("product")]
+
+    serializer = CartItemSerializer(items, many=True)
+    cart_total = sum(i.total_price for i in items) if items else 0
+    # Энкодер DRF: Decimal из serializer.data — числом, как в CartListAPIView.
+    return JsonResponse(
+        {"items": serializer.data, "cart_total": float(cart_total)},
+        encoder=JSONEncoder,
+    )
+
+
+@query_budget(max_queries=8)
+@csrf_exempt
+@require_POST
+async def cart_add(request):
+    user, session_key, failure = await _visitor(request, create_token=True)
+    if failure:
+        return failure
+    data = _payload(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+
+    try:
+        qty = parse_quantity(data.get("qty", 1))
+    except CartOpError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    user_id = user.pk if user else None
+    line = await sync_to_async(add_line)(user_id, session_key, data.get("product_id"), qty)
+    if line is None:
+        return _not_found()
+
+    summary = await arefresh_cart_summary(user_id, session_key)
+    return JsonResponse({
+        "success": True,
+        "new_qty": line.quantity,
+        "cart_total": float(summary["total"]),
+    })
+
+
+@query_budget(max_queries=8)
+@csrf_exempt
+@require_POST
+async def cart_update_qty(request):
+    user, session_key, failure = await _visitor(request)
+    if failure:
+        return failure
+    data = _payload(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+
+    delta = CART_STEPS.get(data.get("action"))
+    if delta is None:
+        return JsonResponse({"error": "action must be increase or decrease"}, status=400)
+
+    user_id = user.pk if user else None
+    line = await sync_to_async(step_line)(user_id, session_key, data.get("item_id"), delta)
+    if line is None:
+        return _not_found()
+
+    summary = await arefresh_cart_summary(user_id, session_key)
+    if not line.quantity:
+        return JsonResponse({"success": True, "deleted": True, "cart_total": float(summary["total"])})
+    return JsonResponse({
+        "success": True,
+        "new_qty": line.quantity,
+        "item_total": float(line.quantity * line.unit_price),
+        "cart_total": float(summary["total"]),
+    })
+
+
+@query_budget(max_queries=9)
+@csrf_exempt
+@require_POST
+async def cart_batch(request):
+    user, session_key, failure = await _visitor(request, create_token=True)
+    if failure:
+        return failure
+    data = _payload(request)
+    if data is None:
+        return JsonResponse({"detail": "JSON parse error"}, status=400)
+
+    # Транзакция — только в sync ORM.
+    try:
+        items, summary = await sync_to_async(apply_cart_ops)(
+            user.pk if user else None, session_key, data.get("ops"),
+        )
+    except CartOpError as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
+    return JsonResponse({
+        "success": True,
+        "items": [{**item, "line_total": float(item["line_total"])} for item in items],
+        "cart_count": summary["count"],
+        "cart_total": float(summary["total"]),
+    })
+
+
+@query_budget(max_queries=5)
+@csrf_exempt
+@require_POST
+async def cart_clear(request):
+    user, session_key, failure = await _visitor(request)
+    if failure:
+        return failure
+    await cart_queryset(user.pk if user else None, session_key).adelete()
+    await ainvalidate_cart_summary(user.pk if user else None, session_key)
+    return JsonResponse({"success": True})
+
+
+@query_budget(max_queries=19)
+@csrf_exempt
+@require_POST
+async def order_create(request):
+    user, session_key, failure = await _visitor(request)
+    if failure:
+        return failure
+
+    try:
+        order = await sync_to_async(create_order_from_cart)(user=user, session_key=session_key)
+    except EmptyCart:
+        return JsonResponse({"success": False, "error": "cart empty"}, status=400)
+    except OutOfStock as exc:
+        return JsonResponse(
+            {"success": False, "error": "out of stock", "product_ids": exc.product_ids},
+            status=409,
+        )
+
+    await ainvalidate_cart_summary(user.pk if user else None, session_key)
+    return JsonResponse({"success": True, "order_id": order.id})
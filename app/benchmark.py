@@ -0,0 +1,532 @@
+"""
+Нагрузочные бенчмарки: генератор синтетических данных и раннер сценариев.
+
+    python manage.py generate_bench_data --products 100000 --orders 1000000
+    python manage.py run_benchmarks --requests 200 --output bench.json
+    python manage.py run_benchmarks --concurrency 8 --base-url http://127.0.0.1:8000
+
+Запускать на отдельной базе: генератор пишет миллионы строк,
+сценарии корзины и checkout меняют данные.
+"""
+import bisect
+import copy
+import itertools
+import json
+import math
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import CartItem, Category, Order, OrderItem, Product, Review
+
+
+BENCH_PASSWORD = "bench-password"
+BENCH_USER_PREFIX = "bench_user_"
+BENCH_CATEGORY_PREFIX = "Бенч-категория "
+
+_ADJECTIVES = (
+    "марсианский", "красный", "пыльный", "лёгкий", "прочный", "складной",
+    "титановый", "орбитальный", "термо", "компактный", "походный", "звёздный",
+)
+_NOUNS = (
+    "чайник", "ровер", "шлем", "скафандр", "фонарь", "рюкзак", "термос",
+    "купол", "генератор", "бур", "антенна", "ботинки", "перчатки", "палатка",
+)
+_WORDS = (
+    "для", "экспедиции", "грунт", "кратер", "пыль", "реголит", "ночью",
+    "солнечной", "батареей", "защита", "давление", "кислород", "удобный",
+    "надёжный", "колёса", "база", "купол", "станция", "шторм", "долина",
+)
+
+
+class ZipfSampler:
+    """
+    Выбор индекса 0..n-1 с весами 1 / (k + 1) ** s — «популярные» товары
+    встречаются в корзинах и заказах гораздо чаще остальных.
+    """
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for k in range(n):
+            total += 1.0 / (k + 1) ** s
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def _batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# --- генератор данных ---
+
+def generate_dataset(
+    categories=30,
+    products=100_000,
+    users=5_000,
+    orders=1_000_000,
+    carts=2_000,
+    guest_carts=2_000,
+    review_rate=0.05,
+    days=365,
+    seed=42,
+    batch_size=5_000,
+    log=print,
+):
+    """
+    Заполняет базу синтетическими данными. Одинаковый seed даёт одинаковые
+    товары, пользователей и состав заказов (даты — относительно «сейчас»).
+    Производные структуры (поиск, рейтинги, сводки, «покупают вместе»,
+    популярность) пересобираются в конце.
+    """
+    from .popularity import refresh_popularity
+    from .ratings import recompute_all_ratings
+    from .recommendations import rebuild_recommendations
+    from .rollups import rebuild_rollups
+    from .search import get_backend
+
+    rng = random.Random(seed)
+    now = timezone.now()
+    User = get_user_model()
+
+    def random_moment():
+        return now - timedelta(seconds=rng.randint(0, days * 86400))
+
+    started = time.perf_counter()
+
+    def step(label, count):
+        log(f"{label}: {count} ({time.perf_counter() - started:.1f}s)")
+
+    # Категории: Category.name уникально, повторный запуск нумерует дальше.
+    offset = Category.objects.filter(name__startswith=BENCH_CATEGORY_PREFIX).count()
+    with transaction.atomic():
+        category_objs = Category.objects.bulk_create(
+            [Category(name=f"{BENCH_CATEGORY_PREFIX}{i}") for i in range(offset + 1, offset + categories + 1)],
+            batch_size=batch_size,
+        )
+    category_ids = [c.pk for c in category_objs]
+    step("categories", len(category_ids))
+
+    # Товары
+    product_ids, product_prices = [], []
+    for chunk in _batched(range(products), batch_size):
+        objs = []
+        for i in chunk:
+            price = Decimal(str(round(rng.lognormvariate(7, 1.0), 2)))
+            objs.append(Product(
+                category_id=category_ids[rng.randrange(len(category_ids))],
+                name=f"{rng.choice(_ADJECTIVES).capitalize()} {rng.choice(_NOUNS)} #{i + 1}",
+                description=" ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 30))),
+                price=price,
+                created_at=random_moment(),
+            ))
+        with transaction.atomic():
+            created = Product.objects.bulk_create(objs)
+        product_ids.extend(p.pk for p in created)
+        product_prices.extend(p.price for p in created)
+    step("products", len(product_ids))
+
+    # Пользователи: один хэш пароля на всех.
+    password = make_password(BENCH_PASSWORD)
+    user_ids = []
+    offset = User.objects.filter(username__startswith=BENCH_USER_PREFIX).count()
+    for chunk in _batched(range(offset, offset + users), batch_size):
+        with transaction.atomic():
+            created = User.objects.bulk_create([
+                User(username=f"{BENCH_USER_PREFIX}{i}", password=password)
+                for i in chunk
+            ])
+        user_ids.extend(u.pk for u in created)
+    step("users", len(user_ids))
+
+    popularity = ZipfSampler(len(product_ids), 1.1, rng)
+
+    # Заказы и позиции
+    reviewed = set()
+    review_candidates = []
+    items_total = 0
+    for chunk in _batched(range(orders), batch_size):
+        planned = []
+        for _ in chunk:
+            lines = {}
+            for _ in range(min(1 + int(rng.expovariate(0.6)), 12)):
+                idx = popularity.sample()
+                lines[idx] = lines.get(idx, 0) + rng.randint(1, 3)
+            user_id = user_ids[rng.randrange(len(user_ids))] if user_ids and rng.random() < 0.85 else None
+            status = "completed" if rng.random() < 0.95 else "cancelled"
+            planned.append((user_id, status, random_moment(), lines))
+
+        with transaction.atomic():
+            order_objs = Order.objects.bulk_create([
+                Order(
+                    user_id=user_id,
+                    status=status,
+                    created_at=created_at,
+                    total_price=sum(product_prices[idx] * qty for idx, qty in lines.items()),
+                )
+                for user_id, status, created_at, lines in planned
+            ])
+            items = []
+            for order, (user_id, status, created_at, lines) in zip(order_objs, planned):
+                for idx, qty in lines.items():
+                    items.append(OrderItem(
+                        order_id=order.pk,
+                        product_id=product_ids[idx],
+                        quantity=qty,
+                        unit_price=product_prices[idx],
+                        created_at=created_at,
+                    ))
+                    if user_id and status == "completed" and rng.random() < review_rate:
+                        key = (product_ids[idx], user_id)
+                        if key not in reviewed:
+                            reviewed.add(key)
+                            review_candidates.append((key, created_at))
+            OrderItem.objects.bulk_create(items, batch_size=batch_size)
+        items_total += len(items)
+    step("orders", orders)
+    step("order items", items_total)
+
+    # Отзывы: рейтинг смещён к 4–5.
+    for chunk in _batched(review_candidates, batch_size):
+        with transaction.atomic():
+            Review.objects.bulk_create([
+                Review(
+                    product_id=product_id,
+                    user_id=user_id,
+                    rating=rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 3, 6, 9))[0],
+                    text=" ".join(rng.choice(_WORDS) for _ in range(rng.randint(0, 20))),
+                    created_at=created_at + timedelta(days=rng.randint(1, 14)),
+                )
+                for (product_id, user_id), created_at in chunk
+            ])
+    step("reviews", len(review_candidates))
+
+    # Корзины: у части пользователей и у гостей, товары — по популярности.
+    cart_rows = []
+    for user_id in rng.sample(user_ids, min(carts, len(user_ids))):
+        for idx in {popularity.sample() for _ in range(rng.randint(1, 8))}:
+            cart_rows.append(CartItem(user_id=user_id, product_id=product_ids[idx], quantity=rng.randint(1, 4)))
+    for _ in range(guest_carts):
+        session_key = uuid.UUID(int=rng.getrandbits(128)).hex
+        for idx in {popularity.sample() for _ in range(rng.randint(1, 5))}:
+            cart_rows.append(CartItem(session_key=session_key, product_id=product_ids[idx], quantity=rng.randint(1, 3)))
+    with transaction.atomic():
+        CartItem.objects.bulk_create(cart_rows, batch_size=batch_size)
+    step("cart items", len(cart_rows))
+
+    # bulk_create не вызывает сигналы — пересобираем производные данные.
+    get_backend().rebuild(Product.objects.order_by("id"))
+    recompute_all_ratings()
+    rebuild_rollups()
+    rebuild_recommendations()
+    # После rollups: очки хитов и трендов считаются по часовым сводкам.
+    refresh_popularity(full=True)
+    step("derived data", 1)
+
+    return {
+        "categories": len(category_ids),
+        "products": len(product_ids),
+        "users": len(user_ids),
+        "orders": orders,
+        "order_items": items_total,
+        "reviews": len(review_candidates),
+        "cart_items": len(cart_rows),
+    }
+
+
+# --- раннер ---
+
+class TestClientTransport:
+    """
+    Запросы через django.test.Client в том же процессе: видно число SQL-запросов.
+    """
+    counts_queries = True
+
+    def __init__(self, host="localhost"):
+        self.host = host
+        self.client = Client(SERVER_NAME=host)
+
+    def clone(self):
+        return TestClientTransport(self.host)
+
+    def login(self, username, password):
+        return self.client.login(username=username, password=password)
+
+    def request(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            if method == "GET":
+                response = self.client.get(path, data or {})
+            else:
+                response = self.client.post(path, json.dumps(data or {}), content_type="application/json")
+        return response.status_code, len(ctx.captured_queries)
+
+
+class HTTPTransport:
+    """
+    Запросы к запущенному серверу (runserver, uvicorn, gunicorn).
+    Число SQL-запросов здесь недоступно.
+    """
+    counts_queries = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def clone(self):
+        return HTTPTransport(self.base_url)
+
+    def _csrf(self):
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        return ""
+
+    def login(self, username, password):
+        status, _ = self.request("POST", "/api/auth/login/", {"username": username, "password": password})
+        return status == 200
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        body = None
+        headers = {}
+        if method == "GET":
+            if data:
+                url += "?" + urlencode(data)
+        else:
+            body = json.dumps(data or {}).encode()
+            headers = {
+                "Content-Type": "application/json",
+                "X-CSRFToken": self._csrf(),
+                "Referer": self.base_url + "/",
+            }
+        req = Request(url, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status, None
+        except OSError as exc:
+            return getattr(exc, "code", 0), None
+
+
+def _scenario_index(ctx):
+    params = {}
+    if ctx.rng.random() < 0.3:
+        params["q"] = ctx.rng.choice(_NOUNS)
+    if ctx.rng.random() < 0.3:
+        params["category"] = ctx.rng.choice(ctx.category_ids)
+    params["sort"] = ctx.rng.choice(("new", "price_asc", "price_desc", "popular", "trending"))
+    return "GET", "/", params
+
+
+def _scenario_product_detail(ctx):
+    return "GET", f"/product/{ctx.product_id()}/", None
+
+
+def _scenario_cart_add(ctx):
+    return "POST", "/api/cart/add/", {"product_id": ctx.product_id(), "qty": 1}
+
+
+def _scenario_cart_list(ctx):
+    return "GET", "/api/cart/", None
+
+
+def _scenario_checkout(ctx):
+    # Подготовка (наполнение корзины) не входит в замер.
+    for _ in range(ctx.rng.randint(1, 5)):
+        ctx.transport.request("POST", "/api/cart/add/", {"product_id": ctx.product_id(), "qty": 1})
+    return "POST", "/api/orders/create/", None
+
+
+def _scenario_stats_sales(ctx):
+    return "GET", "/api/stats/sales/", {"days": ctx.rng.choice((7, 30, 90))}
+
+
+def _scenario_stats_categories(ctx):
+    return "GET", "/api/stats/categories/", {"days": ctx.rng.choice((7, 30, 90))}
+
+
+SCENARIOS = {
+    "index_view": _scenario_index,
+    "product_detail_view": _scenario_product_detail,
+    "cart_add": _scenario_cart_add,
+    "cart_list": _scenario_cart_list,
+    "checkout": _scenario_checkout,
+    "stats_sales": _scenario_stats_sales,
+    "stats_categories": _scenario_stats_categories,
+}
+
+
+class _Context:
+    def __init__(self, transport, rng):
+        self.transport = transport
+        self.rng = rng
+        self.product_ids = list(Product.objects.values_list("id", flat=True))
+        self.category_ids = list(Category.objects.values_list("id", flat=True))
+        if not self.product_ids:
+            raise RuntimeError("В базе нет товаров — сначала generate_bench_data.")
+        self.popularity = ZipfSampler(len(self.product_ids), 1.1, rng)
+
+    def product_id(self):
+        return self.product_ids[self.popularity.sample()]
+
+    def fork(self, transport, rng):
+        """
+        Контекст для потока: свой транспорт (cookie, сессия) и генератор,
+        общие списки id и таблица Zipf.
+        """
+        ctx = copy.copy(self)
+        ctx.transport, ctx.rng = transport, rng
+        ctx.popularity = copy.copy(self.popularity)
+        ctx.popularity.rng = rng
+        return ctx
+
+
+def percentile(sorted_values, pct):
+    """
+    Перцентиль по методу ближайшего ранга.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(ctx, build, count):
+    """
+    count замеров сценария build на одном транспорте: (latencies, queries, errors).
+    """
+    latencies, queries, errors = [], [], 0
+    for _ in range(count):
+        method, path, data = build(ctx)
+        t0 = time.perf_counter()
+        status, query_count = ctx.transport.request(method, path, data)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if query_count is not None:
+            queries.append(query_count)
+        if status >= 400:
+            errors += 1
+    return latencies, queries, errors
+
+
+def _measure_in_thread(ctx, build, count):
+    try:
+        return _measure(ctx, build, count)
+    finally:
+        # У каждого потока своё соединение с базой.
+        connection.close()
+
+
+def run_benchmarks(transport, scenarios=None, requests=200, warmup=10, seed=42, username=None,
+                   concurrency=1):
+    """
+    Прогоняет сценарии и возвращает отчёт для json.dump.
+    При concurrency > 1 запросы сценария делят между собой столько же
+    потоков, у каждого свой транспорт; throughput_rps — выполненные
+    запросы, делённые на время прогона сценария.
+    """
+    rng = random.Random(seed)
+    if username is None:
+        bench_user = (
+            get_user_model().objects.filter(username__startswith=BENCH_USER_PREFIX)
+            .order_by("id").values_list("username", flat=True).first()
+        )
+        username = bench_user
+
+    ctx = _Context(transport, rng)
+    workers = [ctx] + [
+        ctx.fork(transport.clone(), random.Random(seed + i)) for i in range(1, concurrency)
+    ]
+    for worker in workers:
+        if username and not worker.transport.login(username, BENCH_PASSWORD):
+            raise RuntimeError(f"Не удалось войти как {username}")
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "started_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "transport": type(transport).__name__,
+            "requests_per_scenario": requests,
+            "concurrency": concurrency,
+            "seed": seed,
+            "dataset": {
+                "products": len(ctx.product_ids),
+                "categories": len(ctx.category_ids),
+                "orders": Order.objects.count(),
+                "order_items": OrderItem.objects.count(),
+            },
+        },
+        "scenarios": {},
+    }
+
+    for name in scenarios or SCENARIOS:
+        build = SCENARIOS[name]
+        for _ in range(warmup):
+            transport.request(*build(ctx))
+
+        # Поровну на поток, остаток — первым.
+        counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+        started = time.perf_counter()
+        if concurrency == 1:
+            parts = [_measure(ctx, build, requests)]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                parts = list(pool.map(_measure_in_thread, workers, [build] * concurrency, counts))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(itertools.chain.from_iterable(part[0] for part in parts))
+        queries = sorted(itertools.chain.from_iterable(part[1] for part in parts))
+        errors = sum(part[2] for part in parts)
+        result = {
+            "requests": len(latencies),
+            "errors": errors,
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "max_ms": round(latencies[-1], 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+        }
+        if queries:
+            result.update({
+                "queries_p50": percentile(queries, 50),
+                "queries_max": queries[-1],
+            })
+        report["scenarios"][name] = result
+
+    return report
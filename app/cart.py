@@ -0,0 +1,171 @@
+"""
+Сводка корзины (кол-во товаров и сумма), закэшированная по пользователю/гостю.
+Любая мутация корзины должна вызвать refresh_cart_summary или invalidate_cart_summary.
+
+Кэш — общий для всех процессов default (app.E001 в app/checks.py): запись
+корзины обрабатывает один воркер, а бейдж читают все остальные.
+
+Гость определяется токеном из app.guests; в моделях и здесь он по-прежнему
+называется session_key.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import login
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+
+from .guests import forget_guest_token, guest_token
+from .models import CartItem
+
+
+CART_SUMMARY_TIMEOUT = getattr(settings, "CART_SUMMARY_TIMEOUT", 60 * 60)
+
+EMPTY_SUMMARY = {"count": 0, "total": Decimal("0")}
+
+
+def _cache_key(user_id=None, session_key=None):
+    if user_id:
+        return f"cart_summary:user:{user_id}"
+    return f"cart_summary:session:{session_key}"
+
+
+def cart_owner(request):
+    """
+    (user_id, session_key) владельца корзины без создания токена.
+    Для гостя без корзины оба значения None.
+    """
+    if request.user.is_authenticated:
+        return request.user.pk, None
+    return None, guest_token(request)
+
+
+def cart_queryset(user_id=None, session_key=None):
+    if user_id:
+        return CartItem.objects.filter(user_id=user_id)
+    if not session_key:
+        # filter(session_key=None) дал бы IS NULL — чужие «ничьи» строки.
+        return CartItem.objects.none()
+    return CartItem.objects.filter(session_key=session_key, user__isnull=True)
+
+
+def _summary_aggregates():
+    return {
+        "count": Sum("quantity"),
+        "total": Sum(
+            F("quantity") * F("product__price"),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    }
+
+
+def _summary_from(data):
+    return {
+        "count": data["count"] or 0,
+        "total": data["total"] or Decimal("0"),
+    }
+
+
+def compute_cart_summary(user_id=None, session_key=None):
+    data = cart_queryset(user_id, session_key).aggregate(**_summary_aggregates())
+    return _summary_from(data)
+
+
+def refresh_cart_summary(user_id=None, session_key=None):
+    """
+    Пересчитывает сводку одним запросом и кладёт её в кэш.
+    """
+    if not user_id and not session_key:
+        return dict(EMPTY_SUMMARY)
+    summary = compute_cart_summary(user_id, session_key)
+    cache.set(_cache_key(user_id, session_key), summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def store_cart_summary(user_id, session_key, count, total):
+    """
+    Кладёт в кэш сводку, уже посчитанную вызывающим (например, app.cartops).
+    """
+    summary = _summary_from({"count": count, "total": total})
+    if user_id or session_key:
+        cache.set(_cache_key(user_id, session_key), summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(user_id=None, session_key=None):
+    if not user_id and not session_key:
+        return
+    cache.delete(_cache_key(user_id, session_key))
+
+
+async def arefresh_cart_summary(user_id=None, session_key=None):
+    if not user_id and not session_key:
+        return dict(EMPTY_SUMMARY)
+    data = await cart_queryset(user_id, session_key).aaggregate(**_summary_aggregates())
+    summary = _summary_from(data)
+    await cache.aset(_cache_key(user_id, session_key), summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+async def ainvalidate_cart_summary(user_id=None, session_key=None):
+    if not user_id and not session_key:
+        return
+    await cache.adelete(_cache_key(user_id, session_key))
+
+
+def get_cart_summary(request):
+    """
+    Сводка корзины для текущего посетителя. При попадании в кэш — ноль запросов.
+    """
+    user_id, session_key = cart_owner(request)
+    if not user_id and not session_key:
+        return dict(EMPTY_SUMMARY)
+
+    summary = cache.get(_cache_key(user_id, session_key))
+    if summary is None:
+        summary = refresh_cart_summary(user_id, session_key)
+    return summary
+
+
+def merge_guest_cart(user, session_key):
+    """
+    Переносит гостевую корзину пользователю за фиксированное число запросов:
+    суммирует количество для совпадающих товаров, удаляет эти гостевые строки
+    и переназначает остальные. Возвращает число перенесённых строк.
+    """
+    if not session_key:
+        return 0
+
+    with transaction.atomic():
+        guest = cart_queryset(session_key=session_key)
+        user_items = CartItem.objects.filter(user=user)
+
+        guest_qty = (
+            guest.filter(product_id=OuterRef("product_id"))
+            .values("product_id")
+            .annotate(s=Sum("quantity"))
+            .values("s")
+        )
+        user_items.filter(
+            product_id__in=guest.values("product_id"),
+        ).update(quantity=F("quantity") + Subquery(guest_qty))
+
+        guest.filter(product_id__in=user_items.values("product_id")).delete()
+        moved = guest.update(user=user, session_key=None)
+
+    invalidate_cart_summary(user_id=user.pk)
+    invalidate_cart_summary(session_key=session_key)
+    return moved
+
+
+def login_with_cart(request, user):
+    """
+    Гостевой токен запоминаем до login(): тот меняет ключ сессии,
+    а старые корзины могут быть привязаны именно к нему.
+    """
+    token = None if request.user.is_authenticated else guest_token(request)
+    login(request, user)
+    if token:
+        merge_guest_cart(user, token)
+        forget_guest_token(request)
@@ -0,0 +1,318 @@
+"""
+Изменения корзины на стороне SQL.
+
+upsert_lines — INSERT ... ON CONFLICT по частичным уникальным индексам
+CartItem (строка на товар у пользователя или гостя): без чтения строки
+и без гонки get_or_create.
+
+add_line / step_line — одиночные изменения из API корзины: один
+условный UPDATE (или upsert) с RETURNING, новое количество приходит в том
+же запросе. Количество не читается в Python и не пишется обратно, поэтому
+одновременные клики из двух вкладок не теряют обновления, и
+select_for_update не нужен.
+
+apply_cart_ops — пакет операций от cart.js за фиксированное число
+запросов в одной транзакции, сколько бы операций ни пришло:
+
+    [{"op": "add", "product_id": 5, "qty": 2},
+     {"op": "set", "product_id": 7, "qty": 3},
+     {"op": "remove", "product_id": 7},
+     {"op": "clear"}]
+"""
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Window
+from django.utils import timezone
+
+from .cart import cart_queryset, store_cart_summary
+from .models import CartItem, Product
+
+
+Line = namedtuple("Line", "item_id product_id quantity unit_price")
+
+
+MAX_OPS = 100
+MAX_QUANTITY = 999
+
+OPS = ("add", "set", "remove", "clear")
+
+# action из /api/cart/update_qty/ -> изменение количества.
+CART_STEPS = {"increase": 1, "decrease": -1}
+
+
+class CartOpError(ValueError):
+    pass
+
+
+def parse_quantity(value, minimum=1):
+    try:
+        qty = int(value)
+    except (TypeError, ValueError):
+        raise CartOpError("qty must be an integer")
+    if not minimum <= qty <= MAX_QUANTITY:
+        raise CartOpError(f"qty must be between {minimum} and {MAX_QUANTITY}")
+    return qty
+
+
+def _product_id(op):
+    try:
+        return int(op["product_id"])
+    except (KeyError, TypeError, ValueError):
+        raise CartOpError("product_id is required")
+
+
+def plan_cart_ops(ops):
+    """
+    Сворачивает операции в итоговый план: (clear, {product_id: (mode, qty)}),
+    mode — "set" (итоговое количество, 0 — удалить) или "add" (прибавить).
+    """
+    if not isinstance(ops, list) or not ops:
+        raise CartOpError("ops must be a non-empty list")
+    if len(ops) > MAX_OPS:
+        raise CartOpError(f"at most {MAX_OPS} ops per request")
+
+    clear = False
+    plan = {}
+    for op in ops:
+        if not isinstance(op, dict) or op.get("op") not in OPS:
+            raise CartOpError(f"op must be one of: {', '.join(OPS)}")
+
+        kind = op["op"]
+        if kind == "clear":
+            clear = True
+            plan = {}
+            continue
+
+        product_id = _product_id(op)
+        if kind == "remove":
+            plan[product_id] = ("set", 0)
+        elif kind == "set":
+            plan[product_id] = ("set", parse_quantity(op.get("qty", 1), 0))
+        else:
+            qty = parse_quantity(op.get("qty", 1))
+            mode, current = plan.get(product_id, ("add", 0))
+            # add после set — это set: база уже известна.
+            plan[product_id] = (mode, min(current + qty, MAX_QUANTITY))
+
+    # После clear прибавлять не к чему.
+    if clear:
+        plan = {pid: ("set", qty) for pid, (_, qty) in plan.items()}
+    return clear, plan
+
+
+def _capped(expression):
+    return f"CASE WHEN {expression} > {MAX_QUANTITY} THEN {MAX_QUANTITY} ELSE {expression} END"
+
+
+def _conflict_target(user_id):
+    qn = connection.ops.quote_name
+    if user_id:
+        return f"({qn('user_id')}, {qn('product_id')}) WHERE {qn('user_id')} IS NOT NULL"
+    return f"({qn('session_key')}, {qn('product_id')}) WHERE {qn('user_id')} IS NULL"
+
+
+def _owner_condition(user_id, session_key):
+    qn = connection.ops.quote_name
+    if user_id:
+        return f"{qn('user_id')} = %s", [user_id]
+    return f"{qn('session_key')} = %s AND {qn('user_id')} IS NULL", [session_key]
+
+
+def _returning():
+    """
+    RETURNING строки корзины вместе с текущей ценой товара.
+    """
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    product = qn(Product._meta.db_table)
+    return (
+        f"RETURNING {table}.{qn('id')}, {table}.{qn('product_id')}, {table}.{qn('quantity')}, "
+        f"(SELECT {qn('price')} FROM {product} WHERE {product}.{qn('id')} = {table}.{qn('product_id')})"
+    )
+
+
+def _line(row):
+    if row is None:
+        return None
+    price = Product._meta.get_field("price").to_python(row[3])
+    return Line(row[0], row[1], row[2], price)
+
+
+def _added_at():
+    return CartItem._meta.get_field("added_at").get_db_prep_value(timezone.now(), connection)
+
+
+def upsert_lines(user_id, session_key, quantities, increment):
+    """
+    Одним INSERT ... ON CONFLICT ставит (increment=False) или прибавляет
+    (increment=True) количества {product_id: qty} в корзине владельца.
+    """
+    if not quantities:
+        return
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    quantity = qn("quantity")
+    if increment:
+        value = _capped(f"{table}.{quantity} + excluded.{quantity}")
+    else:
+        value = f"excluded.{quantity}"
+
+    columns = ("user_id", "session_key", "product_id", "quantity", "added_at")
+    sql = (
+        f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) "
+        f"VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(quantities))} "
+        f"ON CONFLICT {_conflict_target(user_id)} DO UPDATE SET {quantity} = {value}"
+    )
+
+    added_at = _added_at()
+    params = []
+    for product_id, qty in quantities.items():
+        params.extend([user_id or None, None if user_id else session_key, product_id, qty, added_at])
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def add_line(user_id, session_key, product_id, qty):
+    """
+    Кладёт qty штук товара в корзину (вставка или прибавление) одним
+    запросом. Возвращает Line с новым количеством или None, если товара нет.
+    """
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    product = qn(Product._meta.db_table)
+    quantity = qn("quantity")
+
+    # INSERT ... SELECT из товара: несуществующий product_id просто
+    # ничего не вставит, отдельная проверка не нужна.
+    sql = (
+        f"INSERT INTO {table} ({qn('user_id')}, {qn('session_key')}, {qn('product_id')}, "
+        f"{quantity}, {qn('added_at')}) "
+        f"SELECT %s, %s, {qn('id')}, %s, %s FROM {product} WHERE {qn('id')} = %s "
+        f"ON CONFLICT {_conflict_target(user_id)} "
+        f"DO UPDATE SET {quantity} = {_capped(f'{table}.{quantity} + excluded.{quantity}')} "
+        f"{_returning()}"
+    )
+    params = [user_id or None, None if user_id else session_key, qty, _added_at(), product_id]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return _line(cursor.fetchone())
+
+
+def step_line(user_id, session_key, item_id, delta):
+    """
+    Меняет количество строки корзины на delta (+1 / -1) условным UPDATE.
+    Уменьшение с единицы удаляет строку — тоже условно, по quantity.
+
+    Возвращает Line с новым количеством, Line с quantity=0, если строка
+    удалена, или None, если у владельца такой строки нет.
+    """
+    if not user_id and not session_key:
+        return None
+    qn = connection.ops.quote_name
+    table = qn(CartItem._meta.db_table)
+    quantity = qn("quantity")
+    owner, owner_params = _owner_condition(user_id, session_key)
+    where = f"{qn('id')} = %s AND {owner}"
+    params = [item_id] + owner_params
+
+    if delta > 0:
+        update = (
+            f"UPDATE {table} SET {quantity} = {_capped(f'{quantity} + %s')} "
+            f"WHERE {where} {_returning()}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(update, [delta, delta] + params)
+            return _line(cursor.fetchone())
+
+    update = (
+        f"UPDATE {table} SET {quantity} = {quantity} - %s "
+        f"WHERE {where} AND {quantity} > %s {_returning()}"
+    )
+    delete = (
+        f"DELETE FROM {table} WHERE {where} AND {quantity} <= %s "
+        f"RETURNING {qn('id')}, {qn('product_id')}"
+    )
+    step = -delta
+    with connection.cursor() as cursor:
+        # Между UPDATE и DELETE другая вкладка может изменить строку —
+        # тогда не сработает ни одно условие, и пробуем ещё раз.
+        for _ in range(2):
+            cursor.execute(update, [step] + params + [step])
+            row = cursor.fetchone()
+            if row is not None:
+                return _line(row)
+            cursor.execute(delete, params + [step])
+            row = cursor.fetchone()
+            if row is not None:
+                return Line(row[0], row[1], 0, None)
+    return None
+
+
+def cart_lines(user_id=None, session_key=None):
+    """
+    Строки корзины с суммами и итог одним запросом (оконные SUM).
+    Заодно обновляет кэш сводки — отдельный пересчёт не нужен.
+    """
+    line_total = ExpressionWrapper(
+        F("quantity") * F("product__price"),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+    rows = list(
+        cart_queryset(user_id, session_key)
+        .order_by("id")
+        .annotate(
+            line_total=line_total,
+            cart_count=Window(Sum("quantity")),
+            cart_total=Window(Sum(line_total)),
+        )
+        .values("id", "product_id", "quantity", "line_total", "cart_count", "cart_total")
+    )
+    summary = store_cart_summary(
+        user_id,
+        session_key,
+        rows[0]["cart_count"] if rows else 0,
+        rows[0]["cart_total"] if rows else None,
+    )
+    items = [
+        {
+            "item_id": row["id"],
+            "product_id": row["product_id"],
+            "quantity": row["quantity"],
+            "line_total": row["line_total"],
+        }
+        for row in rows
+    ]
+    return items, summary
+
+
+def apply_cart_ops(user_id, session_key, ops):
+    """
+    Применяет пакет операций атомарно: не больше пяти запросов на запись
+    и один на чтение итога. Ошибка в любой операции откатывает все.
+    Возвращает (items, summary) как cart_lines.
+    """
+    if not user_id and not session_key:
+        raise CartOpError("cart owner is required")
+    clear, plan = plan_cart_ops(ops)
+    sets = {pid: qty for pid, (mode, qty) in plan.items() if mode == "set" and qty}
+    adds = {pid: qty for pid, (mode, qty) in plan.items() if mode == "add"}
+    removed = [pid for pid, (mode, qty) in plan.items() if mode == "set" and not qty]
+
+    with transaction.atomic():
+        lines = cart_queryset(user_id, session_key)
+        if clear:
+            lines.delete()
+
+        wanted = set(sets) | set(adds)
+        if wanted:
+            known = set(Product.objects.filter(id__in=wanted).values_list("id", flat=True))
+            if known != wanted:
+                raise CartOpError(f"unknown product_id: {sorted(wanted - known)[0]}")
+
+        if removed and not clear:
+            lines.filter(product_id__in=removed).delete()
+        upsert_lines(user_id, session_key, sets, increment=False)
+        upsert_lines(user_id, session_key, adds, increment=True)
+
+    return cart_lines(user_id, session_key)
@@ -0,0 +1,229 @@
+"""
+Каталог: общий построитель запроса для index_view и API товаров
+плюс keyset-пагинация (курсоры вместо OFFSET).
+"""
+import base64
+import binascii
+import json
+import math
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import Category, Product
+from .search import get_backend
+
+
+# sort -> (поле, направление). Второй ключ — id, чтобы порядок был строгим.
+SORT_ORDERINGS = {
+    "new": ("created_at", True),
+    "price_asc": ("price", False),
+    "price_desc": ("price", True),
+    "rating": ("rating_avg", True),
+    # Предрасчитанные очки из app.popularity.
+    "popular": ("bestseller_score", True),
+    "trending": ("trending_score", True),
+    # bm25: меньше — релевантнее. Имеет смысл только вместе с q.
+    "relevance": ("search_rank", False),
+}
+DEFAULT_SORT = "new"
+
+# Порядок категорий в фильтре: при сортировке по хитам и трендам — по
+# очкам категорий из app.popularity, иначе по названию.
+CATEGORY_ORDERINGS = {
+    "popular": ("-bestseller_score", "name"),
+    "trending": ("-trending_score", "name"),
+}
+
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 100
+
+# Фрагмент сетки товаров в index.html. Ключ включает версию каталога
+# из общего кэша (app.versions): после bump_version в любом процессе,
+# включая import_products и refresh_popularity, устаревшие записи
+# перестают читаться во всех воркерах.
+GRID_CACHE_TIMEOUT = 60 * 60
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_catalog_params(params):
+    """
+    Разбирает GET-параметры каталога так же, как это делал index_view.
+    Некорректные значения молча отбрасываются.
+    """
+    search_query = (params.get("q") or "").strip()
+    min_price = params.get("min_price") or ""
+    max_price = params.get("max_price") or ""
+    sort = params.get("sort") or ("relevance" if search_query else DEFAULT_SORT)
+    if sort not in SORT_ORDERINGS or (sort == "relevance" and not search_query):
+        sort = DEFAULT_SORT
+
+    active_category = None
+    category_id = params.get("category")
+    if category_id:
+        try:
+            active_category = int(category_id)
+        except ValueError:
+            active_category = None
+
+    return {
+        "search_query": search_query,
+        "min_price": min_price,
+        "max_price": max_price,
+        "category": active_category,
+        "sort": sort,
+    }
+
+
+def _to_decimal(value):
+    try:
+        d = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    # NaN и Infinity разбираются, но в фильтре по цене дают ValidationError.
+    if not d.is_finite():
+        return None
+    return d
+
+
+def filter_products(filters, qs=None):
+    """
+    Применяет поиск, диапазон цен и категорию. Без сортировки.
+    """
+    if qs is None:
+        qs = Product.objects.all()
+
+    search_query = filters["search_query"]
+    if search_query:
+        qs = get_backend().filter_queryset(qs, search_query)
+
+    min_price = _to_decimal(filters["min_price"]) if filters["min_price"] else None
+    if min_price is not None:
+        qs = qs.filter(price__gte=min_price)
+
+    max_price = _to_decimal(filters["max_price"]) if filters["max_price"] else None
+    if max_price is not None:
+        qs = qs.filter(price__lte=max_price)
+
+    if filters["category"] is not None:
+        qs = qs.filter(category_id=filters["category"])
+
+    return qs
+
+
+def ordered_categories(sort):
+    return Category.objects.order_by(*CATEGORY_ORDERINGS.get(sort, ("name",)))
+
+
+def order_products(qs, sort, search_query=""):
+    if sort == "relevance":
+        qs = get_backend().rank_queryset(qs, search_query)
+    field, desc = SORT_ORDERINGS[sort]
+    prefix = "-" if desc else ""
+    return qs.order_by(f"{prefix}{field}", f"{prefix}id")
+
+
+def build_catalog_queryset(params, qs=None):
+    """
+    Один построитель для HTML-каталога и API.
+    Возвращает (queryset, filters).
+    """
+    filters = parse_catalog_params(params)
+    qs = filter_products(filters, qs)
+    return order_products(qs, filters["sort"], filters["search_query"]), filters
+
+
+def grid_cache_key(filters, page_number):
+    """
+    Нормализованный ключ фрагмента сетки: одинаковый для ?sort=new и без
+    sort, для " q " и "q" и т.п. Не зависит от пользователя.
+    """
+    parts = [page_number] + [filters[name] for name in sorted(filters)]
+    return json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+
+
+# --- keyset-пагинация ---
+
+def _serialize_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(sort, product):
+    field, _ = SORT_ORDERINGS[sort]
+    payload = {
+        "s": sort,
+        "v": _serialize_value(getattr(product, field)),
+        "id": product.pk,
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        pk = int(payload["id"])
+        value = payload["v"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor("invalid cursor")
+
+    # Курсор от другой сортировки бессмысленен.
+    if payload.get("s") != sort:
+        raise InvalidCursor("cursor does not match sort")
+
+    field, _ = SORT_ORDERINGS[sort]
+    if field == "created_at":
+        value = parse_datetime(value) if isinstance(value, str) else None
+    elif field in ("search_rank", "rating_avg", "bestseller_score", "trending_score"):
+        value = value if isinstance(value, (int, float)) and math.isfinite(value) else None
+    else:
+        value = _to_decimal(value)
+    if value is None:
+        raise InvalidCursor("invalid cursor")
+    return value, pk
+
+
+def keyset_filter(qs, sort, cursor):
+    """
+    Оставляет строки строго после курсора: (field, id) > (v, pk)
+    в направлении сортировки. Работает по индексу без OFFSET.
+    """
+    value, pk = decode_cursor(cursor, sort)
+    field, desc = SORT_ORDERINGS[sort]
+    op = "lt" if desc else "gt"
+    return qs.filter(
+        Q(**{f"{field}__{op}": value}) |
+        Q(**{field: value, f"id__{op}": pk})
+    )
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_page(qs, sort, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Возвращает (items, next_cursor). Стоимость одинакова для любой глубины:
+    WHERE по ключу + LIMIT page_size + 1.
+    """
+    if cursor:
+        qs = keyset_filter(qs, sort, cursor)
+    items = list(qs[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(sort, items[-1])
+    return items, next_cursor
@@ -0,0 +1,81 @@
+"""
+Оформление заказа из корзины: фиксированное число запросов в одной транзакции.
+"""
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .cart import cart_queryset
+from .models import Order, OrderItem
+from .recommendations import apply_order as apply_copurchases
+from .rollups import apply_order
+from .stock import reserve_stock
+
+
+class EmptyCart(Exception):
+    pass
+
+
+def create_order_from_cart(user=None, session_key=None):
+    """
+    Читает корзину один раз (с товарами и блокировкой строк, где СУБД это умеет),
+    создаёт заказ и позиции через bulk_create, считает сумму в SQL
+    и удаляет ровно прочитанные строки корзины. Всё или ничего.
+
+    Общие для всех заказов строки (остатки товаров, часовые сводки,
+    совместные покупки) обновляются последними: их блокировки держатся только до COMMIT.
+    При нехватке товара — OutOfStock и откат.
+    """
+    user_id = user.pk if user else None
+
+    with transaction.atomic():
+        lines = list(
+            cart_queryset(user_id, session_key)
+            .select_for_update()
+            .select_related("product")
+        )
+        if not lines:
+            raise EmptyCart()
+
+        now = timezone.now()
+        order = Order.objects.create(
+            user=user,
+            status="completed",
+            created_at=now,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=line.product,
+                quantity=line.quantity,
+                unit_price=line.product.price,
+                created_at=now,
+            )
+            for line in lines
+        ])
+
+        order_total = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(s=Sum(F("quantity") * F("unit_price")))
+            .values("s")
+        )
+        Order.objects.filter(pk=order.pk).update(
+            total_price=Subquery(
+                order_total,
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
+        cart_queryset(user_id, session_key).filter(
+            pk__in=[line.pk for line in lines],
+        ).delete()
+
+        quantities = {}
+        for line in lines:
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+        reserve_stock(quantities)
+        apply_order(order)
+        apply_copurchases(order, product_ids=quantities)
+
+    return order
@@ -0,0 +1,33 @@
+"""
+Системные проверки настроек, без которых приложение работает неверно.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+# Бэкенды, у которых у каждого процесса своё содержимое.
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Версии данных (app.versions) меняют и воркеры, и management-команды.
+    В кэше отдельного процесса другие их изменений не видят: ETag не
+    меняется, и клиенты бесконечно получают устаревший 304.
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in PER_PROCESS_CACHES:
+        return [Error(
+            "The default cache is local to each process.",
+            hint=(
+                "Data versions, catalog fragments and cart summaries must be "
+                "shared between web workers and management commands: use "
+                "FileBasedCache, RedisCache or DatabaseCache."
+            ),
+            obj="CACHES['default']",
+            id="app.E001",
+        )]
+    return []
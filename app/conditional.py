@@ -0,0 +1,100 @@
+"""
+Функции ETag / Last-Modified для django.views.decorators.http.condition.
+Считаются по версиям из app.versions и кэшу корзины — без запросов к БД
+(кроме загрузки сессии/пользователя), поэтому 304 отдаётся до сериализации
+и агрегаций.
+"""
+import hashlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .analytics import read_meta, snapshot_version
+from .cart import get_cart_summary
+from .rollups import stats_since
+from .versions import CATALOG, ORDERS, get_version, get_versions
+
+
+def _etag(*parts):
+    raw = "|".join(str(p) for p in parts)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest()[:20] + '"'
+
+
+def _as_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+
+
+def _query(request):
+    return sorted(request.GET.lists())
+
+
+# --- API ---
+
+def catalog_api_etag(request, *args, **kwargs):
+    return _etag("products", get_version(CATALOG), _query(request))
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return _as_datetime(get_version(CATALOG))
+
+
+def recommendations_etag(request, pk, *args, **kwargs):
+    # ORDERS: top-K меняется с каждым заказом; CATALOG: поля товаров в ответе.
+    return _etag("recommendations", pk, get_versions(CATALOG, ORDERS))
+
+
+def analytics_etag(request, *args, **kwargs):
+    # Окно ?days= сдвигается раз в сутки (по TIME_ZONE, как и дни снимка) —
+    # дата тоже часть ответа.
+    return _etag(
+        "analytics", request.path, snapshot_version(read_meta()),
+        timezone.localdate().isoformat(), _query(request),
+    )
+
+
+def _stats_window(request):
+    try:
+        days = int(request.GET.get("days", 30))
+    except ValueError:
+        return None
+    return stats_since(days)
+
+
+def stats_etag(request, *args, **kwargs):
+    since = _stats_window(request)
+    if since is None:
+        return None
+    # CATALOG: в ответе есть названия категорий.
+    return _etag(
+        "stats", request.path, get_versions(ORDERS, CATALOG),
+        since.isoformat(), _query(request),
+    )
+
+
+def stats_last_modified(request, *args, **kwargs):
+    since = _stats_window(request)
+    if since is None:
+        return None
+    # Окно сдвигается раз в час — это тоже изменение ответа.
+    return max(_as_datetime(max(get_versions(ORDERS, CATALOG))), since)
+
+
+# --- HTML: зависит и от посетителя, поэтому только ETag ---
+
+def _visitor(request):
+    return request.user.pk, get_cart_summary(request)["count"]
+
+
+def index_etag(request, *args, **kwargs):
+    # Гостя index_view редиректит — не валидируем.
+    if not request.user.is_authenticated:
+        return None
+    return _etag("index", get_version(CATALOG), _visitor(request), _query(request))
+
+
+def product_detail_etag(request, pk, *args, **kwargs):
+    # ORDERS: после покупки меняется can_review.
+    return _etag(
+        "product", pk, get_versions(CATALOG, ORDERS),
+        _visitor(request), _query(request),
+    )
@@ -1,21 +1,13 @@
-from .models import CartItem
-from .api_views import get_session_key
+from .cart import get_cart_summary
 
 
 def cart_info(request):
     """
     Добавляет cart_count во все шаблоны.
+    Сводка берётся из кэша, гостю без сессии сессия не создаётся.
     """
     try:
-        if request.user.is_authenticated:
-            items = CartItem.objects.filter(user=request.user)
-        else:
-            session_key = get_session_key(request)
-            items = CartItem.objects.filter(
-                session_key=session_key,
-                user__isnull=True,
-            )
-        cart_count = sum(i.quantity for i in items)
+        cart_count = get_cart_summary(request)["count"]
     except Exception:
         cart_count = 0
 
@@ -0,0 +1,170 @@
+"""
+Потоковая выгрузка заказов с позициями (CSV или NDJSON, опционально gzip).
+
+Заказы читаются keyset-пачками по id: на пачку — один запрос заказов
+и один запрос их позиций, без долгого курсора и без загрузки всей
+выборки в память. Строки отдаются клиенту по мере чтения.
+
+CSV — одна строка на позицию (поля заказа повторяются),
+NDJSON — один объект на заказ со списком items.
+"""
+import csv
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Order, OrderItem
+
+
+CHUNK_SIZE = 500
+FORMATS = ("csv", "ndjson")
+
+CSV_COLUMNS = (
+    "order_id", "created_at", "status", "user", "order_total",
+    "product_id", "product_name", "quantity", "unit_price", "line_total",
+)
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def order_queryset(date_from=None, date_to=None, status=""):
+    """
+    Заказы за период [date_from, date_to] (даты включительно, локальное время).
+    """
+    qs = Order.objects.all()
+    if date_from:
+        qs = qs.filter(created_at__gte=_day_start(date_from))
+    if date_to:
+        qs = qs.filter(created_at__lt=_day_start(date_to + timedelta(days=1)))
+    if status:
+        qs = qs.filter(status=status)
+    return qs
+
+
+def iter_orders(qs, chunk_size=CHUNK_SIZE):
+    """
+    (order_dict, [item_dict, ...]) в порядке id, пачками по chunk_size.
+    """
+    qs = qs.order_by("id").values("id", "created_at", "status", "user__username", "total_price")
+    last_id = 0
+    while True:
+        orders = list(qs.filter(id__gt=last_id)[:chunk_size])
+        if not orders:
+            return
+        last_id = orders[-1]["id"]
+
+        items = {}
+        rows = (
+            OrderItem.objects.filter(order_id__in=[o["id"] for o in orders])
+            .order_by("order_id", "id")
+            .values("order_id", "product_id", "product__name", "quantity", "unit_price")
+        )
+        for row in rows:
+            items.setdefault(row["order_id"], []).append(row)
+
+        for order in orders:
+            yield order, items.get(order["id"], [])
+
+
+class _Echo:
+    """
+    Файлоподобный объект для csv.writer: возвращает строку, а не пишет её.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(orders):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order, items in orders:
+        head = [
+            order["id"],
+            timezone.localtime(order["created_at"]).isoformat(),
+            order["status"],
+            order["user__username"] or "",
+            order["total_price"],
+        ]
+        if not items:
+            yield writer.writerow(head + [""] * 5)
+        for item in items:
+            yield writer.writerow(head + [
+                item["product_id"],
+                item["product__name"],
+                item["quantity"],
+                item["unit_price"],
+                item["unit_price"] * item["quantity"],
+            ])
+
+
+def _ndjson_lines(orders):
+    for order, items in orders:
+        record = {
+            "id": order["id"],
+            "created_at": timezone.localtime(order["created_at"]).isoformat(),
+            "status": order["status"],
+            "user": order["user__username"],
+            "total_price": str(order["total_price"]),
+            "items": [
+                {
+                    "product_id": item["product_id"],
+                    "product_name": item["product__name"],
+                    "quantity": item["quantity"],
+                    "unit_price": str(item["unit_price"]),
+                    "line_total": str(item["unit_price"] * item["quantity"]),
+                }
+                for item in items
+            ],
+        }
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def _buffered(lines, size=64 * 1024):
+    """
+    Склеивает строки в блоки ~size байт: меньше мелких записей в сокет.
+    """
+    buf, length = [], 0
+    for line in lines:
+        data = line.encode("utf-8")
+        buf.append(data)
+        length += len(data)
+        if length >= size:
+            yield b"".join(buf)
+            buf, length = [], 0
+    if buf:
+        yield b"".join(buf)
+
+
+def _gzipped(blocks):
+    compressor = zlib.compressobj(wbits=31)  # 31 — формат gzip
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(qs, fmt="csv", gzip=False, chunk_size=CHUNK_SIZE):
+    """
+    Итератор байтов для StreamingHttpResponse.
+    """
+    lines = _csv_lines if fmt == "csv" else _ndjson_lines
+    blocks = _buffered(lines(iter_orders(qs, chunk_size)))
+    return _gzipped(blocks) if gzip else blocks
+
+
+def export_filename(fmt, date_from=None, date_to=None, gzip=False):
+    period = "-".join(d.strftime("%Y%m%d") for d in (date_from, date_to) if d)
+    name = f"orders-{period}" if period else "orders"
+    ext = "csv" if fmt == "csv" else "ndjson"
+    return f"{name}.{ext}.gz" if gzip else f"{name}.{ext}"
@@ -0,0 +1,108 @@
+"""
+Фасеты каталога: сколько товаров даст каждый фильтр при текущих остальных.
+
+Считается двумя GROUP BY-запросами независимо от числа категорий и
+ценовых диапазонов:
+- категории — по всем фильтрам, кроме самой категории;
+- цены — по всем фильтрам, кроме диапазона цен.
+Так у активной категории видны соседние, а у выбранной цены — другие
+диапазоны (disjunctive faceting).
+"""
+from decimal import Decimal
+
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .catalog import filter_products
+
+
+# Границы ценовых диапазонов (₽). Цены распределены примерно
+# логнормально, поэтому шаги растут.
+PRICE_BUCKETS = (500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def price_ranges():
+    """
+    [(min_price, max_price), ...]; None — открытая граница.
+    """
+    bounds = (None,) + PRICE_BUCKETS + (None,)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _bucket_expression():
+    whens = [
+        When(price__lt=Decimal(bound), then=Value(i))
+        for i, bound in enumerate(PRICE_BUCKETS)
+    ]
+    return Case(*whens, default=Value(len(PRICE_BUCKETS)), output_field=IntegerField())
+
+
+def category_counts(filters, qs=None):
+    """
+    {category_id: count} для всех фильтров, кроме категории.
+    """
+    rows = (
+        filter_products(dict(filters, category=None), qs)
+        .order_by()
+        .values("category_id")
+        .annotate(n=Count("id"))
+    )
+    return {row["category_id"]: row["n"] for row in rows}
+
+
+def price_histogram(filters, qs=None):
+    """
+    Количество товаров в каждом диапазоне PRICE_BUCKETS
+    при всех фильтрах, кроме цены. Пустые диапазоны тоже в списке.
+    """
+    rows = (
+        filter_products(dict(filters, min_price="", max_price=""), qs)
+        .order_by()
+        .annotate(bucket=_bucket_expression())
+        .values("bucket")
+        .annotate(n=Count("id"))
+    )
+    counts = {row["bucket"]: row["n"] for row in rows}
+    return [
+        {"min_price": low, "max_price": high, "count": counts.get(i, 0)}
+        for i, (low, high) in enumerate(price_ranges())
+    ]
+
+
+def _active_range(filters, low, high):
+    return (
+        str(low or "") == filters["min_price"]
+        and str(high or "") == filters["max_price"]
+    )
+
+
+def catalog_facets(filters, categories, qs=None):
+    """
+    Фасеты для сайдбара и API.
+
+    categories — уже загруженный список категорий (показываются все,
+    в том числе с нулём). total — размер текущей выборки, его можно
+    отдать Paginator вместо отдельного COUNT.
+    """
+    by_category = category_counts(filters, qs)
+    if filters["category"] is None:
+        total = sum(by_category.values())
+    else:
+        total = by_category.get(filters["category"], 0)
+
+    histogram = price_histogram(filters, qs)
+    for row in histogram:
+        row["active"] = _active_range(filters, row["min_price"], row["max_price"])
+
+    return {
+        "total": total,
+        "categories": [
+            {
+                "id": category.pk,
+                "name": category.name,
+                "count": by_category.get(category.pk, 0),
+                "active": filters["category"] == category.pk,
+            }
+            for category in categories
+        ],
+        "price": histogram,
+    }
@@ -0,0 +1,120 @@
+"""
+Идентификатор гостя без django_session.
+
+Гость получает случайный токен в подписанной cookie только тогда, когда
+что-то кладёт в корзину. Токен хранится в CartItem.session_key, так что
+весь код корзины, checkout и слияние при входе работают как раньше.
+Чтение (сводка в шапке, пустая корзина, боты) ничего не пишет.
+
+Старые корзины по ключу сессии продолжают находиться: пока cookie нет,
+токеном считается session_key, и он тут же переезжает в cookie.
+"""
+import re
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+
+
+GUEST_COOKIE = getattr(settings, "GUEST_CART_COOKIE", "guest_cart")
+GUEST_COOKIE_AGE = getattr(settings, "GUEST_CART_COOKIE_AGE", 60 * 60 * 24 * 30)
+GUEST_COOKIE_SALT = "app.guests"
+
+_TOKEN_RE = re.compile(r"^[0-9a-z]{32,40}$")
+
+
+def _http_request(request):
+    # DRF Request: атрибуты нужно ставить на исходный HttpRequest,
+    # его видит GuestCartMiddleware.
+    return getattr(request, "_request", request)
+
+
+def _read_cookie(request):
+    try:
+        token = request.get_signed_cookie(
+            GUEST_COOKIE, default=None, salt=GUEST_COOKIE_SALT, max_age=GUEST_COOKIE_AGE,
+        )
+    except signing.BadSignature:
+        return None
+    if token and _TOKEN_RE.match(token):
+        return token
+    return None
+
+
+def guest_token(request):
+    """
+    Токен гостевой корзины или None. Ничего не создаёт.
+    """
+    request = _http_request(request)
+    if not hasattr(request, "_guest_token"):
+        token = _read_cookie(request)
+        if token is None and hasattr(request, "session"):
+            # Корзина, заведённая до перехода на cookie.
+            token = request.session.session_key
+            request._guest_token_dirty = token is not None
+        request._guest_token = token
+    return request._guest_token
+
+
+def ensure_guest_token(request):
+    """
+    Токен для записи в корзину; при необходимости выдаёт новый.
+    Cookie ставит GuestCartMiddleware.
+    """
+    request = _http_request(request)
+    token = guest_token(request)
+    if token is None:
+        token = uuid.uuid4().hex
+        request._guest_token = token
+        request._guest_token_dirty = True
+    return token
+
+
+def forget_guest_token(request):
+    """
+    После слияния корзины при входе гостевой токен больше не нужен.
+    """
+    request = _http_request(request)
+    request._guest_token = None
+    request._guest_token_dirty = False
+    request._guest_token_forget = True
+
+
+class GuestCartMiddleware:
+    """
+    Выставляет или удаляет cookie гостя по итогам запроса.
+    Подключается после SessionMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        if getattr(request, "_guest_token_forget", False):
+            response.delete_cookie(GUEST_COOKIE, samesite="Lax")
+        elif getattr(request, "_guest_token_dirty", False):
+            response.set_signed_cookie(
+                GUEST_COOKIE,
+                request._guest_token,
+                salt=GUEST_COOKIE_SALT,
+                max_age=GUEST_COOKIE_AGE,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -0,0 +1,124 @@
+"""
+Производные изображения товара (WebP фиксированных размеров).
+
+Имя файла содержит хэш исходника, поэтому URL меняется вместе с картинкой
+и файлы можно отдавать с бессрочным Cache-Control.
+Карта размеров хранится в Product.photo_variants:
+{"source": "<имя исходника>", "thumb": "<имя>", "card": "<имя>", "detail": "<имя>"}
+"""
+import hashlib
+import io
+import posixpath
+from functools import reduce
+from operator import or_
+
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .models import Product
+from .versions import CATALOG, bump_version
+
+
+# name -> (ширина, высота, обрезать под размер)
+IMAGE_SIZES = {
+    "thumb": (120, 120, True),
+    "card": (480, 360, True),
+    "detail": (1200, 1200, False),
+}
+WEBP_QUALITY = 82
+DERIVATIVES_DIR = "products/derivatives"
+
+
+def _source_hash(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def _render(image, width, height, crop):
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def build_variants(photo):
+    """
+    Создаёт все размеры для файла photo (FieldFile) и возвращает карту имён.
+    """
+    storage = photo.storage
+    with storage.open(photo.name, "rb") as fh:
+        data = fh.read()
+
+    digest = _source_hash(data)
+    stem = posixpath.splitext(posixpath.basename(photo.name))[0]
+
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    variants = {"source": photo.name}
+    for size, (width, height, crop) in IMAGE_SIZES.items():
+        name = f"{DERIVATIVES_DIR}/{stem}-{size}-{digest}.webp"
+        if not storage.exists(name):
+            buf = io.BytesIO()
+            _render(image, width, height, crop).save(buf, "WEBP", quality=WEBP_QUALITY, method=4)
+            name = storage.save(name, ContentFile(buf.getvalue()))
+        variants[size] = name
+    return variants
+
+
+def delete_variants(storage, variants):
+    for size in IMAGE_SIZES:
+        name = variants.get(size)
+        if name and storage.exists(name):
+            storage.delete(name)
+
+
+def variants_in_use(names, exclude_pk=None):
+    """
+    Имена из names, на которые ссылается photo_variants других товаров.
+    Импорт хранит фото по содержимому (products/{stem}-{digest}{ext}),
+    поэтому у разных товаров бывают общие исходники и общие производные.
+    """
+    names = list(names)
+    if not names:
+        return set()
+    query = reduce(or_, (Q(**{f"photo_variants__{size}__in": names}) for size in IMAGE_SIZES))
+    used = set()
+    for variants in Product.objects.filter(query).exclude(pk=exclude_pk).values_list("photo_variants", flat=True):
+        used.update(variants.get(size) for size in IMAGE_SIZES)
+    return used
+
+
+def sync_product_variants(product, force=False):
+    """
+    Пересоздаёт производные, если исходник поменялся (или force).
+    Пишет через QuerySet.update, чтобы не вызывать post_save повторно.
+    Возвращает True, если карта изменилась.
+    """
+    old = product.photo_variants or {}
+    if not product.photo:
+        if not old:
+            return False
+        variants = {}
+    elif not force and old.get("source") == product.photo.name:
+        return False
+    else:
+        variants = build_variants(product.photo)
+
+    stale = {
+        size: name for size, name in old.items()
+        if size in IMAGE_SIZES and name not in variants.values()
+    }
+    if stale:
+        # Файлы, нужные другим товарам, остаются на месте.
+        shared = variants_in_use(stale.values(), exclude_pk=product.pk)
+        stale = {size: name for size, name in stale.items() if name not in shared}
+    if stale:
+        delete_variants(product.photo.storage, stale)
+
+    product.photo_variants = variants
+    Product.objects.filter(pk=product.pk).update(photo_variants=variants)
+    bump_version(CATALOG)
+    return True
@@ -0,0 +1,265 @@
+"""
+Потоковый импорт товаров из CSV или JSONL.
+
+Файл читается построчно и обрабатывается пачками по batch_size строк,
+каждая пачка — своя транзакция: bulk_create новых товаров и bulk_update
+изменившихся (upsert по Product.external_id). Память не зависит от
+размера файла.
+
+Поля строки: external_id, name, category, price, description, image.
+category — название, недостающие категории создаются. image — имя файла
+в каталоге images_dir; копия кладётся в storage под именем с хэшем
+содержимого, поэтому повторный импорт не копирует файлы заново.
+
+bulk-операции не шлют post_save, поэтому поисковый индекс, WebP-производные
+и версия каталога обновляются здесь же, по пачке.
+"""
+import csv
+import hashlib
+import json
+import os
+import posixpath
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.db import transaction
+
+from .images import sync_product_variants
+from .models import Category, Product
+from .search import get_backend
+from .versions import CATALOG, bump_version
+
+
+DEFAULT_BATCH_SIZE = 500
+MAX_ERRORS = 100
+PHOTO_DIR = "products"
+
+UPDATE_FIELDS = ["name", "category", "price", "description", "photo"]
+MAX_PRICE = Decimal("99999999.99")
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.errors = []  # (номер строки, сообщение), первые MAX_ERRORS
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def warn(self, line, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+    def error(self, line, message):
+        self.skipped += 1
+        self.warn(line, message)
+
+
+def detect_format(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    raise ValueError(f"Неизвестный формат файла: {filename}")
+
+
+def iter_rows(fh, fmt):
+    """
+    (номер строки, dict | None) из текстового потока; None — строку
+    не удалось разобрать.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(fh)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+
+def _text(raw, field, max_length=None, required=False):
+    value = raw.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"пустое поле {field}")
+    if max_length and len(value) > max_length:
+        raise RowError(f"{field} длиннее {max_length} символов")
+    return value
+
+
+def clean_row(raw):
+    """
+    Проверяет и нормализует строку файла. RowError — строку пропускаем.
+    """
+    if raw is None:
+        raise RowError("строку не удалось разобрать")
+
+    try:
+        price = Decimal(_text(raw, "price") or "0")
+        # NaN и Infinity: сравнение с NaN бросает InvalidOperation.
+        if not price.is_finite():
+            raise InvalidOperation
+        price = price.quantize(Decimal("0.01"))
+    except InvalidOperation:
+        raise RowError(f"некорректная цена: {raw.get('price')!r}")
+    if price < 0 or price > MAX_PRICE:
+        raise RowError(f"цена вне диапазона: {price}")
+
+    return {
+        "external_id": _text(raw, "external_id", 100, required=True),
+        "name": _text(raw, "name", 255, required=True),
+        "category": _text(raw, "category", 255, required=True),
+        "price": price,
+        "description": _text(raw, "description"),
+        # Только имя файла: пути из файла импорта не должны выходить из images_dir.
+        "image": os.path.basename(_text(raw, "image")),
+    }
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def store_image(images_dir, filename, storage):
+    """
+    Копирует файл в storage (если такой копии ещё нет) и возвращает её имя.
+    """
+    path = os.path.join(images_dir, filename)
+    if not os.path.isfile(path):
+        raise RowError(f"нет файла изображения {filename}")
+    stem, ext = os.path.splitext(filename)
+    name = posixpath.join(PHOTO_DIR, f"{stem}-{_file_digest(path)}{ext.lower()}")
+    if not storage.exists(name):
+        with open(path, "rb") as fh:
+            name = storage.save(name, File(fh))
+    return name
+
+
+def _snapshot(product):
+    return (product.name, product.category_id, product.price, product.description, product.photo.name)
+
+
+def _resolve_categories(names, categories):
+    """
+    Дополняет кэш categories (название -> id), создавая недостающие.
+    """
+    missing = set(names) - categories.keys()
+    if not missing:
+        return
+    Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+    categories.update(Category.objects.filter(name__in=missing).values_list("name", "id"))
+
+
+def _import_batch(batch, stats, categories, images_dir, storage):
+    # Повтор external_id внутри пачки: побеждает последняя строка.
+    rows = {data["external_id"]: (line, data) for line, data in batch}
+    changed_photos = []
+
+    with transaction.atomic():
+        _resolve_categories({data["category"] for _, data in rows.values()}, categories)
+        existing = Product.objects.in_bulk(list(rows), field_name="external_id")
+
+        to_create, to_update = [], []
+        for key, (line, data) in rows.items():
+            product = existing.get(key) or Product(external_id=key)
+            before = _snapshot(product) if product.pk else None
+
+            # Без картинки товар всё равно импортируем, фото остаётся прежним.
+            photo = product.photo.name
+            if data["image"]:
+                if images_dir is None:
+                    stats.warn(line, "image указан, но каталог изображений не задан")
+                else:
+                    try:
+                        photo = store_image(images_dir, data["image"], storage)
+                    except (RowError, OSError) as exc:
+                        stats.warn(line, str(exc))
+
+            product.name = data["name"]
+            product.category_id = categories[data["category"]]
+            product.price = data["price"]
+            product.description = data["description"]
+            product.photo.name = photo
+
+            if before is None:
+                to_create.append(product)
+            elif _snapshot(product) != before:
+                to_update.append(product)
+            else:
+                stats.unchanged += 1
+                continue
+            if photo and (before is None or before[-1] != photo):
+                changed_photos.append(product)
+
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, UPDATE_FIELDS)
+        get_backend().index_products(to_create + to_update)
+
+    stats.created += len(to_create)
+    stats.updated += len(to_update)
+
+    # Картинки — вне транзакции, чтобы не держать блокировку записи.
+    for product in changed_photos:
+        try:
+            sync_product_variants(product)
+        except OSError as exc:
+            stats.warn(None, f"{product.external_id}: {exc}")
+    if to_create or to_update:
+        bump_version(CATALOG)
+
+
+def import_products(rows, images_dir=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Импортирует строки из iter_rows(). progress(stats) вызывается после
+    каждой пачки. Возвращает ImportStats.
+    """
+    stats = ImportStats()
+    categories = {}
+    storage = Product._meta.get_field("photo").storage
+
+    batch = []
+    for line, raw in rows:
+        stats.rows += 1
+        try:
+            batch.append((line, clean_row(raw)))
+        except RowError as exc:
+            stats.error(line, str(exc))
+        if len(batch) >= batch_size:
+            _import_batch(batch, stats, categories, images_dir, storage)
+            batch = []
+            if progress:
+                progress(stats)
+
+    if batch:
+        _import_batch(batch, stats, categories, images_dir, storage)
+    if progress:
+        progress(stats)
+    return stats
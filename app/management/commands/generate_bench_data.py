@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app.benchmark import generate_dataset
+
+
+class Command(BaseCommand):
+    help = "Генерирует синтетические данные для бенчмарков (запускать на отдельной базе)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=30)
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--users", type=int, default=5_000)
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--carts", type=int, default=2_000, help="Пользователей с корзиной.")
+        parser.add_argument("--guest-carts", type=int, default=2_000)
+        parser.add_argument("--review-rate", type=float, default=0.05)
+        parser.add_argument("--days", type=int, default=365, help="Глубина истории заказов.")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+
+    def handle(self, *args, **options):
+        counts = generate_dataset(
+            categories=options["categories"],
+            products=options["products"],
+            users=options["users"],
+            orders=options["orders"],
+            carts=options["carts"],
+            guest_carts=options["guest_carts"],
+            review_rate=options["review_rate"],
+            days=options["days"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(json.dumps(counts, ensure_ascii=False)))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from app.images import sync_product_variants
+from app.models import Product
+
+
+class Command(BaseCommand):
+    help = "Создаёт WebP-производные (thumb, card, detail) для фото товаров."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Пересоздать даже если производные уже есть.",
+        )
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        products = Product.objects.exclude(photo="").exclude(photo__isnull=True)
+        for product in products.only("id", "photo", "photo_variants").iterator():
+            try:
+                if sync_product_variants(product, force=options["force"]):
+                    done += 1
+            except OSError as exc:
+                failed += 1
+                self.stderr.write(f"#{product.pk} {product.photo.name}: {exc}")
+        self.stdout.write(self.style.SUCCESS(f"Обработано: {done}, ошибок: {failed}"))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.importer import DEFAULT_BATCH_SIZE, detect_format, import_products, iter_rows
+
+
+class Command(BaseCommand):
+    help = "Импортирует товары из CSV или JSONL (upsert по external_id)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл .csv или .jsonl.")
+        parser.add_argument(
+            "--format",
+            choices=("csv", "jsonl"),
+            default=None,
+            help="Формат файла (по умолчанию — по расширению).",
+        )
+        parser.add_argument(
+            "--images",
+            default=None,
+            help="Каталог с файлами изображений из поля image.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Строк в одной транзакции.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options["format"] or detect_format(options["path"])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        try:
+            fh = open(options["path"], encoding="utf-8-sig", newline="")
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        with fh:
+            stats = import_products(
+                iter_rows(fh, fmt),
+                images_dir=options["images"],
+                batch_size=max(1, options["batch_size"]),
+                progress=self._progress,
+            )
+
+        for line, message in stats.errors:
+            prefix = f"строка {line}: " if line else ""
+            self.stderr.write(f"{prefix}{message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {stats.elapsed:.1f} с: создано {stats.created}, "
+            f"обновлено {stats.updated}, без изменений {stats.unchanged}, "
+            f"пропущено {stats.skipped}"
+        ))
+
+    def _progress(self, stats):
+        self.stdout.write(
+            f"{stats.rows} строк, {stats.rate:.0f} строк/с "
+            f"(создано {stats.created}, обновлено {stats.updated}, пропущено {stats.skipped})"
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = "Пересобирает матрицу совместных покупок и top-K рекомендаций по заказам."
+
+    def handle(self, *args, **options):
+        pairs = rebuild_recommendations()
+        self.stdout.write(self.style.SUCCESS(f"Пар товаров: {pairs}"))
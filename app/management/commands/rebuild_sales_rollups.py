@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Пересобирает почасовые сводки продаж (SalesRollup и др.) по заказам."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Пересобрать только последние N дней (по умолчанию — всё).",
+        )
+
+    def handle(self, *args, **options):
+        since = None
+        if options["days"] is not None:
+            since = timezone.now() - timedelta(days=options["days"])
+        hours = rebuild_rollups(since=since)
+        self.stdout.write(self.style.SUCCESS(f"Часовых сводок: {hours}"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Product
+from app.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Перестраивает поисковый индекс товаров."
+
+    def handle(self, *args, **options):
+        count = get_backend().rebuild(Product.objects.order_by("id"))
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано товаров: {count}"))
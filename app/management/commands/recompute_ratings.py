@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.ratings import recompute_all_ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает Product.rating_avg и rating_count по отзывам."
+
+    def handle(self, *args, **options):
+        count = recompute_all_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано товаров: {count}"))
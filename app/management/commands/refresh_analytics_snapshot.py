@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.analytics import available, refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Дописывает новые заказы в колоночный снимок аналитики (ANALYTICS_SNAPSHOT_DIR). "
+        "Запускать по расписанию; --full — пересобрать, чтобы учесть смену статусов."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Пересобрать снимок с нуля.")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Заказов за один запрос.")
+
+    def handle(self, *args, **options):
+        if not available():
+            raise CommandError("Для снимка аналитики нужен NumPy: pip install numpy")
+
+        def progress(meta):
+            self.stdout.write(f"  заказов: {meta['orders']}, позиций: {meta['items']}")
+
+        meta = refresh_snapshot(full=options["full"], chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Снимок: {meta['orders']} заказов, {meta['items']} позиций (до #{meta['last_order_id']})"
+        ))
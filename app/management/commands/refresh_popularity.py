@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        "Обновляет хиты и тренды (Product/Category.*_score) по закрытым часам продаж. "
+        "Запускать по расписанию, например раз в час; --full — раз в сутки."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Пересчитать с нуля, а не только новые часы.",
+        )
+
+    def handle(self, *args, **options):
+        products = refresh_popularity(full=options["full"])
+        self.stdout.write(self.style.SUCCESS(f"Товаров с новыми продажами: {products}"))
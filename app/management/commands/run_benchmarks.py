@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.benchmark import SCENARIOS, HTTPTransport, TestClientTransport, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет сценарии (каталог, товар, корзина, checkout, статистика) "
+        "и печатает p50/p95/p99, пропускную способность и число SQL-запросов в JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Замеров на сценарий.")
+        parser.add_argument("--warmup", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Число потоков, одновременно выполняющих запросы сценария.",
+        )
+        parser.add_argument(
+            "--scenario",
+            action="append",
+            choices=sorted(SCENARIOS),
+            help="Запустить только указанные сценарии (можно повторять).",
+        )
+        parser.add_argument("--username", help="Пользователь для входа (пароль бенч-пользователей).")
+        parser.add_argument(
+            "--base-url",
+            help="Гнать запросы в запущенный сервер вместо django.test.Client.",
+        )
+        parser.add_argument("--host", default="localhost", help="Host для django.test.Client.")
+        parser.add_argument("--output", help="Файл для JSON-отчёта (по умолчанию stdout).")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency должно быть не меньше 1.")
+
+        if options["base_url"]:
+            transport = HTTPTransport(options["base_url"])
+        else:
+            transport = TestClientTransport(host=options["host"])
+
+        try:
+            report = run_benchmarks(
+                transport,
+                scenarios=options["scenario"],
+                requests=options["requests"],
+                warmup=options["warmup"],
+                seed=options["seed"],
+                username=options["username"],
+                concurrency=options["concurrency"],
+            )
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fh:
+                fh.write(data + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Отчёт: {options['output']}"))
+        else:
+            self.stdout.write(data)
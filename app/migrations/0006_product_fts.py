@@ -0,0 +1,41 @@
+from django.db import migrations
+
+FTS_TABLE = "app_product_fts"
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    from app.search import normalize_text
+
+    Product = apps.get_model("app", "Product")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+            [
+                (pk, normalize_text(name), normalize_text(description))
+                for pk, name, description in Product.objects.values_list("id", "name", "description")
+            ],
+        )
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_alter_category_options_alter_order_options_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:25
+
+from django.db import migrations, models
+from django.db.models import Avg, Count
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model("app", "Product")
+    Review = apps.get_model("app", "Review")
+    for row in Review.objects.values("product_id").annotate(avg=Avg("rating"), count=Count("id")):
+        Product.objects.filter(pk=row["product_id"]).update(
+            rating_avg=row["avg"],
+            rating_count=row["count"],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_product_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:43
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """
+    Старый unique_together не мешал дублям: складываем их в одну строку.
+    """
+    CartItem = apps.get_model("app", "CartItem")
+    groups = (
+        ("user", "product", CartItem.objects.filter(user__isnull=False)),
+        ("session_key", "product", CartItem.objects.filter(user__isnull=True)),
+    )
+    for owner, product, qs in groups:
+        duplicates = (
+            qs.values(owner, product)
+            .annotate(n=Count("id"), keep=Min("id"), qty=Sum("quantity"))
+            .filter(n__gt=1)
+        )
+        for row in duplicates:
+            lines = qs.filter(**{owner: row[owner], product: row[product]})
+            lines.exclude(id=row["keep"]).delete()
+            lines.filter(id=row["keep"]).update(quantity=row["qty"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_product_external_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together=set(),
+        ),
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'product'), name='cartitem_unique_user_product'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('session_key', 'product'), name='cartitem_unique_guest_product'),
+        ),
+    ]
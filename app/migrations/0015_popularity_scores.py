@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('through_hour', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='bestseller_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='trending_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='bestseller_score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'bestseller_score'], name='product_category_popular_idx'),
+        ),
+    ]
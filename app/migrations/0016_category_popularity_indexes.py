@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_popularity_scores'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-bestseller_score', 'name'], name='category_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['-trending_score', 'name'], name='category_trending_idx'),
+        ),
+    ]
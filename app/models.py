@@ -8,9 +8,18 @@ User = settings.AUTH_USER_MODEL
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
 
+    # Сумма популярности товаров категории, обновляет app.popularity.
+    # По ним упорядочен фильтр категорий при sort=popular / trending.
+    bestseller_score = models.FloatField(default=0, editable=False)
+    trending_score = models.FloatField(default=0, editable=False)
+
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
+        indexes = [
+            models.Index(fields=["-bestseller_score", "name"], name="category_popular_idx"),
+            models.Index(fields=["-trending_score", "name"], name="category_trending_idx"),
+        ]
 
     def __str__(self):
         return self.name
@@ -28,12 +37,87 @@ class Product(models.Model):
     photo = models.ImageField(upload_to="products/", blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
 
+    # Остаток на складе; None — остатки не ведутся. Меняется только
+    # условными UPDATE из app.stock (в админке — действие «Пополнить остатки»).
+    stock = models.PositiveIntegerField(null=True, blank=True)
+
+    # Артикул во внешней системе; по нему импорт (app.importer) делает upsert.
+    external_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
+
+    # Карта WebP-производных фото, заполняется app.images.
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    # Денормализованный рейтинг, обновляется в app.ratings.
+    rating_avg = models.FloatField(default=0, db_index=True)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    # Продажи с экспоненциальным затуханием (хиты — медленным, тренды —
+    # быстрым). Пересчитывает команда refresh_popularity, см. app.popularity.
+    bestseller_score = models.FloatField(default=0, db_index=True, editable=False)
+    trending_score = models.FloatField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        # Под фильтры и сортировки каталога (app.catalog, app.facets):
+        # категория + цена, категория + новизна, категория + популярность
+        # и те же сортировки без категории. Второй ключ сортировки, id,
+        # SQLite берёт из rowid.
+        indexes = [
+            models.Index(fields=["category", "price"], name="product_category_price_idx"),
+            models.Index(fields=["category", "created_at"], name="product_category_created_idx"),
+            models.Index(fields=["category", "bestseller_score"], name="product_category_popular_idx"),
+            models.Index(fields=["price"], name="product_price_idx"),
+            models.Index(fields=["created_at"], name="product_created_idx"),
+        ]
+
     @property
     def photo_url(self):
         if self.photo and hasattr(self.photo, "url"):
             return self.photo.url
         return ""
 
+    @property
+    def current_photo_variants(self):
+        """
+        photo_variants, если они построены из текущего фото. После замены
+        фото, которую app.images не смог обработать, карта ещё описывает
+        прежнее — тогда её не используем.
+        """
+        variants = self.photo_variants or {}
+        if not self.photo or variants.get("source") != self.photo.name:
+            return {}
+        return variants
+
+    @property
+    def photo_urls(self):
+        """
+        {"thumb": url, "card": url, "detail": url, "original": url}.
+        Пока производных нет, все размеры указывают на оригинал.
+        """
+        original = self.photo_url
+        if not original:
+            return {}
+        storage = self.photo.storage
+        variants = self.current_photo_variants
+        urls = {"original": original}
+        for size in ("thumb", "card", "detail"):
+            name = variants.get(size)
+            urls[size] = storage.url(name) if name else original
+        return urls
+
+    @property
+    def photo_srcset(self):
+        from .images import IMAGE_SIZES
+
+        names = self.current_photo_variants
+        if not names:
+            return ""
+        storage = self.photo.storage
+        return ", ".join(
+            f"{storage.url(names[size])} {width}w"
+            for size, (width, _, _) in IMAGE_SIZES.items()
+            if names.get(size)
+        )
+
     def __str__(self):
         return self.name
 
@@ -60,7 +144,22 @@ class CartItem(models.Model):
     added_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        unique_together = ("user", "product", "session_key")
+        # Одна строка на товар у владельца. unique_together по
+        # (user, product, session_key) не работал: одно из полей всегда NULL,
+        # а NULL в уникальном индексе не равен сам себе. На эти индексы
+        # опирается upsert в app.cartops.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"],
+                condition=models.Q(user__isnull=False),
+                name="cartitem_unique_user_product",
+            ),
+            models.UniqueConstraint(
+                fields=["session_key", "product"],
+                condition=models.Q(user__isnull=True),
+                name="cartitem_unique_guest_product",
+            ),
+        ]
 
     @property
     def total_price(self):
@@ -95,13 +194,30 @@ class Order(models.Model):
 
     class Meta:
         ordering = ("-created_at",)
+        # Отчёты и выгрузки фильтруют по статусу и периоду,
+        # история покупок (app.purchases) — по покупателю и статусу.
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="order_status_created_idx"),
+            models.Index(fields=["user", "status"], name="order_user_status_idx"),
+            models.Index(fields=["created_at"], name="order_created_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Статус на момент загрузки — чтобы app.rollups видел смену статуса.
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
 
     def __str__(self):
         return f"Заказ #{self.id}"
 
     @property
     def items_count(self):
-        return sum(i.quantity for i in self.items.all())
+        prefetched = getattr(self, "_prefetched_objects_cache", {}).get("items")
+        if prefetched is not None:
+            return sum(i.quantity for i in prefetched)
+        return self.items.aggregate(s=models.Sum("quantity"))["s"] or 0
 
 
 class OrderItem(models.Model):
@@ -115,6 +231,13 @@ class OrderItem(models.Model):
     unit_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # Покрывающий индекс для «какие товары в этих заказах»
+        # (покупки пользователя, выгрузки, сводки по товарам).
+        indexes = [
+            models.Index(fields=["order", "product"], name="orderitem_order_product_idx"),
+        ]
+
     @property
     def total_price(self):
         return self.unit_price * self.quantity
@@ -148,3 +271,92 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.user} — {self.product} — {self.rating}★"
+
+
+class SalesRollup(models.Model):
+    """
+    Почасовая сводка продаж (только completed-заказы).
+    Поддерживается app.rollups, пересобирается командой rebuild_sales_rollups.
+    """
+    hour = models.DateTimeField(unique=True)
+    orders_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ("hour",)
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 — {self.revenue}"
+
+
+class CategorySalesRollup(models.Model):
+    hour = models.DateTimeField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("hour", "category")
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 — {self.category_id} — {self.revenue}"
+
+
+class ProductSalesRollup(models.Model):
+    hour = models.DateTimeField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("hour", "product")
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H}:00 — {self.product_id} — {self.revenue}"
+
+
+class PopularityState(models.Model):
+    """
+    Одна строка: продажи из ProductSalesRollup до часа through_hour
+    (не включая) уже учтены в *_score. Ведёт app.popularity.
+    """
+    through_hour = models.DateTimeField()
+
+    def __str__(self):
+        return f"popularity through {self.through_hour:%Y-%m-%d %H}:00"
+
+
+class ProductPair(models.Model):
+    """
+    Разреженная матрица совместных покупок: в скольких completed-заказах
+    товары product и other были вместе. Хранится в обе стороны.
+    Поддерживается app.recommendations, пересобирается командой
+    rebuild_recommendations.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    orders_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("product", "other")
+
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id} — {self.orders_count}"
+
+
+class ProductRecommendation(models.Model):
+    """
+    «Часто покупают вместе»: top-K соседей товара из ProductPair,
+    уже упорядоченные по rank. Страница товара читает только эту таблицу.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    orders_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("product", "rank")
+        ordering = ("product", "rank")
+
+    def __str__(self):
+        return f"{self.product_id} #{self.rank}: {self.recommended_id}"
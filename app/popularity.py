@@ -0,0 +1,154 @@
+"""
+Хиты и тренды: продажи товара в штуках с экспоненциальным затуханием.
+
+    score(T) = Σ units_h · 0.5 ** ((T - h) / half_life)
+
+по часовым строкам ProductSalesRollup (только completed-заказы).
+bestseller_score затухает медленно (HALF_LIVES), trending_score — быстро.
+Категория получает сумму по своим товарам.
+
+Пересчёт инкрементальный: очки «старятся» одним UPDATE на множитель
+за прошедшее время, и прибавляются только часы после PopularityState.
+Текущий, ещё не закрытый час не учитывается. Сортировки sort=popular
+и sort=trending в каталоге — обычный ORDER BY по индексу.
+
+Отмены старых заказов меняют уже учтённые часы — их догоняет
+refresh_popularity --full.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Category, PopularityState, Product, ProductSalesRollup
+from .rollups import hour_bucket
+from .versions import CATALOG, bump_version
+
+
+HALF_LIVES = getattr(settings, "POPULARITY_HALF_LIVES", {
+    "bestseller_score": timedelta(days=30),
+    "trending_score": timedelta(days=3),
+})
+
+# Меньше этого очки обнуляются, чтобы не «старить» вечно давно забытые товары.
+MIN_SCORE = 1e-3
+
+# Полный пересчёт берёт столько самых медленных полураспадов:
+# более старые продажи весят меньше 0.1%.
+FULL_WINDOW_HALF_LIVES = 10
+
+UPDATE_CHUNK = 500
+
+
+def decay_factor(field, elapsed):
+    return 0.5 ** (elapsed / HALF_LIVES[field])
+
+
+def _decay_all(elapsed):
+    """
+    Умножает очки всех товаров с ненулевыми очками на множитель затухания.
+    """
+    updates = {}
+    for field in HALF_LIVES:
+        factor = decay_factor(field, elapsed)
+        updates[field] = Case(
+            When(**{f"{field}__lt": MIN_SCORE / factor}, then=Value(0.0)),
+            default=F(field) * Value(factor),
+            output_field=FloatField(),
+        )
+    nonzero = Q()
+    for field in HALF_LIVES:
+        nonzero |= Q(**{f"{field}__gt": 0})
+    Product.objects.filter(nonzero).update(**updates)
+
+
+def _gains(since, until):
+    """
+    {product_id: {field: прирост}} по закрытым часам [since, until),
+    каждый час взвешен по возрасту на момент until.
+    """
+    rows = ProductSalesRollup.objects.filter(hour__lt=until, units__gt=0)
+    if since is not None:
+        rows = rows.filter(hour__gte=since)
+
+    gains = defaultdict(lambda: dict.fromkeys(HALF_LIVES, 0.0))
+    weights = {}
+    for product_id, hour, units in rows.values_list("product_id", "hour", "units").iterator():
+        if hour not in weights:
+            # Середина часа — средний момент продажи в нём.
+            age = until - (hour + timedelta(minutes=30))
+            weights[hour] = {field: decay_factor(field, age) for field in HALF_LIVES}
+        for field, weight in weights[hour].items():
+            gains[product_id][field] += units * weight
+    return gains
+
+
+def _add_gains(gains):
+    """
+    score += прирост: один UPDATE с CASE на пачку товаров.
+    """
+    product_ids = list(gains)
+    for start in range(0, len(product_ids), UPDATE_CHUNK):
+        chunk = product_ids[start:start + UPDATE_CHUNK]
+        updates = {
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(gains[pk][field])) for pk in chunk],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+            for field in HALF_LIVES
+        }
+        Product.objects.filter(pk__in=chunk).update(**updates)
+
+
+def _refresh_categories():
+    updates = {}
+    for field in HALF_LIVES:
+        total = (
+            Product.objects.filter(category_id=OuterRef("pk"))
+            .order_by()
+            .values("category_id")
+            .annotate(s=Sum(field))
+            .values("s")
+        )
+        updates[field] = Coalesce(Subquery(total, output_field=FloatField()), Value(0.0))
+    Category.objects.update(**updates)
+
+
+def refresh_popularity(now=None, full=False):
+    """
+    Доводит очки до начала текущего часа. full=True — пересчёт с нуля
+    за FULL_WINDOW_HALF_LIVES самых медленных полураспадов.
+    Возвращает число товаров с новыми продажами.
+    """
+    until = hour_bucket(now or timezone.now())
+
+    with transaction.atomic():
+        state = PopularityState.objects.select_for_update().first()
+        if full or state is None:
+            Product.objects.filter(Q(bestseller_score__gt=0) | Q(trending_score__gt=0)).update(
+                **dict.fromkeys(HALF_LIVES, 0.0)
+            )
+            since = until - max(HALF_LIVES.values()) * FULL_WINDOW_HALF_LIVES
+        elif state.through_hour >= until:
+            return 0
+        else:
+            since = state.through_hour
+            _decay_all(until - since)
+
+        gains = _gains(since, until)
+        _add_gains(gains)
+        _refresh_categories()
+
+        if state is None:
+            PopularityState.objects.create(through_hour=until)
+        else:
+            state.through_hour = until
+            state.save(update_fields=["through_hour"])
+
+    bump_version(CATALOG)
+    return len(gains)
@@ -0,0 +1,54 @@
+"""
+Что пользователь купил (completed-заказы) и на что уже оставил отзыв —
+одним UNION-запросом, с кэшем на время запроса.
+"""
+from django.db.models import CharField, Value
+
+from .models import OrderItem, Review
+
+
+class PurchaseIndex:
+    def __init__(self, bought=(), reviewed=()):
+        self.bought = set(bought)
+        self.reviewed = set(reviewed)
+
+    def has_bought(self, product_id):
+        return product_id in self.bought
+
+    def has_reviewed(self, product_id):
+        return product_id in self.reviewed
+
+    def can_review(self, product_id):
+        return product_id in self.bought and product_id not in self.reviewed
+
+
+def load_purchase_index(user):
+    if not user.is_authenticated:
+        return PurchaseIndex()
+
+    bought = (
+        OrderItem.objects.filter(order__user=user, order__status="completed")
+        .values_list("product_id", Value("b", output_field=CharField()))
+        .order_by()
+    )
+    reviewed = (
+        Review.objects.filter(user=user)
+        .values_list("product_id", Value("r", output_field=CharField()))
+        .order_by()
+    )
+
+    index = PurchaseIndex()
+    for product_id, kind in bought.union(reviewed):
+        if kind == "b":
+            index.bought.add(product_id)
+        else:
+            index.reviewed.add(product_id)
+    return index
+
+
+def get_purchase_index(request):
+    index = getattr(request, "_purchase_index", None)
+    if index is None:
+        index = load_purchase_index(request.user)
+        request._purchase_index = index
+    return index
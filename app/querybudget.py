@@ -0,0 +1,225 @@
+"""
+Учёт SQL-запросов на запрос: количество, суммарное время, повторяющиеся
+«формы» запросов (N+1). Работает через connection.execute_wrapper,
+поэтому не требует DEBUG.
+
+Бюджет вьюхи задаётся декоратором @query_budget(...) или берётся
+из settings.QUERY_BUDGET:
+
+    QUERY_BUDGET = {
+        "MAX_QUERIES": 30,      # по умолчанию для вьюх без декоратора
+        "MAX_DUPLICATES": 5,    # сколько раз можно повторить одну форму
+        "RAISE": False,         # True — исключение вместо warning (в тестах)
+    }
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger("app.querybudget")
+
+DEFAULTS = {
+    "MAX_QUERIES": 30,
+    "MAX_DUPLICATES": 5,
+    "RAISE": False,
+}
+
+_IN_LIST_RE = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "QUERY_BUDGET", {}))
+    return config
+
+
+def query_shape(sql):
+    """
+    Нормализует SQL: параметры и литералы -> ?, списки IN (...) -> (?...).
+    """
+    shape = _IN_LIST_RE.sub("(?...)", sql)
+    shape = _LITERAL_RE.sub("?", shape)
+    return shape.replace("%s", "?")
+
+
+class QueryRecorder:
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        # (alias, sql, params) — для full_scans(); по умолчанию не копим.
+        self.statements = [] if keep_statements else None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+            if self.statements is not None and not many:
+                self.statements.append((context["connection"].alias, sql, params))
+
+    def duplicates(self, threshold):
+        """
+        Формы, повторённые больше threshold раз: [(shape, count), ...].
+        """
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+@contextmanager
+def record_queries(using=None, keep_statements=False):
+    """
+    with record_queries() as rec: ...  — rec.count, rec.duration, rec.shapes.
+    keep_statements=True — ещё и rec.statements для full_scans().
+    """
+    recorder = QueryRecorder(keep_statements)
+    aliases = [using] if using else list(connections)
+    with _wrapped(aliases, recorder):
+        yield recorder
+
+
+@contextmanager
+def _wrapped(aliases, recorder):
+    if not aliases:
+        yield
+        return
+    with connections[aliases[0]].execute_wrapper(recorder):
+        with _wrapped(aliases[1:], recorder):
+            yield
+
+
+def query_budget(max_queries=None, max_duplicates=None):
+    """
+    Объявляет бюджет вьюхи (функции или класса APIView).
+    """
+    def decorator(view):
+        view.query_budget = {"max_queries": max_queries, "max_duplicates": max_duplicates}
+        return view
+    return decorator
+
+
+def budget_for(view_func):
+    config = get_config()
+    declared = getattr(view_func, "query_budget", None)
+    if declared is None:
+        # APIView.as_view() сохраняет класс в view_class.
+        declared = getattr(getattr(view_func, "view_class", None), "query_budget", None) or {}
+    max_queries = declared.get("max_queries")
+    max_duplicates = declared.get("max_duplicates")
+    return (
+        config["MAX_QUERIES"] if max_queries is None else max_queries,
+        config["MAX_DUPLICATES"] if max_duplicates is None else max_duplicates,
+    )
+
+
+def check_budget(recorder, max_queries, max_duplicates, label):
+    """
+    Возвращает список нарушений (пустой — всё в порядке).
+    """
+    problems = []
+    if recorder.count > max_queries:
+        problems.append(f"{label}: {recorder.count} queries, budget {max_queries}")
+    for shape, n in recorder.duplicates(max_duplicates):
+        problems.append(f"{label}: same query repeated {n} times (limit {max_duplicates}): {shape[:200]}")
+    return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы каждого HTTP-запроса и сверяет с бюджетом вьюхи.
+    При DEBUG добавляет заголовок Server-Timing.
+
+    В async-цепочке (ASGI) пропускает запросы без учёта: ORM там ходит
+    через другие потоки, и execute_wrapper их не видит.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.get_response(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            max_queries, max_duplicates = budget_for(match.func)
+            problems = check_budget(recorder, max_queries, max_duplicates, match.view_name or request.path)
+            if problems:
+                if get_config()["RAISE"]:
+                    raise QueryBudgetExceeded("\n".join(problems))
+                for problem in problems:
+                    logger.warning(problem)
+
+        if settings.DEBUG:
+            response["Server-Timing"] = (
+                f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+            )
+        return response
+
+
+@contextmanager
+def assert_query_budget(max_queries, max_duplicates=None, label="block"):
+    """
+    Для тестов: падает, если блок превысил бюджет или повторял один запрос.
+    """
+    if max_duplicates is None:
+        max_duplicates = get_config()["MAX_DUPLICATES"]
+    with record_queries() as recorder:
+        yield recorder
+    problems = check_budget(recorder, max_queries, max_duplicates, label)
+    if problems:
+        raise QueryBudgetExceeded("\n".join(problems))
+
+
+_FULL_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+_PLANNED = ("SELECT", "UPDATE", "DELETE", "WITH")
+
+
+def full_scans(statements):
+    """
+    Запросы из rec.statements, план которых читает таблицу целиком
+    (EXPLAIN QUERY PLAN: «SCAN <таблица>» без индекса). Проход по
+    подзапросу во FROM (CTE, окна) — не таблица и не считается.
+    Возвращает [(table, sql), ...]. Только для SQLite.
+    """
+    found = []
+    seen = set()
+    tables = {}
+    for alias, sql, params in statements:
+        if (alias, sql) in seen or not sql.lstrip().upper().startswith(_PLANNED):
+            continue
+        seen.add((alias, sql))
+        connection = connections[alias]
+        if connection.vendor != "sqlite":
+            continue
+        with connection.cursor() as cursor:
+            if alias not in tables:
+                tables[alias] = set(connection.introspection.table_names(cursor))
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            for row in cursor.fetchall():
+                match = _FULL_SCAN_RE.match(row[-1])
+                if match and match.group(1) in tables[alias]:
+                    found.append((match.group(1), sql))
+    return found
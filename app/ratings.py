@@ -0,0 +1,75 @@
+"""
+Денормализованный рейтинг товара: Product.rating_avg и Product.rating_count.
+Обновляется инкрементально одним UPDATE; recompute_ratings лечит расхождения.
+"""
+from django.db.models import Avg, Count, F, FloatField, Value
+from django.db.models.functions import Cast
+
+from .models import Product, Review
+from .versions import CATALOG, bump_version
+
+
+def apply_review_created(product_id, rating):
+    """
+    avg' = (avg * n + r) / (n + 1), в правой части UPDATE — старые значения.
+    """
+    count = Cast(F("rating_count"), FloatField())
+    Product.objects.filter(pk=product_id).update(
+        rating_avg=(F("rating_avg") * count + Value(float(rating))) / (count + Value(1.0)),
+        rating_count=F("rating_count") + 1,
+    )
+    bump_version(CATALOG)
+
+
+def apply_review_changed(product_id, old_rating, new_rating):
+    """
+    avg' = avg + (new - old) / n
+    """
+    if old_rating != new_rating:
+        Product.objects.filter(pk=product_id, rating_count__gt=0).update(
+            rating_avg=F("rating_avg") + Value(float(new_rating - old_rating))
+            / Cast(F("rating_count"), FloatField()),
+        )
+    # Текст отзыва мог измениться и без рейтинга — страница товара устарела.
+    bump_version(CATALOG)
+
+
+def recompute_product_rating(product_id):
+    data = Review.objects.filter(product_id=product_id).aggregate(
+        avg=Avg("rating"),
+        count=Count("id"),
+    )
+    Product.objects.filter(pk=product_id).update(
+        rating_avg=data["avg"] or 0,
+        rating_count=data["count"],
+    )
+    bump_version(CATALOG)
+
+
+def recompute_all_ratings():
+    """
+    Пересчёт по всем товарам: один GROUP BY и bulk_update.
+    """
+    stats = {
+        row["product_id"]: row
+        for row in Review.objects.values("product_id").annotate(
+            avg=Avg("rating"),
+            count=Count("id"),
+        )
+    }
+    batch = []
+    total = 0
+    for product in Product.objects.only("id", "rating_avg", "rating_count").iterator():
+        row = stats.get(product.pk)
+        product.rating_avg = row["avg"] if row else 0
+        product.rating_count = row["count"] if row else 0
+        batch.append(product)
+        if len(batch) >= 1000:
+            Product.objects.bulk_update(batch, ["rating_avg", "rating_count"])
+            total += len(batch)
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ["rating_avg", "rating_count"])
+        total += len(batch)
+    bump_version(CATALOG)
+    return total
@@ -0,0 +1,146 @@
+"""
+«Часто покупают вместе» по истории completed-заказов.
+
+ProductPair — разреженная матрица совместных покупок (пара хранится в обе
+стороны), ProductRecommendation — top-K соседей каждого товара. Обе
+таблицы обновляются инкрементально при оформлении и смене статуса заказа:
+upsert пар заказа и пересчёт top-K только для товаров этого заказа.
+
+Страница товара и API читают готовый top-K одним запросом по индексу;
+по OrderItem во время запроса ничего не считается.
+
+Заказы больше MAX_BASKET разных товаров не учитываются: пар в них
+квадратично много, а связь между товарами слабая (оптовые закупки).
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Order, OrderItem, ProductPair, ProductRecommendation
+from .rollups import upsert_increment
+from .versions import ORDERS, bump_version
+
+
+TOP_K = getattr(settings, "RECOMMENDATIONS_TOP_K", 8)
+MAX_BASKET = 50
+REFRESH_CHUNK = 500
+
+
+def _pairs(product_ids, sign):
+    ids = sorted(set(product_ids))
+    if not 2 <= len(ids) <= MAX_BASKET:
+        return ids, []
+    return ids, [(a, b, sign) for a in ids for b in ids if a != b]
+
+
+def refresh_top(product_ids, shrink=True):
+    """
+    Пересчитывает top-K для product_ids: один оконный запрос по ProductPair
+    и upsert по (product, rank). shrink=False — списки соседей могли только
+    вырасти (новый заказ), лишних рангов не бывает и удалять нечего.
+    """
+    ranked = (
+        ProductPair.objects.filter(product_id__in=product_ids, orders_count__gt=0)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=F("product_id"),
+            order_by=(F("orders_count").desc(), F("other_id").asc()),
+        ))
+        .filter(position__lte=TOP_K)
+        .values_list("product_id", "other_id", "orders_count", "position")
+    )
+    rows = [
+        ProductRecommendation(
+            product_id=product_id, recommended_id=other_id, rank=position, orders_count=n,
+        )
+        for product_id, other_id, n, position in ranked
+    ]
+    if shrink:
+        ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+    ProductRecommendation.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["product", "rank"],
+        update_fields=["recommended", "orders_count"],
+    )
+
+
+def apply_order(order, sign=1, product_ids=None):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) пары заказа из матрицы
+    и обновляет top-K его товаров. product_ids можно передать, если
+    позиции уже известны (checkout), — тогда OrderItem не читается.
+    """
+    if product_ids is None:
+        product_ids = OrderItem.objects.filter(order_id=order.pk).values_list("product_id", flat=True)
+    ids, rows = _pairs(product_ids, sign)
+    if not rows:
+        return
+
+    # Внутри checkout уже идёт транзакция — savepoint не нужен.
+    with transaction.atomic(savepoint=False):
+        upsert_increment(ProductPair, ["product", "other"], ["orders_count"], rows)
+        refresh_top(ids, shrink=sign < 0)
+
+
+def order_status_changed(order, old_status):
+    if old_status == order.status:
+        return
+    if order.status == "completed":
+        apply_order(order, 1)
+    elif old_status == "completed":
+        apply_order(order, -1)
+
+
+def rebuild_recommendations():
+    """
+    Пересобирает матрицу одним INSERT ... SELECT (самосоединение позиций
+    completed-заказов) и top-K для всех товаров. Возвращает число пар.
+    """
+    qn = connection.ops.quote_name
+    pair = qn(ProductPair._meta.db_table)
+    item = qn(OrderItem._meta.db_table)
+    order = qn(Order._meta.db_table)
+    product_id, order_id = qn("product_id"), qn("order_id")
+
+    sql = (
+        f"INSERT INTO {pair} ({product_id}, {qn('other_id')}, {qn('orders_count')}) "
+        f"SELECT a.{product_id}, b.{product_id}, COUNT(DISTINCT a.{order_id}) "
+        f"FROM {item} a "
+        f"JOIN {item} b ON b.{order_id} = a.{order_id} AND b.{product_id} <> a.{product_id} "
+        f"JOIN {order} o ON o.{qn('id')} = a.{order_id} "
+        f"WHERE o.{qn('status')} = %s AND a.{order_id} IN ("
+        f"SELECT {order_id} FROM {item} GROUP BY {order_id} "
+        f"HAVING COUNT(DISTINCT {product_id}) <= %s) "
+        f"GROUP BY a.{product_id}, b.{product_id}"
+    )
+
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductPair.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, ["completed", MAX_BASKET])
+            pairs = cursor.rowcount
+
+        product_ids = list(
+            ProductPair.objects.values_list("product_id", flat=True).distinct().order_by("product_id")
+        )
+        for start in range(0, len(product_ids), REFRESH_CHUNK):
+            refresh_top(product_ids[start:start + REFRESH_CHUNK])
+
+    bump_version(ORDERS)
+    return pairs
+
+
+def recommended_products(product_id, limit=TOP_K):
+    """
+    Соседи товара в порядке rank. Один запрос по (product, rank);
+    товары, которых нет в наличии, не предлагаем.
+    """
+    rows = (
+        ProductRecommendation.objects.filter(product_id=product_id)
+        .exclude(recommended__stock=0)
+        .select_related("recommended")[:limit]
+    )
+    return [row.recommended for row in rows]
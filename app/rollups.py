@@ -0,0 +1,231 @@
+"""
+Почасовые сводки продаж: SalesRollup, CategorySalesRollup, ProductSalesRollup.
+
+Час считается в TIME_ZONE проекта (Asia/Tashkent). Дни, недели и месяцы
+собираются из часовых строк, поэтому стоимость /api/stats/ зависит от длины
+периода, а не от числа заказов.
+
+Учитываются только completed-заказы. Изменения через QuerySet.update()
+сигналы не видят — для них есть rebuild_sales_rollups.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import (
+    CategorySalesRollup,
+    Order,
+    OrderItem,
+    ProductSalesRollup,
+    SalesRollup,
+)
+from .versions import ORDERS, bump_version
+
+
+GRANULARITIES = ("hour", "day", "week", "month")
+
+LABEL_FORMATS = {
+    "hour": "%Y-%m-%d %H:00",
+    "day": "%Y-%m-%d",
+    "week": "%Y-%m-%d",
+    "month": "%Y-%m",
+}
+
+
+def hour_bucket(dt):
+    return timezone.localtime(dt).replace(minute=0, second=0, microsecond=0)
+
+
+def upsert_increment(model, key_fields, value_fields, rows):
+    """
+    INSERT ... ON CONFLICT DO UPDATE SET v = v + excluded.v одним запросом
+    (SQLite >= 3.24, PostgreSQL). rows — список кортежей key_fields + value_fields.
+    """
+    if not rows:
+        return
+    meta = model._meta
+    columns = [meta.get_field(f).column for f in key_fields + value_fields]
+    key_columns = columns[:len(key_fields)]
+    value_columns = columns[len(key_fields):]
+
+    qn = connection.ops.quote_name
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    sql = (
+        f"INSERT INTO {qn(meta.db_table)} ({', '.join(qn(c) for c in columns)}) "
+        f"VALUES {', '.join([placeholders] * len(rows))} "
+        f"ON CONFLICT ({', '.join(qn(c) for c in key_columns)}) DO UPDATE SET "
+        + ", ".join(f"{qn(c)} = {qn(meta.db_table)}.{qn(c)} + excluded.{qn(c)}" for c in value_columns)
+    )
+
+    fields = [meta.get_field(f) for f in key_fields + value_fields]
+    params = []
+    for row in rows:
+        params.extend(
+            field.get_db_prep_value(value, connection)
+            for field, value in zip(fields, row)
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def apply_order(order, sign=1):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) заказ из сводок.
+    Один запрос на чтение позиций и три upsert-а.
+    """
+    hour = hour_bucket(order.created_at)
+    lines = (
+        OrderItem.objects.filter(order_id=order.pk)
+        .values("product_id", "product__category_id")
+        .annotate(
+            units=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("unit_price")),
+        )
+    )
+
+    by_category = {}
+    product_rows = []
+    total = Decimal("0")
+    for line in lines:
+        units = sign * line["units"]
+        revenue = sign * Decimal(line["revenue"])
+        total += revenue
+        product_rows.append((hour, line["product_id"], units, revenue))
+        cat = by_category.setdefault(line["product__category_id"], [0, Decimal("0")])
+        cat[0] += units
+        cat[1] += revenue
+
+    with transaction.atomic():
+        upsert_increment(
+            SalesRollup, ["hour"], ["orders_count", "revenue"],
+            [(hour, sign, total)],
+        )
+        upsert_increment(
+            CategorySalesRollup, ["hour", "category"], ["units", "revenue"],
+            [(hour, cat_id, units, revenue) for cat_id, (units, revenue) in by_category.items()],
+        )
+        upsert_increment(
+            ProductSalesRollup, ["hour", "product"], ["units", "revenue"],
+            product_rows,
+        )
+    bump_version(ORDERS)
+
+
+def order_status_changed(order, old_status):
+    if old_status == order.status:
+        return
+    if order.status == "completed":
+        apply_order(order, 1)
+    elif old_status == "completed":
+        apply_order(order, -1)
+
+
+def rebuild_rollups(since=None):
+    """
+    Пересобирает сводки с нуля (или начиная с часа since) GROUP BY-ами по заказам.
+    Возвращает число часовых строк SalesRollup.
+    """
+    tz = timezone.get_current_timezone()
+    orders = Order.objects.filter(status="completed")
+    items = OrderItem.objects.filter(order__status="completed")
+    if since is not None:
+        since = hour_bucket(since)
+        orders = orders.filter(created_at__gte=since)
+        items = items.filter(order__created_at__gte=since)
+
+    with transaction.atomic():
+        for model in (SalesRollup, CategorySalesRollup, ProductSalesRollup):
+            qs = model.objects.all()
+            if since is not None:
+                qs = qs.filter(hour__gte=since)
+            qs.delete()
+
+        sales = (
+            orders.annotate(bucket=Trunc("created_at", "hour", tzinfo=tz))
+            .values("bucket")
+            .annotate(n=Count("id"), revenue=Sum("total_price"))
+            .order_by()
+        )
+        sales_rows = [
+            SalesRollup(hour=row["bucket"], orders_count=row["n"], revenue=row["revenue"] or 0)
+            for row in sales.iterator()
+        ]
+        SalesRollup.objects.bulk_create(sales_rows, batch_size=1000)
+
+        item_stats = items.annotate(
+            bucket=Trunc("order__created_at", "hour", tzinfo=tz),
+        )
+        CategorySalesRollup.objects.bulk_create(
+            (
+                CategorySalesRollup(
+                    hour=row["bucket"],
+                    category_id=row["product__category_id"],
+                    units=row["units"],
+                    revenue=row["revenue"],
+                )
+                for row in item_stats.values("bucket", "product__category_id")
+                .annotate(units=Sum("quantity"), revenue=Sum(F("quantity") * F("unit_price")))
+                .order_by()
+                .iterator()
+            ),
+            batch_size=1000,
+        )
+        ProductSalesRollup.objects.bulk_create(
+            (
+                ProductSalesRollup(
+                    hour=row["bucket"],
+                    product_id=row["product_id"],
+                    units=row["units"],
+                    revenue=row["revenue"],
+                )
+                for row in item_stats.values("bucket", "product_id")
+                .annotate(units=Sum("quantity"), revenue=Sum(F("quantity") * F("unit_price")))
+                .order_by()
+                .iterator()
+            ),
+            batch_size=1000,
+        )
+
+    bump_version(ORDERS)
+    return len(sales_rows)
+
+
+def stats_since(days):
+    return hour_bucket(timezone.now() - timedelta(days=days))
+
+
+def sales_series(days, granularity="day"):
+    """
+    (labels, values) выручки по периодам из SalesRollup.
+    """
+    tz = timezone.get_current_timezone()
+    qs = (
+        SalesRollup.objects.filter(hour__gte=stats_since(days))
+        .annotate(bucket=Trunc("hour", granularity, tzinfo=tz))
+        .values("bucket")
+        .annotate(total=Sum("revenue"))
+        .order_by("bucket")
+    )
+    fmt = LABEL_FORMATS[granularity]
+    labels, values = [], []
+    for entry in qs:
+        labels.append(timezone.localtime(entry["bucket"], tz).strftime(fmt))
+        values.append(float(entry["total"] or 0))
+    return labels, values
+
+
+def category_revenue(days):
+    qs = (
+        CategorySalesRollup.objects.filter(hour__gte=stats_since(days))
+        .values("category__name")
+        .annotate(revenue=Sum("revenue"))
+        .filter(revenue__gt=0)
+        .order_by("-revenue")
+    )
+    labels = [entry["category__name"] for entry in qs]
+    values = [float(entry["revenue"] or 0) for entry in qs]
+    return labels, values
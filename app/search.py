@@ -0,0 +1,214 @@
+"""
+Полнотекстовый поиск по товарам.
+
+По умолчанию на SQLite используется виртуальная таблица FTS5 (app_product_fts),
+на остальных СУБД — запасной вариант через icontains.
+Бэкенд можно переопределить настройкой SEARCH_BACKEND (dotted path).
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, FloatField, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+
+FTS_TABLE = "app_product_fts"
+
+# Вес полей в bm25: совпадение в названии важнее описания.
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Окончания для лёгкого русского стемминга, длинные — первыми.
+_RU_ENDINGS = (
+    "иями", "ями", "ами", "ого", "его", "ому", "ему",
+    "ыми", "ими", "ией", "ий", "ый", "ой", "ей", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ых", "их", "ую", "юю", "ов", "ев", "ом", "ем", "ам", "ям",
+    "ах", "ях", "ия", "ья", "ию", "ью",
+    "ы", "и", "а", "я", "о", "е", "у", "ю", "ь", "й",
+)
+_MIN_STEM = 3
+
+
+def normalize_text(text):
+    """
+    Нижний регистр и ё -> е: unicode61 не сводит ё к е сам.
+    """
+    return (text or "").lower().replace("ё", "е")
+
+
+def stem_ru(word):
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def query_terms(query):
+    """
+    Разбивает строку поиска на основы слов.
+    "марсианские чайники" -> ["марсианск", "чайник"]
+    """
+    return [stem_ru(w) for w in _WORD_RE.findall(normalize_text(query))]
+
+
+class SearchBackend:
+    """
+    Интерфейс поискового бэкенда.
+    """
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def index_products(self, products):
+        """
+        Индексирует пачку товаров (массовый импорт обходит post_save).
+        """
+        for product in products:
+            self.index_product(product)
+
+    def rebuild(self, products):
+        """
+        Полностью перестраивает индекс. Возвращает число проиндексированных товаров.
+        """
+        return 0
+
+    def filter_queryset(self, qs, query):
+        raise NotImplementedError
+
+    def rank_queryset(self, qs, query):
+        """
+        Добавляет аннотацию search_rank: чем меньше, тем релевантнее.
+        """
+        raise NotImplementedError
+
+
+class IContainsBackend(SearchBackend):
+    """
+    Запасной бэкенд без индекса: каждое слово ищется через icontains.
+    """
+
+    def filter_queryset(self, qs, query):
+        for term in query_terms(query):
+            qs = qs.filter(Q(name__icontains=term) | Q(description__icontains=term))
+        return qs
+
+    def rank_queryset(self, qs, query):
+        return qs.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    FTS5 с токенизатором unicode61 и префиксным поиском по основам слов.
+    rowid виртуальной таблицы совпадает с Product.id.
+    """
+
+    def match_expression(self, query):
+        terms = query_terms(query)
+        if not terms:
+            return None
+        # Кавычки экранируют служебные символы FTS5, * — префиксный поиск.
+        return " ".join(f'"{t}"*' for t in terms)
+
+    def index_product(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                [product.pk, normalize_text(product.name), normalize_text(product.description)],
+            )
+
+    def remove_product(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+    def index_products(self, products):
+        rows = [
+            (p.pk, normalize_text(p.name), normalize_text(p.description))
+            for p in products
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s",
+                [(row[0],) for row in rows],
+            )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                rows,
+            )
+
+    def rebuild(self, products):
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            rows = (
+                (pk, normalize_text(name), normalize_text(description))
+                for pk, name, description in products.values_list("id", "name", "description").iterator()
+            )
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= 1000:
+                    cursor.executemany(
+                        f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                        batch,
+                    )
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(
+                    f"INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)",
+                    batch,
+                )
+                count += len(batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return count
+
+    def filter_queryset(self, qs, query):
+        match = self.match_expression(query)
+        if match is None:
+            return qs
+        return qs.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [match],
+            )
+        )
+
+    def rank_queryset(self, qs, query):
+        match = self.match_expression(query)
+        if match is None:
+            return IContainsBackend().rank_queryset(qs, query)
+        table = qs.model._meta.db_table
+        return qs.annotate(
+            search_rank=RawSQL(
+                f"SELECT bm25({FTS_TABLE}, %s, %s) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+                [NAME_WEIGHT, DESCRIPTION_WEIGHT, match],
+                output_field=FloatField(),
+            )
+        )
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, "SEARCH_BACKEND", None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == "sqlite":
+            _backend = SQLiteFTSBackend()
+        else:
+            _backend = IContainsBackend()
+    return _backend
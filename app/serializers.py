@@ -5,7 +5,17 @@ from .models import CartItem, Order, OrderItem, Product
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ("id", "name", "price", "description", "photo_url")
+        fields = (
+            "id",
+            "name",
+            "price",
+            "description",
+            "photo_url",
+            "photo_urls",
+            "photo_srcset",
+            "rating_avg",
+            "rating_count",
+        )
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -0,0 +1,57 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .images import sync_product_variants
+from .models import Category, Order, Product
+from .recommendations import apply_order as apply_copurchases
+from .recommendations import order_status_changed as copurchases_status_changed
+from .rollups import apply_order, order_status_changed
+from .search import get_backend
+from .stock import order_status_changed as stock_order_status_changed
+from .versions import CATALOG, bump_version
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_backend().index_product(instance)
+    try:
+        sync_product_variants(instance)
+    except OSError:
+        # Битый или нечитаемый файл — остаёмся на оригинале.
+        pass
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    get_backend().remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, raw=False, **kwargs):
+    if not raw:
+        bump_version(CATALOG)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    # Новые заказы учитывает тот, кто создаёт позиции (checkout, админка).
+    if raw or created:
+        return
+    old_status = getattr(instance, "_loaded_status", None)
+    if old_status is not None:
+        order_status_changed(instance, old_status)
+        stock_order_status_changed(instance, old_status)
+        copurchases_status_changed(instance, old_status)
+    instance._loaded_status = instance.status
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance, **kwargs):
+    if getattr(instance, "_loaded_status", instance.status) == "completed":
+        apply_order(instance, -1)
+        apply_copurchases(instance, -1)
@@ -0,0 +1,101 @@
+"""
+Остатки товаров (Product.stock; None — остатки не ведутся).
+
+Списание при оформлении заказа — один условный UPDATE на весь заказ:
+
+    UPDATE product SET stock = stock - <нужно>
+    WHERE id IN (...) AND (stock IS NULL OR stock >= <нужно>)
+
+Проверка «хватает ли» и вычитание выполняются СУБД атомарно, остаток
+заранее не читается и не блокируется через SELECT FOR UPDATE, поэтому
+параллельные заказы одного товара ждут друг друга только на время
+этого UPDATE и не могут уйти в минус.
+"""
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import OrderItem, Product
+from .versions import CATALOG, bump_version
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f"out of stock: {product_ids}")
+        self.product_ids = product_ids
+
+
+def _needed(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Списывает {product_id: qty} целиком или бросает OutOfStock.
+    Вызывать внутри transaction.atomic: при нехватке откатывается весь заказ.
+    """
+    if not quantities:
+        return
+    needed = _needed(quantities)
+    updated = Product.objects.filter(
+        Q(stock__isnull=True) | Q(stock__gte=needed),
+        pk__in=list(quantities),
+    ).update(stock=F("stock") - needed)
+    if updated != len(quantities):
+        short = Product.objects.filter(pk__in=list(quantities), stock__lt=needed)
+        raise OutOfStock(sorted(short.values_list("pk", flat=True)))
+
+
+def release_stock(quantities):
+    """
+    Возвращает товар на склад (отмена заказа).
+    """
+    if not quantities:
+        return
+    needed = _needed(quantities)
+    Product.objects.filter(pk__in=list(quantities), stock__isnull=False).update(
+        stock=F("stock") + needed,
+    )
+
+
+def restock(queryset, qty):
+    """
+    Массовое пополнение из админки; у товаров без учёта остаток станет qty.
+    """
+    count = queryset.update(stock=Case(
+        When(stock__isnull=True, then=Value(qty)),
+        default=F("stock") + qty,
+        output_field=IntegerField(),
+    ))
+    bump_version(CATALOG)
+    return count
+
+
+def order_quantities(order):
+    rows = (
+        OrderItem.objects.filter(order_id=order.pk)
+        .values("product_id")
+        .annotate(qty=Sum("quantity"))
+        .order_by()
+    )
+    return {row["product_id"]: row["qty"] for row in rows}
+
+
+def order_status_changed(order, old_status):
+    """
+    Отмена возвращает товар. Возврат из отмены списывает его снова —
+    решение администратора важнее остатка, поэтому без проверки, но не ниже нуля.
+    """
+    if old_status == order.status or "cancelled" not in (old_status, order.status):
+        return
+    quantities = order_quantities(order)
+    if order.status == "cancelled":
+        release_stock(quantities)
+    elif quantities:
+        needed = _needed(quantities)
+        Product.objects.filter(pk__in=list(quantities), stock__isnull=False).update(
+            stock=Greatest(F("stock") - needed, Value(0)),
+        )
+    bump_version(CATALOG)
@@ -1,3 +1,1923 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from unittest import skipUnless
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin import site as admin_site
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import analytics, api_urls, api_views, urls
+from .benchmark import TestClientTransport, generate_dataset, run_benchmarks
+from .cart import _cache_key, merge_guest_cart
+from .catalog import MAX_PAGE_SIZE, build_catalog_queryset, order_products
+from .cartops import add_line, step_line
+from .checkout import create_order_from_cart
+from .checks import check_shared_cache
+from .conditional import analytics_etag
+from .exports import export_stream, order_queryset
+from .guests import GUEST_COOKIE
+from .importer import import_products, iter_rows
+from .models import (
+    CartItem,
+    Category,
+    Order,
+    OrderItem,
+    Product,
+    ProductRecommendation,
+    CategorySalesRollup,
+    ProductSalesRollup,
+    Review,
+    SalesRollup,
+)
+from .popularity import decay_factor, refresh_popularity
+from .ratings import recompute_product_rating
+from .rollups import hour_bucket, rebuild_rollups, sales_series
+from .search import FTS_TABLE
+from .querybudget import (
+    QueryBudgetExceeded,
+    assert_query_budget,
+    budget_for,
+    full_scans,
+    query_shape,
+    record_queries,
+)
+from .stock import OutOfStock, reserve_stock
+from .versions import CATALOG, bump_version
+
+
+User = get_user_model()
+
+_test_cache = {}
+
+
+def setUpModule():
+    """
+    Тесты чистят кэш (cache.clear()), а общий файловый кэш BASE_DIR/cache
+    читает запущенный магазин. Поэтому на время тестов кэш переезжает во
+    временный каталог; дочерние процессы получают его через SHOP_CACHE_DIR.
+    """
+    location = tempfile.mkdtemp(prefix="shop-test-cache-")
+    caches = {"default": {**settings.CACHES["default"], "LOCATION": location}}
+    _test_cache["location"] = location
+    _test_cache["override"] = override_settings(CACHES=caches)
+    _test_cache["override"].enable()
+
+
+def tearDownModule():
+    _test_cache.pop("override").disable()
+    shutil.rmtree(_test_cache.pop("location"), ignore_errors=True)
+
+
+def _in_another_process(code):
+    """
+    Выполняет code в отдельном процессе manage.py shell (как воркер или
+    команда по cron) и возвращает последнюю строку его вывода.
+    """
+    result = subprocess.run(
+        [sys.executable, "manage.py", "shell", "-v", "0", "-c", code],
+        cwd=settings.BASE_DIR,
+        env={**os.environ, "SHOP_CACHE_DIR": str(settings.CACHES["default"]["LOCATION"])},
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    return lines[-1] if lines else ""
+
+
+def _patterns(urlconf):
+    for pattern in urlconf.urlpatterns:
+        if isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern
+
+
+class QueryShapeTests(TestCase):
+    def test_shape_ignores_literals_and_in_list_length(self):
+        self.assertEqual(
+            query_shape('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) AND "x" = 5'),
+            query_shape('SELECT * FROM "t" WHERE "id" IN (%s, %s) AND "x" = 7'),
+        )
+
+    def test_repeated_query_shape_is_reported(self):
+        category = Category.objects.create(name="N+1")
+        for i in range(4):
+            Product.objects.create(category=category, name=f"p{i}")
+        with self.assertRaises(QueryBudgetExceeded):
+            with assert_query_budget(max_queries=100, max_duplicates=2):
+                for product in Product.objects.all():
+                    product.category.name
+
+
+class ApiDescriptionTests(TestCase):
+    def test_view_docstrings_reach_drf(self):
+        # Строка после permission_classes — не docstring: описание пропадает
+        # из browsable API и drf_yasg.
+        for view in (
+            api_views.ProductListAPIView,
+            api_views.ProductFacetsAPIView,
+            api_views.ProductRecommendationsAPIView,
+            api_views.CartUpdateQtyAPIView,
+            api_views.CartBatchAPIView,
+        ):
+            with self.subTest(view=view.__name__):
+                self.assertIn("/api/", view().get_view_description())
+
+
+class ViewRequestsMixin:
+    """
+    Данные и по одному запросу на каждый URL из app/urls.py и app/api_urls.py.
+    """
+
+    # name -> (method, kwargs, data); post_json — тело в JSON.
+    REQUESTS = {
+        "index": ("get", {}, {"q": "товар", "sort": "price_asc"}),
+        "welcome": ("get", {}, None),
+        "register": ("get", {}, None),
+        "login": ("get", {}, None),
+        "logout": ("get", {}, None),
+        "cart": ("get", {}, None),
+        "product_detail": ("get", {"pk": "product"}, None),
+        "add_review": ("post", {"pk": "product"}, {"rating": 4, "text": "ок"}),
+        "order_success": ("get", {"order_id": "order"}, None),
+        "order_reviews": ("get", {"order_id": "order"}, None),
+        "admin_dashboard": ("get", {}, None),
+        "api-products": ("get", {}, {"page_size": 5}),
+        "api-product-facets": ("get", {}, {"q": "товар", "min_price": "10"}),
+        "api-product-recommendations": ("get", {"pk": "product"}, None),
+        "api-cart-list": ("get", {}, None),
+        "api-cart-add": ("post", {}, {"product_id": "product", "qty": 1}),
+        "api-cart-update": ("post", {}, {"item_id": "cart_item", "action": "increase"}),
+        "api-cart-clear": ("post", {}, None),
+        "api-cart-batch": ("post_json", {}, {"ops": "batch_ops"}),
+        "api-order-create": ("post", {}, None),
+        "api-login": ("post", {}, {"username": "shopper", "password": "secret"}),
+        "api-stats-sales": ("get", {}, {"days": 30}),
+        "api-stats-categories": ("get", {}, {"days": 30}),
+        "api-analytics-cohorts": ("get", {}, {"months": 6}),
+        "api-analytics-baskets": ("get", {}, {"days": 30}),
+        "api-analytics-revenue": ("get", {}, {"days": 30}),
+        "api-analytics-categories": ("get", {}, {"days": 30}),
+    }
+
+    LINES = 15
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("shopper", password="secret")
+        category = Category.objects.create(name="Тест")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Товар {i}", price=10 + i)
+            for i in range(cls.LINES)
+        ]
+        cls.order = Order.objects.create(user=cls.user, status="completed")
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.order, product=p, quantity=1, unit_price=p.price)
+            for p in cls.products
+        ])
+        Review.objects.create(product=cls.products[1], user=cls.user, rating=5)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _fill_cart(self):
+        CartItem.objects.filter(user=self.user).delete()
+        self.cart_items = CartItem.objects.bulk_create([
+            CartItem(user=self.user, product=p, quantity=2)
+            for p in self.products
+        ])
+
+    def _resolve(self, value):
+        refs = {
+            "product": self.products[0].pk,
+            "order": self.order.pk,
+            "cart_item": self.cart_items[0].pk,
+            "batch_ops": [
+                {"op": "add", "product_id": self.products[0].pk, "qty": 2},
+                {"op": "set", "product_id": self.products[1].pk, "qty": 5},
+                {"op": "remove", "product_id": self.products[2].pk},
+            ],
+        }
+        return refs.get(value, value) if isinstance(value, str) else value
+
+    def _request(self, pattern):
+        method, kwargs, data = self.REQUESTS[pattern.name]
+        kwargs = {k: self._resolve(v) for k, v in kwargs.items()}
+        data = {k: self._resolve(v) for k, v in (data or {}).items()}
+        url = reverse(pattern.name, kwargs=kwargs)
+        if method == "post_json":
+            return self.client.post(url, data, content_type="application/json")
+        return getattr(self.client, method)(url, data)
+
+
+@override_settings(QUERY_BUDGET={"RAISE": True})
+class QueryBudgetTests(ViewRequestsMixin, TestCase):
+    """
+    Каждый URL из app/urls.py и app/api_urls.py обязан объявить
+    @query_budget и укладываться в него на «большой» корзине и заказе.
+    """
+
+    def test_every_url_declares_a_budget(self):
+        for pattern in list(_patterns(urls)) + list(_patterns(api_urls)):
+            with self.subTest(url=pattern.name):
+                view = pattern.callback
+                declared = getattr(view, "query_budget", None) or getattr(
+                    getattr(view, "view_class", None), "query_budget", None
+                )
+                self.assertIsNotNone(declared, f"{pattern.name} has no @query_budget")
+                self.assertIn(pattern.name, self.REQUESTS)
+
+    def test_urls_stay_within_budget(self):
+        for pattern in list(_patterns(urls)) + list(_patterns(api_urls)):
+            self._fill_cart()
+            with self.subTest(url=pattern.name):
+                max_queries, _ = budget_for(pattern.callback)
+                with record_queries() as recorder:
+                    response = self._request(pattern)
+                self.assertLess(response.status_code, 500)
+                self.assertLessEqual(recorder.count, max_queries)
+
+            # Некоторые запросы выходят из аккаунта или чистят корзину.
+            self.client.force_login(self.user)
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN — синтаксис SQLite")
+class QueryPlanTests(ViewRequestsMixin, TestCase):
+    """
+    Ни один запрос вьюх не читает таблицу целиком: для каждого
+    выполненного SELECT/UPDATE/DELETE проверяется EXPLAIN QUERY PLAN.
+    """
+
+    def test_view_queries_use_indexes(self):
+        for pattern in list(_patterns(urls)) + list(_patterns(api_urls)):
+            self._fill_cart()
+            with self.subTest(url=pattern.name):
+                with record_queries(keep_statements=True) as recorder:
+                    response = self._request(pattern)
+                self.assertLess(response.status_code, 500)
+                scans = full_scans(recorder.statements)
+                self.assertEqual(scans, [], f"{pattern.name}: full table scan")
+
+            self.client.force_login(self.user)
+
+    # Фильтры и сортировки каталога, которые реально приходят из формы.
+    CATALOG_PARAMS = [
+        {},
+        {"sort": "price_asc"},
+        {"sort": "price_desc", "max_price": "20"},
+        {"sort": "rating"},
+        {"sort": "popular"},
+        {"sort": "trending"},
+        {"category": "category"},
+        {"category": "category", "sort": "popular"},
+        {"category": "category", "sort": "price_asc"},
+        {"category": "category", "min_price": "11", "max_price": "20"},
+        {"min_price": "11", "max_price": "20"},
+    ]
+
+    def _assert_indexed(self, url, params):
+        with record_queries(keep_statements=True) as recorder:
+            response = self.client.get(url, params)
+        self.assertLess(response.status_code, 500)
+        self.assertEqual(full_scans(recorder.statements), [], f"{url} {params}")
+
+    def test_catalog_filters_use_indexes(self):
+        category = self.products[0].category_id
+        for name in ("index", "api-products", "api-product-facets"):
+            for params in self.CATALOG_PARAMS:
+                params = {k: category if v == "category" else v for k, v in params.items()}
+                if name == "api-products":
+                    params["page_size"] = 5
+                with self.subTest(url=name, params=params):
+                    cache.clear()
+                    self._assert_indexed(reverse(name), params)
+
+    def test_guest_cart_uses_indexes(self):
+        self.client.logout()
+        self.client.post(reverse("api-cart-add"), {"product_id": self.products[0].pk, "qty": 1})
+        item = CartItem.objects.get(user__isnull=True)
+        for name, method, data in (
+            ("cart", "get", None),
+            ("api-cart-list", "get", None),
+            ("api-cart-update", "post", {"item_id": item.pk, "action": "increase"}),
+            ("api-order-create", "post", None),
+        ):
+            with self.subTest(url=name):
+                with record_queries(keep_statements=True) as recorder:
+                    response = getattr(self.client, method)(reverse(name), data)
+                self.assertLess(response.status_code, 500)
+                self.assertEqual(full_scans(recorder.statements), [], name)
+
+
+class ConditionalGetTests(TestCase):
+    """
+    ETag по версии каталога: 304 на совпавший If-None-Match, 200 после
+    bump_version — в том числе из другого процесса (management-команды).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Версии")
+        Product.objects.create(category=category, name="Товар", price=10)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("api-products")
+
+    def _etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response["ETag"]
+
+    def test_matching_etag_returns_304(self):
+        etag = self._etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_bump_returns_fresh_response(self):
+        etag = self._etag()
+        bump_version(CATALOG)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_bump_from_another_process_is_seen(self):
+        etag = self._etag()
+        _in_another_process("from app.versions import CATALOG, bump_version; bump_version(CATALOG)")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_per_process_cache_is_rejected(self):
+        self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        }):
+            self.assertEqual([e.id for e in check_shared_cache(None)], ["app.E001"])
+
+
+def _raw_cursor(payload):
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+class ProductKeysetPaginationTests(TestCase):
+    """
+    Keyset-пагинация /api/products/: каждая строка ровно один раз при
+    одинаковых значениях ключа, 400 на чужой или битый курсор.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Страницы")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Товар {i}", price=10 + i % 3)
+            for i in range(11)
+        ]
+        # Одинаковое время создания у половины товаров: порядок держит id.
+        same = timezone.now() - timedelta(days=1)
+        Product.objects.filter(pk__in=[p.pk for p in cls.products[::2]]).update(created_at=same)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse("api-products")
+
+    def _walk(self, **params):
+        ids = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids.extend(item["id"] for item in data["results"])
+            if not data["next"]:
+                return ids
+            response = self.client.get(data["next"])
+
+    def _first_cursor(self, sort):
+        response = self.client.get(self.url, {"sort": sort, "page_size": 2})
+        return parse_qs(urlsplit(response.json()["next"]).query)["cursor"][0]
+
+    def test_every_row_exactly_once_with_ties(self):
+        for sort in ("new", "price_asc", "price_desc"):
+            with self.subTest(sort=sort):
+                expected = list(
+                    order_products(Product.objects.all(), sort).values_list("id", flat=True)
+                )
+                ids = self._walk(sort=sort, page_size=3)
+                self.assertEqual(ids, expected)
+                self.assertEqual(len(set(ids)), len(self.products))
+
+    def test_cursor_of_another_sort_is_rejected(self):
+        cursor = self._first_cursor("price_asc")
+        response = self.client.get(self.url, {"sort": "new", "cursor": cursor})
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_cursor_is_rejected(self):
+        for cursor in ("не-курсор", _raw_cursor({"s": "price_asc", "id": 1}),
+                       _raw_cursor({"s": "price_asc", "v": "NaN", "id": 1}),
+                       _raw_cursor({"s": "price_asc", "v": "Infinity", "id": 1})):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {"sort": "price_asc", "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_page_size_is_capped(self):
+        Product.objects.bulk_create(
+            Product(category=self.products[0].category, name=f"Ещё {i}", price=1)
+            for i in range(MAX_PAGE_SIZE)
+        )
+        data = self.client.get(self.url, {"page_size": MAX_PAGE_SIZE * 10}).json()
+        self.assertEqual(len(data["results"]), MAX_PAGE_SIZE)
+        self.assertIsNotNone(data["next"])
+
+    def test_non_finite_price_filter_is_ignored(self):
+        self.client.force_login(User.objects.create_user("keyset"))
+        for url, params in ((reverse("index"), {"min_price": "NaN"}),
+                            (self.url, {"max_price": "Infinity"}),
+                            (self.url, {"min_price": "-Infinity", "page_size": 5})):
+            with self.subTest(url=url, params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+
+
+class SearchTests(TestCase):
+    """
+    FTS5-поиск: словоформы, ё/е, префиксы, служебный синтаксис в запросе,
+    синхронизация индекса с товарами и сортировка по релевантности.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Поиск")
+        cls.kettle = Product.objects.create(
+            category=category, name="Марсианский чайник", description="Кипятит воду", price=10,
+        )
+        cls.tree = Product.objects.create(category=category, name="Ёлка", price=20)
+        cls.cup = Product.objects.create(
+            category=category, name="Кружка", description="Пара к чайнику", price=5,
+        )
+
+    def _found(self, query):
+        qs, _ = build_catalog_queryset({"q": query})
+        return list(qs.values_list("id", flat=True))
+
+    def test_inflected_forms_match(self):
+        self.assertIn(self.kettle.pk, self._found("чайники"))
+        self.assertIn(self.kettle.pk, self._found("марсианские чайники"))
+
+    def test_yo_and_ye_are_the_same_letter(self):
+        self.assertEqual(self._found("елки"), [self.tree.pk])
+        self.assertEqual(self._found("ЁЛКА"), [self.tree.pk])
+
+    def test_prefix_matches(self):
+        self.assertEqual(self._found("марс"), [self.kettle.pk])
+
+    def test_fts_syntax_in_query_is_plain_text(self):
+        for query in ('"', 'чайник"', "NEAR(", "NEAR(чайник", "чайник OR", "OR", "*", "-", "^"):
+            with self.subTest(query=query):
+                self._found(query)
+                response = self.client.get(reverse("api-products"), {"q": query})
+                self.assertEqual(response.status_code, 200)
+
+    def test_relevance_puts_name_matches_first(self):
+        self.assertEqual(self._found("чайник"), [self.kettle.pk, self.cup.pk])
+
+    def test_index_follows_save_rename_and_delete(self):
+        product = Product.objects.create(category=self.kettle.category, name="Самовар", price=1)
+        self.assertEqual(self._found("самовар"), [product.pk])
+
+        product.name = "Термос"
+        product.save()
+        self.assertEqual(self._found("самовар"), [])
+        self.assertEqual(self._found("термос"), [product.pk])
+
+        product.delete()
+        self.assertEqual(self._found("термос"), [])
+
+    def test_rebuild_command_restores_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        self.assertEqual(self._found("чайник"), [])
+
+        out = io.StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("Проиндексировано товаров: 3", out.getvalue())
+        self.assertEqual(self._found("чайник"), [self.kettle.pk, self.cup.pk])
+
+
+def _cart_urlconf(views):
+    return type("CartURLConf", (), {
+        "urlpatterns": [path("api/", include(api_urls.cart_urlpatterns(views)))],
+    })
+
+
+SYNC_CART_URLCONF = _cart_urlconf(api_urls.SYNC_CART_VIEWS)
+ASYNC_CART_URLCONF = _cart_urlconf(api_urls.ASYNC_CART_VIEWS)
+
+
+class AsyncCartParityTests(TestCase):
+    """
+    ASYNC_CART_API не меняет контракт: один и тот же сценарий через
+    api_views и async_api_views даёт одинаковые статусы и JSON.
+    """
+
+    # id строк корзины и заказов у двух прогонов разные.
+    VOLATILE = {"id", "item_id", "order_id"}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("parity")
+        category = Category.objects.create(name="Паритет")
+        cls.products = [
+            Product.objects.create(category=category, name=f"Товар {i}", price=f"{10 + i}.50")
+            for i in range(3)
+        ]
+
+    def _normalized(self, value):
+        if isinstance(value, dict):
+            return {k: self._normalized(v) for k, v in value.items() if k not in self.VOLATILE}
+        if isinstance(value, list):
+            return [self._normalized(v) for v in value]
+        return value
+
+    def _item(self, product):
+        return CartItem.objects.filter(product=product).values_list("pk", flat=True).first()
+
+    def _scenario(self):
+        p0, p1, p2 = self.products
+        steps = [
+            ("post", "api-cart-add", lambda: {"product_id": p0.pk, "qty": 2}),
+            ("post", "api-cart-add", lambda: {"product_id": p1.pk, "qty": 1}),
+            ("get", "api-cart-list", lambda: None),
+            ("post", "api-cart-update", lambda: {"item_id": self._item(p0), "action": "increase"}),
+            ("post", "api-cart-update", lambda: {"item_id": self._item(p1), "action": "decrease"}),
+            ("post", "api-cart-update", lambda: {"item_id": self._item(p0), "action": "double"}),
+            ("post", "api-cart-add", lambda: {"product_id": 0, "qty": 1}),
+            ("post", "api-cart-add", lambda: {"product_id": p0.pk, "qty": "много"}),
+            ("post_json", "api-cart-batch", lambda: {"ops": [
+                {"op": "add", "product_id": p2.pk, "qty": 3},
+                {"op": "set", "product_id": p0.pk, "qty": 5},
+            ]}),
+            ("post_json", "api-cart-batch", lambda: {"ops": [{"op": "explode"}]}),
+            ("get", "api-cart-list", lambda: None),
+            ("post", "api-order-create", lambda: None),
+            ("get", "api-cart-list", lambda: None),
+            ("post", "api-order-create", lambda: None),
+            ("post", "api-cart-add", lambda: {"product_id": p1.pk, "qty": 4}),
+            ("post", "api-cart-clear", lambda: None),
+            ("get", "api-cart-list", lambda: None),
+        ]
+        results = []
+        for method, name, data in steps:
+            url = reverse(name)
+            if method == "post_json":
+                response = self.client.post(url, data(), content_type="application/json")
+            else:
+                response = getattr(self.client, method)(url, data())
+            results.append((name, response.status_code, self._normalized(response.json())))
+        return results
+
+    def _run(self, urlconf, login):
+        cache.clear()
+        self.client.logout()
+        if login:
+            self.client.force_login(self.user)
+        CartItem.objects.all().delete()
+        with override_settings(ROOT_URLCONF=urlconf):
+            return self._scenario()
+
+    def test_sync_and_async_payloads_match(self):
+        for login in (True, False):
+            with self.subTest(login=login):
+                sync = self._run(SYNC_CART_URLCONF, login)
+                async_ = self._run(ASYNC_CART_URLCONF, login)
+                for expected, actual in zip(sync, async_):
+                    self.assertEqual(actual, expected)
+
+    def test_list_total_price_is_a_number(self):
+        CartItem.objects.create(user=self.user, product=self.products[0], quantity=2)
+        for urlconf in (SYNC_CART_URLCONF, ASYNC_CART_URLCONF):
+            self.client.force_login(self.user)
+            with self.subTest(urlconf=urlconf), override_settings(ROOT_URLCONF=urlconf):
+                item = self.client.get(reverse("api-cart-list")).json()["items"][0]
+                self.assertEqual(item["total_price"], 21.0)
+
+
+class GuestCartTests(TestCase):
+    """
+    Гостевая корзина живёт в подписанной cookie guest_cart: чтение не
+    создаёт сессий, cookie появляется при первой записи, подделка
+    отбрасывается, старые корзины по session_key находятся, при входе
+    корзина переезжает к пользователю.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Гости")
+        cls.product = Product.objects.create(category=category, name="Для гостя", price=7)
+
+    def setUp(self):
+        cache.clear()
+
+    def _add(self, qty=1):
+        response = self.client.post(
+            reverse("api-cart-add"), {"product_id": self.product.pk, "qty": qty},
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _cart(self):
+        response = self.client.get(reverse("api-cart-list"))
+        self.assertEqual(response.status_code, 200)
+        return [(item["product"]["id"], item["quantity"]) for item in response.json()["items"]]
+
+    def test_anonymous_reads_create_no_sessions(self):
+        for url in (reverse("welcome"), reverse("api-products"), reverse("api-cart-list"),
+                    reverse("product_detail", args=[self.product.pk])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(GUEST_COOKIE, response.cookies)
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_first_write_sets_signed_cookie(self):
+        response = self._add(2)
+        self.assertIn(GUEST_COOKIE, response.cookies)
+        self.assertTrue(response.cookies[GUEST_COOKIE]["httponly"])
+
+        item = CartItem.objects.get()
+        self.assertIsNone(item.user_id)
+        self.assertNotEqual(response.cookies[GUEST_COOKIE].value, item.session_key)
+        self.assertEqual(self._cart(), [(self.product.pk, 2)])
+        self.assertFalse(Session.objects.exists())
+
+    def test_tampered_cookie_is_rejected(self):
+        signed = self._add().cookies[GUEST_COOKIE].value
+        token = CartItem.objects.get().session_key
+        for value in (signed + "x", f"{token}:forged-signature", token):
+            with self.subTest(value=value):
+                self.client.cookies[GUEST_COOKIE] = value
+                self.assertEqual(self._cart(), [])
+
+        self.client.cookies[GUEST_COOKIE] = signed
+        self.assertEqual(self._cart(), [(self.product.pk, 1)])
+
+    def test_legacy_session_cart_is_readable(self):
+        session = SessionStore()
+        session.create()
+        CartItem.objects.create(session_key=session.session_key, product=self.product, quantity=3)
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+        response = self.client.get(reverse("api-cart-list"))
+        self.assertEqual(response.json()["items"][0]["quantity"], 3)
+        # Ключ сессии переезжает в cookie гостя, корзина остаётся доступной.
+        self.assertIn(GUEST_COOKIE, response.cookies)
+        del self.client.cookies[settings.SESSION_COOKIE_NAME]
+        self.assertEqual(self._cart(), [(self.product.pk, 3)])
+
+    def test_login_merges_guest_cart(self):
+        user = User.objects.create_user("guest-login", password="secret")
+        CartItem.objects.create(user=user, product=self.product, quantity=1)
+        self._add(2)
+
+        response = self.client.post(reverse("login"), {"username": "guest-login", "password": "secret"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[GUEST_COOKIE].value, "")
+
+        item = CartItem.objects.get()
+        self.assertEqual((item.user_id, item.quantity), (user.pk, 3))
+        self.assertEqual(self._cart(), [(self.product.pk, 3)])
+
+
+class CartMergeTests(TestCase):
+    """
+    merge_guest_cart: количества складываются, гостевые строки переезжают
+    или удаляются, число запросов не зависит от размера корзины.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Слияние")
+        cls.products = Product.objects.bulk_create(
+            Product(category=category, name=f"Товар {i}", price=1) for i in range(40)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("merger")
+
+    def _guest(self, token, products, quantity=2):
+        CartItem.objects.bulk_create(
+            CartItem(session_key=token, product=p, quantity=quantity) for p in products
+        )
+
+    def _user_cart(self):
+        return dict(CartItem.objects.filter(user=self.user).values_list("product_id", "quantity"))
+
+    def test_same_product_quantities_are_summed(self):
+        shared, guest_only = self.products[:2]
+        CartItem.objects.create(user=self.user, product=shared, quantity=1)
+        self._guest("a" * 32, [shared, guest_only])
+
+        self.assertEqual(merge_guest_cart(self.user, "a" * 32), 1)
+        self.assertEqual(self._user_cart(), {shared.pk: 3, guest_only.pk: 2})
+        self.assertFalse(CartItem.objects.filter(session_key="a" * 32, user__isnull=True).exists())
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_other_guests_are_untouched(self):
+        self._guest("a" * 32, self.products[:1])
+        self._guest("b" * 32, self.products[:1], quantity=5)
+
+        merge_guest_cart(self.user, "a" * 32)
+        self.assertEqual(self._user_cart(), {self.products[0].pk: 2})
+        self.assertEqual(
+            list(CartItem.objects.filter(user__isnull=True).values_list("session_key", "quantity")),
+            [("b" * 32, 5)],
+        )
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size, token in ((1, "c" * 32), (40, "d" * 32)):
+            CartItem.objects.filter(user=self.user).delete()
+            half = self.products[:size // 2]
+            CartItem.objects.bulk_create(
+                CartItem(user=self.user, product=p, quantity=1) for p in half
+            )
+            self._guest(token, self.products[:size])
+            with CaptureQueriesContext(connection) as ctx:
+                merge_guest_cart(self.user, token)
+            counts.append(len(ctx.captured_queries))
+            self.assertEqual(sum(self._user_cart().values()), size * 2 + len(half))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[0], 5)
+
+
+class CartSummaryCacheTests(TestCase):
+    """
+    Сводку корзины, обновлённую одним воркером, видят остальные процессы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("badge")
+        category = Category.objects.create(name="Бейдж")
+        cls.product = Product.objects.create(category=category, name="Товар", price=7)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _seen_by_other_worker(self):
+        return _in_another_process(
+            "from django.core.cache import cache; "
+            f"print((cache.get({_cache_key(self.user.pk)!r}) or {{}}).get('count'))"
+        )
+
+    def test_cart_writes_reach_other_workers(self):
+        self.client.post(reverse("api-cart-add"), {"product_id": self.product.pk, "qty": 3})
+        self.assertEqual(self._seen_by_other_worker(), "3")
+
+        item = CartItem.objects.get(user=self.user)
+        self.client.post(reverse("api-cart-update"), {"item_id": item.pk, "action": "decrease"})
+        self.assertEqual(self._seen_by_other_worker(), "2")
+
+
+class CatalogGridCacheTests(TestCase):
+    """
+    Закэшированный фрагмент сетки каталога не переживает изменений,
+    которые делают команды: новые цены и пересчёт популярности.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("grid")
+        category = Category.objects.create(name="Сетка")
+        cls.first = Product.objects.create(category=category, name="Первый товар", price=10)
+        cls.second = Product.objects.create(category=category, name="Второй товар", price=20)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _grid(self, **params):
+        response = self.client.get(reverse("index"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_popularity_refresh_reorders_cached_grid(self):
+        # Без продаж очки равны — новее выше.
+        html = self._grid(sort="popular")
+        self.assertLess(html.index(self.second.name), html.index(self.first.name))
+
+        ProductSalesRollup.objects.create(
+            hour=hour_bucket(timezone.now() - timedelta(hours=2)),
+            product=self.first, units=5, revenue=50,
+        )
+        out = io.StringIO()
+        call_command("refresh_popularity", stdout=out)
+        self.assertIn("Товаров с новыми продажами: 1", out.getvalue())
+
+        html = self._grid(sort="popular")
+        self.assertLess(html.index(self.first.name), html.index(self.second.name))
+
+    def test_bulk_price_change_reaches_cached_grid(self):
+        self.assertNotIn("777", self._grid())
+        # Так меняют цены импорт и другие команды: UPDATE без сигналов + bump.
+        Product.objects.filter(pk=self.first.pk).update(price=777)
+        bump_version(CATALOG)
+        self.assertIn("777", self._grid())
+
+
+class ImporterTests(TestCase):
+    HEADER = "external_id,name,category,price,description\n"
+
+    def _import(self, body, fmt="csv", batch_size=2):
+        rows = iter_rows(io.StringIO(body if fmt == "jsonl" else self.HEADER + body), fmt)
+        return import_products(rows, batch_size=batch_size)
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        stats = self._import(
+            "a1,Хороший,Кат,10.5,\n"
+            "a2,Не число,Кат,nan,\n"
+            "a3,Бесконечность,Кат,inf,\n"
+            "a4,Минус,Кат,-Infinity,\n"
+            "a5,Отрицательная,Кат,-1,\n"
+            "a6,Огромная,Кат,1e999999,\n"
+            "a7,,Кат,5,\n"
+            "a8,Тоже хороший,Кат,7,\n",
+        )
+        self.assertEqual((stats.rows, stats.created, stats.skipped), (8, 2, 6))
+        self.assertEqual([line for line, _ in stats.errors], [3, 4, 5, 6, 7, 8])
+        self.assertEqual(
+            sorted(Product.objects.values_list("external_id", flat=True)), ["a1", "a8"],
+        )
+
+    def test_jsonl_nan_price_and_broken_lines_do_not_abort(self):
+        stats = self._import(
+            '{"external_id": "j1", "name": "Один", "category": "К", "price": NaN}\n'
+            "не json\n"
+            '{"external_id": "j2", "name": "Два", "category": "К", "price": 3}\n',
+            fmt="jsonl",
+        )
+        self.assertEqual((stats.created, stats.skipped), (1, 2))
+        self.assertEqual(Product.objects.get().external_id, "j2")
+
+    def test_upsert_by_external_id(self):
+        self._import("u1,Старое,Кат,10,\nu2,Второй,Кат,20,\n")
+        first = Product.objects.get(external_id="u1")
+
+        stats = self._import("u1,Новое,Кат,11,\nu2,Второй,Кат,20,\nu3,Третий,Кат,30,\n")
+        self.assertEqual((stats.created, stats.updated, stats.unchanged), (1, 1, 1))
+
+        first.refresh_from_db()
+        self.assertEqual((first.name, first.price), ("Новое", 11))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_categories_are_created_once_and_reused(self):
+        existing = Category.objects.create(name="Есть")
+        self._import("c1,Один,Есть,1,\nc2,Два,Новая,2,\nc3,Три,Новая,3,\n", batch_size=1)
+
+        self.assertEqual(
+            sorted(Category.objects.values_list("name", flat=True)), ["Есть", "Новая"],
+        )
+        self.assertEqual(Product.objects.get(external_id="c1").category, existing)
+        self.assertEqual(
+            Product.objects.filter(category__name="Новая").count(), 2,
+        )
+
+
+class BenchDataTests(TestCase):
+    SIZES = {
+        "categories": 3, "products": 20, "users": 4, "orders": 30,
+        "carts": 2, "guest_carts": 2, "batch_size": 7,
+    }
+
+    def _generate(self):
+        return generate_dataset(**self.SIZES, log=lambda message: None)
+
+    def test_generator_can_run_twice(self):
+        first = self._generate()
+        second = self._generate()
+
+        self.assertEqual(first, second)
+        self.assertEqual(Category.objects.count(), 2 * self.SIZES["categories"])
+        self.assertEqual(Product.objects.count(), 2 * self.SIZES["products"])
+        self.assertEqual(Order.objects.count(), 2 * self.SIZES["orders"])
+
+    def test_generator_builds_derived_data(self):
+        self._generate()
+        self.assertTrue(ProductSalesRollup.objects.exists())
+        self.assertTrue(ProductRecommendation.objects.exists())
+
+
+class BenchRunnerTests(TransactionTestCase):
+    """
+    Раннер бенчмарков в несколько потоков: каждый со своим клиентом,
+    замеры всех потоков попадают в отчёт.
+    """
+
+    def test_concurrent_run_counts_every_request(self):
+        generate_dataset(**BenchDataTests.SIZES, log=lambda message: None)
+        report = run_benchmarks(
+            TestClientTransport(host="testserver"), scenarios=["product_detail_view", "cart_list"],
+            requests=10, warmup=1, concurrency=4,
+        )
+
+        self.assertEqual(report["meta"]["concurrency"], 4)
+        for name, result in report["scenarios"].items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result["requests"], 10)
+                self.assertEqual(result["errors"], 0)
+                self.assertGreater(result["throughput_rps"], 0)
+                self.assertIn("queries_max", result)
+
+
+class PopularityTests(TestCase):
+    """
+    Очки с затуханием: старая продажа весит меньше свежей, инкрементальный
+    пересчёт совпадает с полным, категории — сумма своих товаров.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name="Книги")
+        cls.tools = Category.objects.create(name="Инструменты")
+        cls.old_hit = Product.objects.create(category=cls.books, name="Старый хит", price=1)
+        cls.novelty = Product.objects.create(category=cls.tools, name="Новинка", price=1)
+        cls.now = hour_bucket(timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    def _sale(self, product, hours_ago, units):
+        ProductSalesRollup.objects.create(
+            hour=self.now - timedelta(hours=hours_ago), product=product, units=units, revenue=units,
+        )
+
+    def _scores(self):
+        return {
+            (model.__name__, pk): scores
+            for model in (Product, Category)
+            for pk, *scores in model.objects.values_list("pk", "bestseller_score", "trending_score")
+        }
+
+    def test_older_sale_weighs_less(self):
+        self._sale(self.old_hit, 24 * 10, 5)
+        self._sale(self.novelty, 1, 5)
+        refresh_popularity(now=self.now)
+
+        old_hit = Product.objects.get(pk=self.old_hit.pk)
+        novelty = Product.objects.get(pk=self.novelty.pk)
+        self.assertLess(old_hit.bestseller_score, novelty.bestseller_score)
+        self.assertLess(old_hit.trending_score, novelty.trending_score)
+        # Продажа часа считается в его середине: возраст — полчаса.
+        self.assertAlmostEqual(
+            novelty.trending_score, 5 * decay_factor("trending_score", timedelta(minutes=30)),
+        )
+        self.assertAlmostEqual(
+            old_hit.trending_score,
+            5 * decay_factor("trending_score", timedelta(days=10) - timedelta(minutes=30)),
+        )
+
+    def test_incremental_refresh_matches_full_rebuild(self):
+        for hours_ago, units in ((24 * 40, 30), (24 * 7, 4), (60, 2), (49, 6)):
+            self._sale(self.old_hit, hours_ago, units)
+        self._sale(self.novelty, 50, 3)
+        refresh_popularity(now=self.now - timedelta(hours=48))
+
+        for hours_ago, units in ((30, 5), (2, 1)):
+            self._sale(self.novelty, hours_ago, units)
+        self._sale(self.old_hit, 47, 2)
+        refresh_popularity(now=self.now)
+        incremental = self._scores()
+
+        refresh_popularity(now=self.now, full=True)
+        full = self._scores()
+
+        self.assertEqual(incremental.keys(), full.keys())
+        for key, scores in full.items():
+            for got, expected in zip(incremental[key], scores):
+                self.assertAlmostEqual(got, expected, places=6, msg=key)
+
+    def test_category_scores_order_category_filter(self):
+        self._sale(self.old_hit, 24 * 10, 20)
+        self._sale(self.novelty, 1, 5)
+        refresh_popularity(now=self.now)
+
+        books = Category.objects.get(pk=self.books.pk)
+        self.assertAlmostEqual(
+            books.bestseller_score, Product.objects.get(pk=self.old_hit.pk).bestseller_score,
+        )
+
+        def category_names(sort):
+            response = self.client.get(reverse("api-product-facets"), {"sort": sort})
+            return [c["name"] for c in response.json()["categories"]]
+
+        self.assertEqual(category_names("popular"), ["Книги", "Инструменты"])
+        self.assertEqual(category_names("trending"), ["Инструменты", "Книги"])
+        self.assertEqual(category_names("price_asc"), ["Инструменты", "Книги"])
+
+
+@skipUnless(analytics.available(), "нужен NumPy")
+class AnalyticsSnapshotTests(TestCase):
+    """
+    Цифры дашборда по снимку совпадают с теми же агрегатами через ORM —
+    после полной сборки, дозаписи, прерванной дозаписи и смены поколения.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f"cohort{i}") for i in range(4)]
+        cls.categories = [Category.objects.create(name=f"Аналитика {i}") for i in range(3)]
+        cls.products = [
+            Product.objects.create(category=cls.categories[i % 3], name=f"Товар {i}", price=i + 1)
+            for i in range(6)
+        ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.now = timezone.now()
+        self.seq = 0
+
+    def _order(self, user, days_ago, lines, status="completed"):
+        """
+        lines — [(индекс товара, количество, цена), ...].
+        """
+        self.seq += 1
+        created_at = self.now - timedelta(days=days_ago, minutes=self.seq)
+        order = Order.objects.create(
+            user=user,
+            status=status,
+            created_at=created_at,
+            total_price=sum(Decimal(str(price)) * qty for _, qty, price in lines),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[i], quantity=qty,
+                      unit_price=Decimal(str(price)), created_at=created_at)
+            for i, qty, price in lines
+        ])
+        return order
+
+    def _history(self):
+        u0, u1, u2, u3 = self.users
+        self._order(u0, 200, [(0, 1, 10.5), (1, 2, 3.33)])
+        self._order(u0, 100, [(2, 1, 99.99)])
+        self._order(u0, 5, [(3, 25, 1)])                        # корзина 20+
+        self._order(u1, 100, [(4, 3, 7.25)])
+        self._order(u1, 40, [(5, 1, 1000)], status="cancelled")
+        self._order(u1, 10, [(0, 1, 10.5), (3, 1, 2.5)])
+        self._order(u2, 2, [(1, 4, 0.01)])
+        self._order(None, 1, [(2, 2, 12)])                      # гость
+        self._order(u3, 0, [(5, 1, 50)], status="pending")
+
+    def _snapshot(self, **kwargs):
+        analytics.refresh_snapshot(self.directory, **kwargs)
+        return analytics.load_snapshot(self.directory)
+
+    # --- ожидаемые значения через ORM ---
+
+    def _completed(self, days=None):
+        orders = Order.objects.filter(status="completed")
+        if days is not None:
+            since = timezone.localtime(self.now - timedelta(days=days)).date()
+            orders = orders.filter(created_at__date__gt=since)
+        return orders
+
+    def _expected_revenue(self, days=None):
+        totals = [float(t) for t in self._completed(days).values_list("total_price", flat=True)]
+        return {
+            "count": len(totals),
+            "revenue": round(sum(totals), 2),
+            "percentiles": {
+                str(p): round(float(v), 2)
+                for p, v in zip(analytics.PERCENTILES, analytics.np.percentile(totals, analytics.PERCENTILES))
+            },
+        }
+
+    def _expected_baskets(self, days=None):
+        units = self._completed(days).annotate(units=Sum("items__quantity")).values_list("units", flat=True)
+        counts = Counter(min(u, analytics.BASKET_BINS) for u in units)
+        return [counts.get(n, 0) for n in range(1, analytics.BASKET_BINS + 1)]
+
+    def _expected_categories(self, days=None):
+        rows = (
+            OrderItem.objects.filter(order__in=self._completed(days))
+            .values("product__category_id")
+            .annotate(revenue=Sum(F("quantity") * F("unit_price")), units=Sum("quantity"))
+        )
+        return {
+            row["product__category_id"]: (round(float(row["revenue"]), 2), row["units"])
+            for row in rows
+        }
+
+    def _expected_cohorts(self, months):
+        current = analytics._month_index(self.now)
+        seen = defaultdict(set)
+        for user_id, created_at in self._completed().filter(user__isnull=False).values_list(
+            "user_id", "created_at",
+        ):
+            seen[user_id].add(analytics._month_index(created_at))
+        cohorts = defaultdict(lambda: defaultdict(set))
+        for user_id, buys in seen.items():
+            first = min(buys)
+            for month in buys:
+                cohorts[first][month - first].add(user_id)
+        expected = {}
+        for first, offsets in cohorts.items():
+            if first < current - months + 1:
+                continue
+            size = len(offsets[0])
+            expected[analytics._month_label(first)] = [
+                round(len(offsets.get(k, ())) / size, 4) for k in range(current - first + 1)
+            ]
+        return expected
+
+    def assertMatchesOrm(self, snapshot):
+        for days in (None, 7, 30):
+            with self.subTest(days=days):
+                revenue = analytics.revenue_percentiles(snapshot, days)
+                expected = self._expected_revenue(days)
+                self.assertEqual(revenue["count"], expected["count"])
+                self.assertAlmostEqual(revenue["revenue"], expected["revenue"], places=2)
+                self.assertEqual(revenue["percentiles"], expected["percentiles"])
+
+                self.assertEqual(analytics.basket_sizes(snapshot, days)["orders"], self._expected_baskets(days))
+
+                mix = {
+                    row["category_id"]: (row["revenue"], row["units"])
+                    for row in analytics.category_mix(snapshot, days)
+                }
+                self.assertEqual(mix, self._expected_categories(days))
+
+        cohorts = analytics.cohort_retention(snapshot, 12)["cohorts"]
+        self.assertEqual(
+            {row["month"]: row["retention"] for row in cohorts}, self._expected_cohorts(12),
+        )
+
+    def test_snapshot_matches_orm_aggregates(self):
+        self._history()
+        snapshot = self._snapshot(chunk_size=3)
+        self.assertEqual(snapshot.meta["orders"], Order.objects.count())
+        self.assertEqual(snapshot.meta["items"], OrderItem.objects.count())
+        self.assertMatchesOrm(snapshot)
+
+    def test_basket_bins_clip_large_baskets(self):
+        self._order(self.users[0], 1, [(0, 1, 1)])
+        self._order(self.users[0], 1, [(0, 19, 1), (1, 1, 1)])
+        self._order(self.users[0], 1, [(0, 500, 1)])
+        baskets = analytics.basket_sizes(self._snapshot())
+        self.assertEqual(baskets["labels"][-1], f"{analytics.BASKET_BINS}+")
+        self.assertEqual(baskets["orders"][0], 1)
+        self.assertEqual(baskets["orders"][-1], 2)
+
+    def test_incremental_refresh_appends_new_orders(self):
+        self._history()
+        first = self._snapshot(chunk_size=4)
+        generation = first.meta["generation"]
+
+        self._order(self.users[2], 0, [(4, 2, 5.5)])
+        self._order(self.users[3], 0, [(0, 1, 10.5), (5, 1, 3)])
+        snapshot = self._snapshot(chunk_size=4)
+
+        self.assertIsNot(snapshot, first)
+        self.assertEqual(snapshot.meta["generation"], generation)
+        self.assertEqual(snapshot.meta["orders"], Order.objects.count())
+        self.assertMatchesOrm(snapshot)
+
+    def test_interrupted_append_is_truncated(self):
+        self._history()
+        meta = self._snapshot().meta
+        # Дозапись упала после записи колонки, но до meta.json.
+        path = os.path.join(self.directory, f"orders.total.{meta['generation']}.bin")
+        with open(path, "ab") as fh:
+            fh.write(b"\xff" * 8 * 3)
+
+        self._order(self.users[1], 0, [(2, 1, 42)])
+        snapshot = self._snapshot()
+        self.assertEqual(os.path.getsize(path), 8 * Order.objects.count())
+        self.assertMatchesOrm(snapshot)
+
+    def test_full_refresh_switches_generation(self):
+        self._history()
+        old = self._snapshot()
+        old_generation = old.meta["generation"]
+        old_revenue = analytics.revenue_percentiles(old)["revenue"]
+
+        # Отмену уже выгруженного заказа дозапись не видит — только --full.
+        order = Order.objects.filter(status="completed").order_by("id").first()
+        order.status = "cancelled"
+        order.save()
+        self.assertEqual(analytics.revenue_percentiles(self._snapshot())["revenue"], old_revenue)
+
+        snapshot = self._snapshot(full=True)
+        self.assertEqual(snapshot.meta["generation"], old_generation + 1)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.endswith(".bin")),
+            sorted(
+                f"{table}.{column}.{old_generation + 1}.bin"
+                for table, columns in analytics.TABLES.items() for column in columns
+            ),
+        )
+        self.assertMatchesOrm(snapshot)
+        # Открытые до переключения memmap-ы читаются и после удаления файлов.
+        completed = old.orders["status"] == analytics.COMPLETED
+        self.assertAlmostEqual(float(old.orders["total"][completed].sum()) / 100, old_revenue)
+
+    def test_etag_follows_local_date(self):
+        request = RequestFactory().get("/api/analytics/baskets/", {"days": 7})
+
+        def etag_at(utc):
+            with mock.patch("django.utils.timezone.now", return_value=utc):
+                return analytics_etag(request)
+
+        # 18:30 и 19:30 UTC — одни сутки по UTC, но в Ташкенте (UTC+5) это
+        # 23:30 и 00:30 следующего дня: окно ?days= уже сдвинулось.
+        before = etag_at(datetime(2026, 1, 1, 18, 30, tzinfo=dt_timezone.utc))
+        after = etag_at(datetime(2026, 1, 1, 19, 30, tzinfo=dt_timezone.utc))
+        same_day = etag_at(datetime(2026, 1, 1, 10, 0, tzinfo=dt_timezone.utc))
+        self.assertNotEqual(before, after)
+        self.assertEqual(before, same_day)
+
+
+class RollupTests(TestCase):
+    """
+    Инкрементальные сводки (checkout, завершение, отмена) совпадают
+    с rebuild_rollups(); час и день считаются по Asia/Tashkent.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("rollups")
+        categories = [Category.objects.create(name=f"Сводки {i}") for i in range(2)]
+        cls.products = [
+            Product.objects.create(category=categories[i % 2], name=f"Товар {i}", price=Decimal(f"{i + 1}.25"))
+            for i in range(3)
+        ]
+
+    def _checkout(self, *lines):
+        CartItem.objects.bulk_create([
+            CartItem(user=self.user, product=self.products[i], quantity=qty) for i, qty in lines
+        ])
+        return create_order_from_cart(user=self.user)
+
+    def _pending(self, created_at, *lines):
+        order = Order.objects.create(user=self.user, status="pending", created_at=created_at)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=self.products[i], quantity=qty,
+                      unit_price=self.products[i].price, created_at=created_at)
+            for i, qty in lines
+        ])
+        order.total_price = sum(self.products[i].price * qty for i, qty in lines)
+        order.save(update_fields=["total_price"])
+        return order
+
+    def _set_status(self, order, status):
+        order = Order.objects.get(pk=order.pk)
+        order.status = status
+        order.save()
+        return order
+
+    def _rollups(self):
+        """
+        Ненулевые строки всех трёх сводок: отмена оставляет нули, rebuild — нет.
+        """
+        rows = set()
+        for hour, n, revenue in SalesRollup.objects.values_list("hour", "orders_count", "revenue"):
+            if n or revenue:
+                rows.add(("sales", hour, None, n, revenue))
+        for model, key in ((CategorySalesRollup, "category_id"), (ProductSalesRollup, "product_id")):
+            for hour, key_id, units, revenue in model.objects.values_list("hour", key, "units", "revenue"):
+                if units or revenue:
+                    rows.add((model.__name__, hour, key_id, units, revenue))
+        return rows
+
+    def test_incremental_rollups_match_rebuild(self):
+        earlier = timezone.now() - timedelta(days=3, hours=5)
+        self._checkout((0, 2), (1, 1))
+        kept = self._pending(earlier, (1, 3), (2, 1))
+        self._set_status(kept, "completed")
+        cancelled = self._checkout((2, 4))
+        self._set_status(cancelled, "cancelled")
+        flapping = self._pending(earlier + timedelta(minutes=10), (0, 1))
+        flapping = self._set_status(flapping, "completed")
+        flapping = self._set_status(flapping, "cancelled")
+        self._set_status(flapping, "completed")
+        self._pending(earlier, (0, 5))  # pending в сводки не попадает
+
+        incremental = self._rollups()
+        self.assertTrue(incremental)
+        rebuild_rollups()
+        self.assertEqual(incremental, self._rollups())
+
+    def test_orders_around_local_midnight(self):
+        midnight = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        before, after = midnight - timedelta(minutes=1), midnight + timedelta(minutes=1)
+        # По UTC оба заказа в одних сутках (Ташкент — UTC+5).
+        self.assertEqual(before.astimezone(dt_timezone.utc).date(), after.astimezone(dt_timezone.utc).date())
+
+        for created_at, qty in ((before, 1), (after, 2)):
+            self._set_status(self._pending(created_at, (0, qty)), "completed")
+
+        for check in ("incremental", "rebuild"):
+            if check == "rebuild":
+                rebuild_rollups()
+            with self.subTest(check=check):
+                hours = [timezone.localtime(h) for h in SalesRollup.objects.values_list("hour", flat=True)]
+                self.assertEqual(
+                    [(h.date(), h.hour) for h in hours],
+                    [(before.date(), 23), (after.date(), 0)],
+                )
+                labels, values = sales_series(days=5, granularity="day")
+                self.assertEqual(labels, [f"{before:%Y-%m-%d}", f"{after:%Y-%m-%d}"])
+                self.assertEqual(values, [1.25, 2.5])
+
+
+class ProductPhotoVariantsTests(TestCase):
+    """
+    Производные фото используются, только если построены из текущего файла.
+    """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.product = Product.objects.create(
+            category=Category.objects.create(name="Фото"), name="С фото", price=1,
+        )
+
+    def _set_photo(self, name, data):
+        self.product.photo.save(name, ContentFile(data), save=True)
+        self.product.refresh_from_db()
+
+    def _jpeg(self, color="red"):
+        buf = io.BytesIO()
+        Image.new("RGB", (64, 48), color).save(buf, "JPEG")
+        return buf.getvalue()
+
+    def test_variants_of_current_photo_are_used(self):
+        self._set_photo("first.jpg", self._jpeg())
+        urls = self.product.photo_urls
+        self.assertTrue(urls["thumb"].endswith(".webp"))
+        self.assertIn(urls["card"], self.product.photo_srcset)
+
+    def test_replaced_photo_without_variants_falls_back_to_original(self):
+        self._set_photo("first.jpg", self._jpeg())
+        # Битый файл: производные не строятся (OSError глушит сигнал),
+        # в photo_variants остаётся карта прежнего фото.
+        self._set_photo("second.jpg", b"not an image")
+        self.assertTrue(self.product.photo_variants["source"].startswith("products/first"))
+
+        urls = self.product.photo_urls
+        self.assertEqual(set(urls.values()), {self.product.photo.url})
+        self.assertEqual(self.product.photo_srcset, "")
+
+    def test_shared_variants_survive_other_product_photo_change(self):
+        # Как после импорта: у двух товаров один и тот же файл фото.
+        self._set_photo("a.jpg", self._jpeg())
+        other = Product.objects.create(
+            category=self.product.category, name="Тоже с фото", price=1,
+            photo=self.product.photo.name,
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.photo_variants, self.product.photo_variants)
+
+        self._set_photo("b.jpg", self._jpeg("blue"))
+
+        storage = other.photo.storage
+        for size in ("thumb", "card", "detail"):
+            self.assertTrue(storage.exists(other.photo_variants[size]), size)
+            self.assertNotEqual(self.product.photo_variants[size], other.photo_variants[size])
+
+    def test_unshared_variants_are_deleted_on_photo_change(self):
+        self._set_photo("a.jpg", self._jpeg())
+        old = self.product.photo_variants
+        self._set_photo("b.jpg", self._jpeg("blue"))
+
+        storage = self.product.photo.storage
+        for size in ("thumb", "card", "detail"):
+            self.assertFalse(storage.exists(old[size]), size)
+
+
+class RatingTests(TestCase):
+    """
+    Инкрементальные rating_avg/rating_count совпадают с полным пересчётом
+    после отзыва, смены оценки, удаления и переноса отзыва в админке.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("moderator", password="secret")
+        category = Category.objects.create(name="Оценки")
+        cls.product = Product.objects.create(category=category, name="Оцениваемый", price=10)
+        cls.other = Product.objects.create(category=category, name="Соседний", price=10)
+        cls.buyers = [User.objects.create_user(f"critic{i}") for i in range(3)]
+        for buyer in cls.buyers:
+            order = Order.objects.create(user=buyer, total_price=20)
+            OrderItem.objects.create(order=order, product=cls.product, unit_price=10)
+            OrderItem.objects.create(order=order, product=cls.other, unit_price=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def _review(self, buyer, rating, product=None):
+        product = product or self.product
+        self.client.force_login(buyer)
+        response = self.client.post(reverse("add_review", args=[product.pk]), {"rating": rating})
+        self.assertEqual(response.status_code, 302)
+
+    def _assert_matches_recompute(self, product):
+        product.refresh_from_db()
+        incremental = (product.rating_avg, product.rating_count)
+        recompute_product_rating(product.pk)
+        product.refresh_from_db()
+        self.assertAlmostEqual(incremental[0], product.rating_avg)
+        self.assertEqual(incremental[1], product.rating_count)
+        return incremental
+
+    def test_created_reviews(self):
+        for buyer, rating in zip(self.buyers, (5, 4, 2)):
+            self._review(buyer, rating)
+        avg, count = self._assert_matches_recompute(self.product)
+        self.assertAlmostEqual(avg, 11 / 3)
+        self.assertEqual(count, 3)
+
+    def test_changed_rating(self):
+        for buyer, rating in zip(self.buyers, (5, 4, 2)):
+            self._review(buyer, rating)
+        self._review(self.buyers[2], 5)
+        self._review(self.buyers[0], 1)
+        avg, count = self._assert_matches_recompute(self.product)
+        self.assertAlmostEqual(avg, 10 / 3)
+        self.assertEqual(count, 3)
+
+    def test_admin_delete_and_reassign(self):
+        for buyer, rating in zip(self.buyers, (5, 4, 2)):
+            self._review(buyer, rating)
+        self._review(self.buyers[0], 3, product=self.other)
+
+        self.client.force_login(self.admin)
+        deleted = Review.objects.get(user=self.buyers[0], product=self.product)
+        response = self.client.post(
+            reverse("admin:app_review_delete", args=[deleted.pk]), {"post": "yes"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._assert_matches_recompute(self.product), (3.0, 2))
+
+        moved = Review.objects.get(user=self.buyers[1], product=self.product)
+        created_at = timezone.localtime(moved.created_at)
+        response = self.client.post(reverse("admin:app_review_change", args=[moved.pk]), {
+            "product": self.other.pk,
+            "user": moved.user_id,
+            "rating": moved.rating,
+            "text": moved.text,
+            "created_at_0": created_at.strftime("%Y-%m-%d"),
+            "created_at_1": created_at.strftime("%H:%M:%S"),
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self._assert_matches_recompute(self.product), (2.0, 1))
+        self.assertEqual(self._assert_matches_recompute(self.other), (3.5, 2))
+
+
+class PurchaseIndexTests(TestCase):
+    """
+    Страницы заказа проверяют «куплено/есть отзыв» через один запрос
+    индекса покупок, а не по запросу на позицию.
+    """
+
+    # Заказ, сессия, пользователь, индекс покупок, позиции с товарами
+    # и сводка корзины для шапки (кэш чистится перед каждым запросом).
+    QUERIES = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("shopper")
+        category = Category.objects.create(name="Покупки")
+        products = Product.objects.bulk_create(
+            Product(category=category, name=f"Товар {i}", price=1) for i in range(30)
+        )
+        cls.small = Order.objects.create(user=cls.user, total_price=1)
+        OrderItem.objects.create(order=cls.small, product=products[0], unit_price=1)
+        cls.large = Order.objects.create(user=cls.user, total_price=30)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=cls.large, product=p, unit_price=1) for p in products
+        )
+        # Половина позиций уже с отзывами.
+        Review.objects.bulk_create(Review(user=cls.user, product=p) for p in products[::2])
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_query_count_does_not_depend_on_order_size(self):
+        for name in ("order_success", "order_reviews"):
+            for order in (self.small, self.large):
+                with self.subTest(view=name, items=order.items.count()):
+                    cache.clear()
+                    with self.assertNumQueries(self.QUERIES):
+                        response = self.client.get(reverse(name, args=[order.pk]))
+                    self.assertEqual(response.status_code, 200)
+
+    def test_reviewed_products_are_marked(self):
+        response = self.client.get(reverse("order_reviews", args=[self.large.pk]))
+        info = response.context["products_info"]
+        self.assertEqual(len(info), 30)
+        self.assertEqual(sum(row["has_review"] for row in info), 15)
+
+        response = self.client.get(reverse("order_success", args=[self.large.pk]))
+        self.assertEqual(len(response.context["reviewable_products"]), 15)
+
+
+class StockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer")
+        category = Category.objects.create(name="Склад")
+        cls.limited = Product.objects.create(category=category, name="Редкий", price=10, stock=3)
+        cls.unlimited = Product.objects.create(category=category, name="Обычный", price=5)
+
+    def test_checkout_decrements_tracked_stock_only(self):
+        CartItem.objects.create(user=self.user, product=self.limited, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.unlimited, quantity=50)
+        create_order_from_cart(user=self.user)
+
+        self.limited.refresh_from_db()
+        self.unlimited.refresh_from_db()
+        self.assertEqual(self.limited.stock, 1)
+        self.assertIsNone(self.unlimited.stock)
+
+    def test_shortage_rolls_back_the_whole_order(self):
+        CartItem.objects.create(user=self.user, product=self.limited, quantity=4)
+        CartItem.objects.create(user=self.user, product=self.unlimited, quantity=1)
+        with self.assertRaises(OutOfStock) as ctx:
+            create_order_from_cart(user=self.user)
+
+        self.assertEqual(ctx.exception.product_ids, [self.limited.pk])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.limited.refresh_from_db()
+        self.assertEqual(self.limited.stock, 3)
+
+    def test_cancel_restores_stock(self):
+        CartItem.objects.create(user=self.user, product=self.limited, quantity=3)
+        order = create_order_from_cart(user=self.user)
+        order = Order.objects.get(pk=order.pk)
+        order.status = "cancelled"
+        order.save()
+
+        self.limited.refresh_from_db()
+        self.assertEqual(self.limited.stock, 3)
+
+
+class AdminStockTests(TestCase):
+    """
+    Админка не пишет остаток из формы: иначе сохранение перезаписывает
+    списания checkout, случившиеся после загрузки формы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("boss", password="secret")
+        cls.category = Category.objects.create(name="Админка")
+        cls.product = Product.objects.create(category=cls.category, name="Товар", price=10, stock=5)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:app_product_change", args=[self.product.pk])
+
+    def _form_data(self, **overrides):
+        data = {
+            "name": "Переименован",
+            "category": self.category.pk,
+            "description": "",
+            "external_id": "",
+            "price": "12.00",
+            "stock": "100",
+        }
+        data.update(overrides)
+        return data
+
+    def test_change_form_does_not_write_stock(self):
+        self.assertNotContains(self.client.get(self.url), 'name="stock"')
+        response = self.client.post(self.url, self._form_data())
+        self.assertEqual(response.status_code, 302)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.stock), ("Переименован", 5))
+
+    def test_save_keeps_concurrent_checkout_decrement(self):
+        model_admin = admin_site._registry[Product]
+        request = RequestFactory().post(self.url)
+        request.user = self.admin
+
+        stale = Product.objects.get(pk=self.product.pk)
+        form = model_admin.get_form(request, stale)(self._form_data(), instance=stale)
+        self.assertTrue(form.is_valid(), form.errors)
+        reserve_stock({self.product.pk: 2})  # checkout между загрузкой и сохранением
+        model_admin.save_model(request, form.save(commit=False), form, change=True)
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.stock), ("Переименован", 3))
+
+    def test_restock_action_adds_to_current_stock(self):
+        reserve_stock({self.product.pk: 4})
+        self.client.post(reverse("admin:app_product_changelist"), {
+            "action": "restock_action",
+            "_selected_action": [self.product.pk],
+            "apply": "1",
+            "quantity": 10,
+        })
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 11)
+
+    def test_initial_stock_is_set_on_add(self):
+        response = self.client.post(
+            reverse("admin:app_product_add"), self._form_data(name="Новый", stock="7"),
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Product.objects.get(name="Новый").stock, 7)
+
+
+class OrderExportTests(TestCase):
+    """
+    Выгрузка заказов: CSV и NDJSON читаются обратно, фильтры по периоду
+    (в локальных датах) и статусу, gzip, потоковый ответ админки.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("exporter", password="secret")
+        buyer = User.objects.create_user("buyer")
+        category = Category.objects.create(name="Выгрузка")
+        cls.kettle = Product.objects.create(category=category, name="Чайник, «Марс»", price=10)
+        cls.cup = Product.objects.create(category=category, name="Кружка", price=3)
+
+        def local(*args):
+            return timezone.make_aware(datetime(*args))
+
+        # 00:30 по Ташкенту 2 марта — ещё 1 марта по UTC.
+        cls.first = Order.objects.create(user=buyer, total_price=23, created_at=local(2026, 3, 2, 0, 30))
+        OrderItem.objects.create(order=cls.first, product=cls.kettle, quantity=2, unit_price=10)
+        OrderItem.objects.create(order=cls.first, product=cls.cup, quantity=1, unit_price=3)
+        cls.cancelled = Order.objects.create(
+            user=buyer, total_price=3, status="cancelled", created_at=local(2026, 3, 3, 12),
+        )
+        OrderItem.objects.create(order=cls.cancelled, product=cls.cup, quantity=1, unit_price=3)
+        cls.empty = Order.objects.create(total_price=0, created_at=local(2026, 3, 5, 9))
+
+    def _csv(self, qs, **kwargs):
+        data = b"".join(export_stream(qs, "csv", **kwargs)).decode("utf-8")
+        return list(csv.DictReader(io.StringIO(data)))
+
+    def _ndjson(self, qs, **kwargs):
+        data = b"".join(export_stream(qs, "ndjson", **kwargs)).decode("utf-8")
+        return [json.loads(line) for line in data.splitlines()]
+
+    def test_csv_has_a_row_per_item(self):
+        rows = self._csv(order_queryset(), chunk_size=1)
+        self.assertEqual(
+            [(int(r["order_id"]), r["product_name"], r["quantity"], r["line_total"]) for r in rows],
+            [
+                (self.first.pk, self.kettle.name, "2", "20.00"),
+                (self.first.pk, self.cup.name, "1", "3.00"),
+                (self.cancelled.pk, self.cup.name, "1", "3.00"),
+                (self.empty.pk, "", "", ""),
+            ],
+        )
+        self.assertEqual(rows[0]["user"], "buyer")
+        self.assertEqual(rows[0]["created_at"], "2026-03-02T00:30:00+05:00")
+
+    def test_ndjson_has_an_object_per_order(self):
+        records = self._ndjson(order_queryset(), chunk_size=2)
+        self.assertEqual([r["id"] for r in records], [self.first.pk, self.cancelled.pk, self.empty.pk])
+        first = records[0]
+        self.assertEqual(first["total_price"], "23.00")
+        self.assertEqual(
+            [(i["product_id"], i["quantity"], i["line_total"]) for i in first["items"]],
+            [(self.kettle.pk, 2, "20.00"), (self.cup.pk, 1, "3.00")],
+        )
+        self.assertEqual(records[2]["items"], [])
+        self.assertIsNone(records[2]["user"])
+
+    def test_period_and_status_filters(self):
+        def ids(**kwargs):
+            return [r["id"] for r in self._ndjson(order_queryset(**kwargs))]
+
+        self.assertEqual(ids(date_from=date(2026, 3, 2), date_to=date(2026, 3, 2)), [self.first.pk])
+        self.assertEqual(ids(date_to=date(2026, 3, 1)), [])
+        self.assertEqual(ids(date_from=date(2026, 3, 3)), [self.cancelled.pk, self.empty.pk])
+        self.assertEqual(ids(status="completed"), [self.first.pk, self.empty.pk])
+        self.assertEqual(ids(date_from=date(2026, 3, 3), status="cancelled"), [self.cancelled.pk])
+
+    def test_gzip_round_trip(self):
+        plain = b"".join(export_stream(order_queryset(), "ndjson"))
+        packed = b"".join(export_stream(order_queryset(), "ndjson", gzip=True))
+        self.assertEqual(gzip.decompress(packed), plain)
+
+    def test_admin_view_streams_attachment(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("admin:app_order_export"), {
+            "date_from": "2026-03-02", "date_to": "2026-03-05",
+            "status": "completed", "format": "csv", "gzip": "on",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="orders-20260302-20260305.csv.gz"',
+        )
+
+        data = gzip.decompress(b"".join(response.streaming_content)).decode("utf-8")
+        rows = list(csv.DictReader(io.StringIO(data)))
+        self.assertEqual({int(r["order_id"]) for r in rows}, {self.first.pk, self.empty.pk})
+
+    def test_admin_view_without_params_shows_form(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse("admin:app_order_export"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+        response = self.client.get(reverse("admin:app_order_export"), {
+            "date_from": "2026-03-05", "date_to": "2026-03-01", "format": "ndjson",
+        })
+        self.assertNotIsInstance(response, StreamingHttpResponse)
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """
+    Много одновременных checkout-ов одного товара: продано ровно столько,
+    сколько было, остаток не ушёл в минус, и ни один поток не упал
+    на блокировке — проигравшие получают OutOfStock.
+    """
+
+    BUYERS = 24
+    STOCK = 10
+
+    def _run_checkouts(self, quantity):
+        product = Product.objects.create(
+            category=Category.objects.create(name="Гонка"),
+            name="Последний",
+            price=1,
+            stock=self.STOCK,
+        )
+        buyers = [User.objects.create_user(f"racer{i}") for i in range(self.BUYERS)]
+        CartItem.objects.bulk_create([
+            CartItem(user=buyer, product=product, quantity=quantity) for buyer in buyers
+        ])
+
+        start = threading.Barrier(self.BUYERS)
+        outcomes = Counter()
+        lock = threading.Lock()
+
+        def checkout(buyer):
+            start.wait()
+            try:
+                create_order_from_cart(user=buyer)
+                outcome = "ok"
+            except OutOfStock:
+                outcome = "out_of_stock"
+            except Exception as exc:
+                outcome = type(exc).__name__
+            finally:
+                connection.close()
+            with lock:
+                outcomes[outcome] += 1
+
+        threads = [threading.Thread(target=checkout, args=(b,)) for b in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        self.assertFalse(any(t.is_alive() for t in threads), "checkout threads got stuck")
+
+        product.refresh_from_db()
+        return product, outcomes
+
+    def test_no_overselling_single_unit(self):
+        product, outcomes = self._run_checkouts(quantity=1)
+        self.assertEqual(outcomes, {"ok": self.STOCK, "out_of_stock": self.BUYERS - self.STOCK})
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+
+    def test_no_overselling_multi_unit(self):
+        product, outcomes = self._run_checkouts(quantity=3)
+        sold = self.STOCK // 3
+        self.assertEqual(outcomes, {"ok": sold, "out_of_stock": self.BUYERS - sold})
+        self.assertEqual(product.stock, self.STOCK - sold * 3)
+        self.assertEqual(
+            OrderItem.objects.filter(product=product).count(),
+            sold,
+        )
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """
+    Одновременные изменения одной корзины (клики из нескольких вкладок):
+    ни одно прибавление или убавление не теряется.
+    """
+
+    THREADS = 16
+    ROUNDS = 5
+
+    def setUp(self):
+        self.user = User.objects.create_user("tabs")
+        category = Category.objects.create(name="Вкладки")
+        self.products = [
+            Product.objects.create(category=category, name=f"Товар {i}", price=2)
+            for i in range(3)
+        ]
+
+    def _race(self, work):
+        start = threading.Barrier(self.THREADS)
+        results, failures = [], []
+        lock = threading.Lock()
+
+        def run(index):
+            start.wait()
+            try:
+                for _ in range(self.ROUNDS):
+                    result = work(index)
+                    with lock:
+                        results.append(result)
+            except Exception as exc:
+                with lock:
+                    failures.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        self.assertFalse(any(t.is_alive() for t in threads), "cart threads got stuck")
+        self.assertEqual(failures, [])
+        return results
+
+    def test_concurrent_adds_are_not_lost(self):
+        product = self.products[0]
+        self._race(lambda i: add_line(self.user.pk, None, product.pk, 1))
+
+        line = CartItem.objects.get(user=self.user, product=product)
+        self.assertEqual(line.quantity, self.THREADS * self.ROUNDS)
+
+    def test_concurrent_increase_and_decrease_cancel_out(self):
+        start_qty = self.THREADS * self.ROUNDS
+        item = CartItem.objects.create(user=self.user, product=self.products[1], quantity=start_qty)
+        self._race(lambda i: step_line(self.user.pk, None, item.pk, 1 if i % 2 else -1))
+
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, start_qty)
+
+    def test_decrement_to_zero_deletes_exactly_once(self):
+        start_qty = 10
+        item = CartItem.objects.create(user=self.user, product=self.products[2], quantity=start_qty)
+        results = self._race(lambda i: step_line(self.user.pk, None, item.pk, -1))
+
+        quantities = sorted(line.quantity for line in results if line is not None)
+        self.assertEqual(quantities, list(range(start_qty)))
+        self.assertFalse(CartItem.objects.filter(pk=item.pk).exists())
+
+    def test_guest_and_user_lines_stay_separate(self):
+        product = self.products[0]
+        self._race(lambda i: add_line(
+            self.user.pk if i % 2 else None, None if i % 2 else "guest-token", product.pk, 1,
+        ))
+
+        half = self.THREADS // 2 * self.ROUNDS
+        self.assertEqual(CartItem.objects.get(user=self.user, product=product).quantity, half)
+        self.assertEqual(
+            CartItem.objects.get(session_key="guest-token", user__isnull=True, product=product).quantity,
+            half,
+        )
@@ -0,0 +1,48 @@
+"""
+Версии данных для валидаторов (ETag / Last-Modified) и кэшей.
+
+Версия — это момент последнего изменения (time.time()), хранится в кэше
+default. Версии меняют и веб-воркеры, и management-команды, поэтому кэш
+обязан быть общим для всех процессов (проверка app.E001 в app/checks.py):
+с LocMemCache воркер не видит bump_version из команды и отдаёт устаревший 304.
+Если запись потеряна, версия инициализируется текущим временем: клиенты
+один раз получат полный ответ.
+"""
+import time
+
+from django.core.cache import cache
+
+
+CATALOG = "catalog"  # товары, категории, рейтинги, фото
+ORDERS = "orders"    # заказы и сводки продаж
+
+VERSION_TIMEOUT = None  # не истекает
+
+
+def _key(name):
+    return f"data_version:{name}"
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        version = time.time()
+        if not cache.add(_key(name), version, VERSION_TIMEOUT):
+            version = cache.get(_key(name), version)
+    return version
+
+
+def get_versions(*names):
+    keys = {_key(name): name for name in names}
+    found = cache.get_many(keys)
+    return tuple(
+        found[key] if key in found else get_version(keys[key])
+        for key in keys
+    )
+
+
+def bump_version(name):
+    # Строго больше прежней, даже если часы стоят на месте.
+    version = max(time.time(), (cache.get(_key(name)) or 0) + 1e-6)
+    cache.set(_key(name), version, VERSION_TIMEOUT)
+    return version
@@ -1,24 +1,34 @@
-from decimal import Decimal
-
 from django.contrib import messages
-from django.contrib.auth import authenticate, login, logout, get_user_model
+from django.contrib.auth import authenticate, logout, get_user_model
 from django.core.paginator import Paginator
-from django.db.models import Q, Avg, Sum
+from django.db.models import Sum
 from django.shortcuts import render, redirect, get_object_or_404
+from django.views.decorators.http import condition
 
-from .models import Product, CartItem, Category, Order, OrderItem, Review
-from .api_views import get_session_key
+from .models import Product, Order, OrderItem, Review
+from .analytics import available as analytics_available
+from .cart import cart_owner, cart_queryset, login_with_cart
+from .catalog import GRID_CACHE_TIMEOUT, build_catalog_queryset, grid_cache_key, ordered_categories
+from .conditional import index_etag, product_detail_etag
+from .facets import catalog_facets
+from .purchases import get_purchase_index
+from .querybudget import query_budget
+from .ratings import apply_review_changed, apply_review_created
+from .recommendations import recommended_products
+from .versions import CATALOG, get_version
 
 
 User = get_user_model()
 
 
+@query_budget(max_queries=3)
 def welcome_view(request):
     if request.user.is_authenticated:
         return redirect("index")
     return render(request, "welcome.html")
 
 
+@query_budget(max_queries=15)
 def register_view(request):
     if request.user.is_authenticated:
         return redirect("index")
@@ -42,13 +52,14 @@ def register_view(request):
 
         if not errors:
             user = User.objects.create_user(username=username, password=password1)
-            login(request, user)
+            login_with_cart(request, user)
             messages.success(request, "Регистрация прошла успешно!")
             return redirect("index")
 
     return render(request, "register.html", {"errors": errors})
 
 
+@query_budget(max_queries=15)
 def login_view(request):
     if request.user.is_authenticated:
         return redirect("index")
@@ -62,129 +73,78 @@ def login_view(request):
         if user is None:
             errors.append("Неверное имя пользователя или пароль.")
         else:
-            login(request, user)
-            session_key = get_session_key(request)
-            guest_items = CartItem.objects.filter(
-                session_key=session_key,
-                user__isnull=True,
-            )
-            for item in guest_items:
-                existing = CartItem.objects.filter(
-                    user=user,
-                    product=item.product,
-                ).first()
-                if existing:
-                    existing.quantity += item.quantity
-                    existing.save()
-                    item.delete()
-                else:
-                    item.user = user
-                    item.session_key = None
-                    item.save()
-
+            login_with_cart(request, user)
             messages.success(request, "Вы успешно вошли!")
             return redirect("index")
 
     return render(request, "login.html", {"errors": errors})
 
 
+@query_budget(max_queries=6)
 def logout_view(request):
     logout(request)
     messages.info(request, "Вы вышли из аккаунта.")
     return redirect("welcome")
 
 
+@query_budget(max_queries=8)
+@condition(etag_func=index_etag)
 def index_view(request):
     if not request.user.is_authenticated:
         return redirect("welcome")
 
-    products = Product.objects.all().select_related("category")
-    categories = Category.objects.all().order_by("name")
-
-    search_query = request.GET.get("q", "").strip()
-    min_price = request.GET.get("min_price") or ""
-    max_price = request.GET.get("max_price") or ""
-    sort = request.GET.get("sort") or "new"
-    category_id = request.GET.get("category")
-
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
-
-    if min_price:
-        try:
-            products = products.filter(price__gte=Decimal(min_price))
-        except Exception:
-            pass
-
-    if max_price:
-        try:
-            products = products.filter(price__lte=Decimal(max_price))
-        except Exception:
-            pass
-
-    active_category = None
-    if category_id:
-        try:
-            active_category = int(category_id)
-            products = products.filter(category_id=active_category)
-        except ValueError:
-            active_category = None
-
-    if sort == "price_asc":
-        products = products.order_by("price")
-    elif sort == "price_desc":
-        products = products.order_by("-price")
-    else:
-        products = products.order_by("-created_at")
+    products, filters = build_catalog_queryset(
+        request.GET,
+        Product.objects.all().select_related("category"),
+    )
+    categories = ordered_categories(filters["sort"])
+    facets = catalog_facets(filters, categories)
 
     paginator = Paginator(products, 12)
+    # Размер выборки уже посчитан фасетами — без отдельного COUNT.
+    paginator.count = facets["total"]
     page_number = request.GET.get("page")
     page_obj = paginator.get_page(page_number)
 
     context = {
         "categories": categories,
+        "facets": facets,
         "page_obj": page_obj,
-        "active_category": active_category,
-        "search_query": search_query,
-        "min_price": min_price,
-        "max_price": max_price,
-        "current_sort": sort,
+        "active_category": filters["category"],
+        "search_query": filters["search_query"],
+        "min_price": filters["min_price"],
+        "max_price": filters["max_price"],
+        "current_sort": filters["sort"],
+        # Сетка кэшируется общим фрагментом; cart_count и прочее
+        # персональное рендерится вне его (base.html).
+        "catalog_version": get_version(CATALOG),
+        "grid_cache_key": grid_cache_key(filters, page_obj.number),
+        "grid_cache_timeout": GRID_CACHE_TIMEOUT,
         "title": "Каталог",
     }
     return render(request, "index.html", context)
 
 
+@query_budget(max_queries=7)
+@condition(etag_func=product_detail_etag)
 def product_detail_view(request, pk):
     product = get_object_or_404(Product, pk=pk)
     reviews = Review.objects.filter(product=product).select_related("user")
-    avg_rating = reviews.aggregate(avg=Avg("rating"))["avg"]
 
-    can_review = False
-    if request.user.is_authenticated:
-        has_order = OrderItem.objects.filter(
-            order__user=request.user,
-            order__status="completed",
-            product=product,
-        ).exists()
-        already_reviewed = Review.objects.filter(
-            user=request.user,
-            product=product,
-        ).exists()
-        can_review = has_order and not already_reviewed
+    can_review = get_purchase_index(request).can_review(product.pk)
 
     context = {
         "product": product,
         "reviews": reviews,
-        "avg_rating": round(avg_rating, 1) if avg_rating else None,
+        "recommended": recommended_products(product.pk),
+        "avg_rating": round(product.rating_avg, 1) if product.rating_count else None,
         "can_review": can_review,
         "title": product.name,
     }
     return render(request, "product_detail.html", context)
 
 
+@query_budget(max_queries=12)
 def add_review_view(request, pk):
     product = get_object_or_404(Product, pk=pk)
 
@@ -192,12 +152,7 @@ def add_review_view(request, pk):
         messages.error(request, "Сначала войдите в аккаунт.")
         return redirect("login")
 
-    has_order = OrderItem.objects.filter(
-        order__user=request.user,
-        order__status="completed",
-        product=product,
-    ).exists()
-    if not has_order:
+    if not get_purchase_index(request).has_bought(product.pk):
         messages.error(request, "Вы можете оставить отзыв только после покупки товара.")
         return redirect("product_detail", pk=pk)
 
@@ -211,10 +166,14 @@ def add_review_view(request, pk):
             product=product,
             defaults={"rating": rating, "text": text},
         )
-        if not created:
+        if created:
+            apply_review_created(product.pk, rating)
+        else:
+            old_rating = review.rating
             review.rating = rating
             review.text = text
             review.save()
+            apply_review_changed(product.pk, old_rating, rating)
 
         messages.success(request, "Спасибо за отзыв!")
         return redirect("product_detail", pk=pk)
@@ -225,15 +184,9 @@ def add_review_view(request, pk):
     })
 
 
+@query_budget(max_queries=5)
 def cart_view(request):
-    if request.user.is_authenticated:
-        items = CartItem.objects.filter(user=request.user).select_related("product")
-    else:
-        session_key = get_session_key(request)
-        items = CartItem.objects.filter(
-            session_key=session_key,
-            user__isnull=True,
-        ).select_related("product")
+    items = cart_queryset(*cart_owner(request)).select_related("product")
 
     cart_total = sum(i.total_price for i in items)
 
@@ -244,20 +197,18 @@ def cart_view(request):
     })
 
 
+@query_budget(max_queries=7)
 def order_success_view(request, order_id):
     order = get_object_or_404(Order, id=order_id)
 
     can_review_any = False
     reviewable_products = []
 
-    if request.user.is_authenticated and order.user == request.user:
+    if request.user.is_authenticated and order.user_id == request.user.pk:
+        index = get_purchase_index(request)
         items = OrderItem.objects.filter(order=order).select_related("product")
         for item in items:
-            has_review = Review.objects.filter(
-                user=request.user,
-                product=item.product,
-            ).exists()
-            if not has_review:
+            if not index.has_reviewed(item.product_id):
                 can_review_any = True
                 reviewable_products.append(item.product)
 
@@ -270,6 +221,7 @@ def order_success_view(request, order_id):
     return render(request, "order_success.html", context)
 
 
+@query_budget(max_queries=7)
 def order_reviews_view(request, order_id):
 
     if not request.user.is_authenticated:
@@ -284,16 +236,13 @@ def order_reviews_view(request, order_id):
         .select_related("product")
     )
 
+    index = get_purchase_index(request)
     products_info = []
     for it in items:
-        has_review = Review.objects.filter(
-            user=request.user,
-            product=it.product,
-        ).exists()
         products_info.append({
             "product": it.product,
             "quantity": it.quantity,
-            "has_review": has_review,
+            "has_review": index.has_reviewed(it.product_id),
         })
 
     context = {
@@ -304,6 +253,7 @@ def order_reviews_view(request, order_id):
     return render(request, "order_reviews.html", context)
 
 
+@query_budget(max_queries=6)
 def admin_dashboard_view(request):
     total_orders = Order.objects.filter(status="completed").count()
     total_revenue = Order.objects.filter(status="completed").aggregate(
@@ -315,6 +265,7 @@ def admin_dashboard_view(request):
         "total_orders": total_orders,
         "total_revenue": total_revenue,
         "total_users": total_users,
+        "analytics_enabled": analytics_available() and request.user.is_staff,
         "title": "Админский дашборд",
     }
     return render(request, "admin_dashboard.html", context)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -26,9 +27,11 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
+    "app.querybudget.QueryBudgetMiddleware",
 
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
+    "app.guests.GuestCartMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
@@ -60,6 +63,35 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # BEGIN IMMEDIATE: пишущие транзакции встают в очередь за блокировкой
+            # (до timeout секунд), а не падают с "database is locked", когда
+            # две транзакции сначала читают, а потом обе хотят писать.
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        # Файловая тестовая БД: in-memory с shared cache не ждёт блокировок,
+        # а конкурентным тестам (app/tests.py) нужно именно ожидание.
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
+    }
+}
+
+# Общий для всех процессов кэш: в нём версии данных (app/versions.py),
+# фрагменты каталога и сводки корзин. Команды (import_products,
+# refresh_popularity, ...) и воркеры gunicorn — разные процессы, поэтому
+# LocMemCache не годится (проверка app.E001 в app/checks.py). На одном
+# хосте хватает файлового кэша; на нескольких — Redis:
+#     {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+#      "LOCATION": "redis://127.0.0.1:6379/1"}
+# SHOP_CACHE_DIR переносит файловый кэш в другой каталог (тесты так
+# изолируют свой кэш от кэша запущенного магазина).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("SHOP_CACHE_DIR") or BASE_DIR / "cache",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
     }
 }
 
@@ -86,6 +118,36 @@ REST_FRAMEWORK = {
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Нативные async-вьюхи корзины и checkout (app/async_api_views.py).
+# Имеет смысл при запуске под ASGI (uvicorn project.asgi:application).
+ASYNC_CART_API = False
+
+# Каталог с картинками для импорта товаров из админки (app/importer.py).
+# Команда import_products принимает его через --images.
+PRODUCT_IMPORT_IMAGES_DIR = None
+
+# Колоночный снимок заказов для /api/analytics/ (app/analytics.py).
+# Обновляется командой refresh_analytics_snapshot; нужен NumPy.
+ANALYTICS_SNAPSHOT_DIR = BASE_DIR / "analytics"
+
+# Бюджеты SQL-запросов на вьюху (app/querybudget.py).
+QUERY_BUDGET = {
+    "MAX_QUERIES": 30,
+    "MAX_DUPLICATES": 5,
+    "RAISE": False,
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "app.querybudget": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
+
 LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "index"
 LOGOUT_REDIRECT_URL = "login"
@@ -41,78 +41,165 @@ async function parseJsonResponse(response) {
     return json;
 }
 
-// Добавить в корзину
-async function addToCart(productId) {
+// ===== Пакетные изменения корзины =====
+// Клики копятся CART_FLUSH_DELAY мс, склеиваются и уходят одним
+// запросом в /api/cart/batch/. Пакеты отправляются строго по очереди.
+const CART_FLUSH_DELAY = 300;
+let pendingOps = [];
+let pendingWaiters = [];
+let flushTimer = null;
+let inflight = Promise.resolve(null);
+
+function queueCartOp(op) {
+    const last = pendingOps[pendingOps.length - 1];
+    if (op.op === 'add' && last && last.op === 'add' && last.product_id === op.product_id) {
+        last.qty += op.qty;
+    } else {
+        if (op.op === 'set') {
+            // set задаёт итог — прежние операции с этим товаром не нужны.
+            pendingOps = pendingOps.filter(o => o.product_id !== op.product_id);
+        }
+        pendingOps.push(op);
+    }
+
+    clearTimeout(flushTimer);
+    flushTimer = setTimeout(flushCartOps, CART_FLUSH_DELAY);
+    return new Promise(resolve => pendingWaiters.push(resolve));
+}
+
+function flushCartOps(keepalive = false) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+    if (!pendingOps.length) {
+        return inflight;
+    }
+    const ops = pendingOps;
+    const waiters = pendingWaiters;
+    pendingOps = [];
+    pendingWaiters = [];
+
+    inflight = inflight
+        .then(() => sendCartOps(ops, keepalive))
+        .then(data => {
+            waiters.forEach(resolve => resolve(data));
+            return data;
+        });
+    return inflight;
+}
+
+async function sendCartOps(ops, keepalive) {
     try {
-        const res = await fetch('/api/cart/add/', {
+        const res = await fetch('/api/cart/batch/', {
             method: 'POST',
+            keepalive: keepalive,
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': csrftoken
             },
-            body: JSON.stringify({ product_id: productId, qty: 1 })
+            body: JSON.stringify({ ops: ops })
         });
         const data = await parseJsonResponse(res);
         if (data.error) {
             showToast("Ошибка: " + data.error);
-            return;
+            return null;
         }
-        showToast("Товар добавлен в корзину");
+        applyCartState(data);
+        return data;
     } catch (e) {
         console.error(e);
         showToast("Ошибка сети");
+        return null;
     }
 }
 
-// Изменить количество
-async function changeQty(itemId, action) {
-    try {
-        const res = await fetch('/api/cart/update_qty/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrftoken
-            },
-            body: JSON.stringify({ item_id: itemId, action: action })
-        });
-        const data = await parseJsonResponse(res);
-        if (data.error) {
-            showToast("Ошибка: " + data.error);
+function hasPendingOp(productId) {
+    return pendingOps.some(o => o.product_id === productId);
+}
+
+// Ответ сервера — источник истины; строки с ещё не отправленными
+// кликами не трогаем, чтобы число не «прыгало».
+function applyCartState(data) {
+    const badge = document.getElementById('cart-count');
+    if (badge) {
+        badge.innerText = data.cart_count;
+        badge.classList.toggle('hidden', !data.cart_count);
+    }
+
+    const totalEl = document.getElementById('cart-total');
+    if (!totalEl) {
+        return;
+    }
+    totalEl.innerText = data.cart_total.toFixed(2);
+
+    const present = new Set();
+    data.items.forEach(item => {
+        present.add(String(item.product_id));
+        if (hasPendingOp(item.product_id)) {
             return;
         }
+        const qtyEl = document.getElementById('qty-' + item.product_id);
+        const lineEl = document.getElementById('line-total-' + item.product_id);
+        if (qtyEl) qtyEl.innerText = item.quantity;
+        if (lineEl) lineEl.innerText = item.line_total.toFixed(2);
+    });
+    document.querySelectorAll('[data-cart-line]').forEach(row => {
+        if (!present.has(row.dataset.cartLine) && !hasPendingOp(Number(row.dataset.cartLine))) {
+            row.remove();
+        }
+    });
+    if (!data.items.length) {
         window.location.href = "/cart/";
-    } catch (e) {
-        console.error(e);
-        showToast("Ошибка сети");
     }
 }
 
+// Отправить накопленное, если страницу закрывают раньше таймера.
+window.addEventListener('pagehide', () => flushCartOps(true));
+
+// Добавить в корзину
+let addToastQueued = false;
+
+async function addToCart(productId) {
+    const result = queueCartOp({ op: 'add', product_id: productId, qty: 1 });
+    if (addToastQueued) {
+        return;
+    }
+    addToastQueued = true;
+    const data = await result;
+    addToastQueued = false;
+    if (data) {
+        showToast("Товар добавлен в корзину");
+    }
+}
+
+// Изменить количество (страница корзины): число меняется сразу,
+// на сервер уходит итоговое значение.
+function changeQty(productId, action) {
+    const qtyEl = document.getElementById('qty-' + productId);
+    const current = qtyEl ? parseInt(qtyEl.innerText, 10) || 0 : 0;
+    const qty = Math.max(0, current + (action === 'increase' ? 1 : -1));
+    if (qtyEl) {
+        qtyEl.innerText = qty;
+    }
+    if (qty === 0) {
+        const row = document.querySelector(`[data-cart-line="${productId}"]`);
+        if (row) row.classList.add('opacity-50');
+    }
+    queueCartOp({ op: 'set', product_id: productId, qty: qty });
+}
+
 // Очистить корзину
 async function clearCart() {
-    try {
-        const res = await fetch('/api/cart/clear/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrftoken
-            },
-            body: JSON.stringify({})
-        });
-        const data = await parseJsonResponse(res);
-        if (data.error) {
-            showToast("Ошибка: " + data.error);
-            return;
-        }
+    queueCartOp({ op: 'clear' });
+    const data = await flushCartOps();
+    if (data) {
         showToast("Корзина очищена");
-        window.location.href = "/cart/";
-    } catch (e) {
-        console.error(e);
-        showToast("Ошибка сети");
     }
 }
 
 // Оформить заказ
 async function checkout() {
+    // Сначала — клики, которые ещё не ушли.
+    await flushCartOps();
     try {
         const res = await fetch('/api/orders/create/', {
             method: 'POST',
@@ -123,6 +210,10 @@ async function checkout() {
             body: JSON.stringify({})
         });
         const data = await parseJsonResponse(res);
+        if (data.error === 'out of stock') {
+            showToast("Недостаточно товара на складе");
+            return;
+        }
         if (data.error) {
             showToast("Ошибка: " + data.error);
             return;
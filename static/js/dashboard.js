@@ -207,7 +207,85 @@ function initAdminDashboard() {
         } catch (e) {
             console.error("Ошибка загрузки статистики (админка):", e);
         }
+
+        loadAdminAnalytics(currentDays);
     }
 
     loadCharts();
 }
+
+/* =========================
+   АНАЛИТИКА ПО СНИМКУ (АДМИНКА)
+   ========================= */
+let basketChart = null;
+
+function fillRows(tbody, rows) {
+    tbody.innerHTML = "";
+    rows.forEach((cells) => {
+        const tr = document.createElement("tr");
+        cells.forEach((value) => {
+            const td = document.createElement("td");
+            td.className = "py-1 pr-3";
+            td.textContent = value;
+            tr.appendChild(td);
+        });
+        tbody.appendChild(tr);
+    });
+}
+
+function percent(value) {
+    return (value * 100).toFixed(1) + "%";
+}
+
+async function loadAdminAnalytics(days) {
+    if (!document.getElementById("adminAnalytics")) return;
+
+    try {
+        const [baskets, revenue, categories, cohorts] = await Promise.all([
+            fetchJson(`/api/analytics/baskets/?days=${days}`),
+            fetchJson(`/api/analytics/revenue/?days=${days}`),
+            fetchJson(`/api/analytics/categories/?days=${days}`),
+            fetchJson(`/api/analytics/cohorts/?months=12`)
+        ]);
+
+        const basketCanvas = document.getElementById("adminBasketChart");
+        if (basketCanvas) {
+            const data = baskets.results;
+            if (basketChart) {
+                basketChart.data.labels = data.labels;
+                basketChart.data.datasets[0].data = data.orders;
+                basketChart.update();
+            } else {
+                basketChart = new Chart(basketCanvas.getContext("2d"), {
+                    type: "bar",
+                    data: {
+                        labels: data.labels,
+                        datasets: [{ label: "Заказов", data: data.orders }]
+                    },
+                    options: {
+                        responsive: true,
+                        scales: { y: { beginAtZero: true } }
+                    }
+                });
+            }
+        }
+
+        const rev = revenue.results;
+        fillRows(document.getElementById("adminRevenuePercentiles"), [
+            ["Заказов", rev.count],
+            ["Выручка, ₽", rev.revenue],
+            ["Средний чек, ₽", rev.mean],
+            ...Object.entries(rev.percentiles).map(([p, v]) => [`p${p}, ₽`, v])
+        ]);
+
+        fillRows(document.getElementById("adminCategoryMix"), categories.results.map((row) => [
+            row.name || `#${row.category_id}`, row.revenue, row.units, percent(row.share)
+        ]));
+
+        fillRows(document.getElementById("adminCohorts"), cohorts.results.cohorts.map((row) => [
+            row.month, row.size, ...row.retention.map(percent)
+        ]));
+    } catch (e) {
+        console.error("Ошибка загрузки аналитики (админка):", e);
+    }
+}